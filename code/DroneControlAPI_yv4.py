@@ -5,16 +5,42 @@ import cv2
 import os
 import numpy as np
 import json
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 #from inference_img import Yolov4
 #from yolov3_inference import *
 from grid_coverage import covered_area, reset_grid
-from yolov4_inference import Yolov4
+
+def response_to_numpy(response):
+    """
+    Convert an uncompressed Scene ImageResponse to a (height, width, 3) uint8 array
+    (size 0 if AirSim returned an empty image)
+    """
+    img1d = np.frombuffer(response.image_data_uint8, dtype=np.uint8).copy() # get numpy array
+    return img1d.reshape(response.height, response.width, 3)
+
+# One drone's state, read once per step by DroneControl.getTelemetry.
+# position/orientation: simGetObjectPose (UE4 frame), kinematics: spawn-relative kinematics_estimated,
+# distances: the readings of the requested distance sensors as a float array
+Telemetry = namedtuple('Telemetry', ['position', 'orientation', 'kinematics', 'has_collided', 'distances'])
+
+def quaternion_to_yaw(q):
+    t3 = +2.0 * (q.w_val * q.z_val + q.x_val * q.y_val)
+    t4 = +1.0 - 2.0 * (q.y_val * q.y_val + q.z_val * q.z_val)
+    return math.atan2(t3, t4)
 
 class DroneControl:
-    def __init__(self, droneList, drone_id=0, inference=True):
-        self.client = airsim.MultirotorClient('127.0.0.1')
+    def __init__(self, droneList, drone_id=0, inference=True, ip='127.0.0.1', port=41451, pool_size=0):
+        self.client = airsim.MultirotorClient(ip, port)
         self.client.confirmConnection()
         self.droneList = droneList
+        # pool_size > 0: the per-drone calls go over pool_size more connections (drone i on i % pool_size,
+        # len(droneList): one per drone) and dispatch runs per-drone work in parallel threads
+        self.pool_size = pool_size
+        self.pool = [airsim.MultirotorClient(ip, port) for _ in range(pool_size)]
+        self.pool_locks = [threading.Lock() for _ in self.pool]
+        self.dispatcher = ThreadPoolExecutor(max_workers=len(droneList)) if pool_size else None
         self.init_AirSim()
         self.image_dir = './captured_images/human_1/'
         self.target = 'human_1'
@@ -22,10 +48,38 @@ class DroneControl:
         self.z_offset = self.get_spawn_z_offset(self.droneList[drone_id])
         self.inference = inference
         if self.inference:
+            # darknet is only needed (and importable) when running detection
+            from yolov4_inference import Yolov4
             self.yolo = Yolov4()
             #yolo_weights = 'data/drone.h5'
             #self.infer_model = YoloPredictor(yolo_weights)
     
+    def vehicle_client(self, drone):
+        """
+        Method to get the client of a drone's calls: its pooled connection, or the shared one
+        """
+        if not self.pool:
+            return self.client
+        return self.pool[self.droneList.index(drone) % len(self.pool)]
+
+    def dispatch(self, fn, drones, *args):
+        """
+        Method to run fn(drone, *per-drone args) for each drone, like map, in
+        parallel threads when there is a connection pool (else one drone
+        after the other). fn must only make calls for its own drone; drones
+        sharing a pooled connection take turns on it.
+        Returns the results in the order of drones
+        """
+        if self.dispatcher is None:
+            return list(map(fn, drones, *args))
+        futures = [self.dispatcher.submit(self.run_drone, fn, drone, *drone_args)
+                   for drone, *drone_args in zip(drones, *args)]
+        return [future.result() for future in futures]
+
+    def run_drone(self, fn, drone, *args):
+        with self.pool_locks[self.droneList.index(drone) % len(self.pool)]:
+            return fn(drone, *args)
+
     def init_AirSim(self):
         """
         Method to initialize AirSim for a list of drones
@@ -41,6 +95,8 @@ class DroneControl:
         self.armDisarm(False)
         self.client.reset()
         self.enableApiControl(False)
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown()
     
     def resetAndRearm_Drones(self):
         """
@@ -83,7 +139,7 @@ class DroneControl:
         Method to get current drone states
         """
         if drone in self.droneList:
-            return self.client.getMultirotorState(vehicle_name=drone)
+            return self.vehicle_client(drone).getMultirotorState(vehicle_name=drone)
         else:
             print('Drone does not exists!')
     
@@ -130,10 +186,37 @@ class DroneControl:
         Method to get Distance data
         """
         if drone in self.droneList:
-            return self.client.getDistanceSensorData(distance_sensor_name=dist_sensor, vehicle_name=drone)
+            return self.vehicle_client(drone).getDistanceSensorData(distance_sensor_name=dist_sensor, vehicle_name=drone)
         else:
             print('Drone does not exists!')
 
+    def getDistanceDataArray(self, dist_sensors, drones=None):
+        """
+        Method to read the distance sensors of several drones (default: all)
+        in one pass. All the requests are sent before any reply is awaited.
+        Returns a (len(drones), len(dist_sensors)) float32 array of distances
+        """
+        drones = self.droneList if drones is None else drones
+        futures = [[self.vehicle_client(drone).client.call_async('getDistanceSensorData', dist_sensor, drone)
+                    for dist_sensor in dist_sensors] for drone in drones]
+        distances = np.empty((len(drones), len(dist_sensors)), dtype=np.float32)
+        for i, row in enumerate(futures):
+            for j, future in enumerate(row):
+                distances[i, j] = future.get()['distance']
+        return distances
+
+    def getTelemetry(self, drone, dist_sensors=(), distances=None):
+        """
+        Method to read the pose, kinematics, collision and distance sensors
+        of a drone in one pass (collision comes with the multirotor state)
+        distances: the drone's row of getDistanceDataArray, if already read
+        """
+        pose = self.vehicle_client(drone).simGetObjectPose(drone)
+        state = self.vehicle_client(drone).getMultirotorState(vehicle_name=drone)
+        if distances is None:
+            distances = self.getDistanceDataArray(dist_sensors, [drone])[0]
+        return Telemetry(pose.position, pose.orientation, state.kinematics_estimated, state.collision.has_collided, distances)
+
     def getLidarData(self, lidar, drone):
         """
         Method to get lidar data
@@ -180,13 +263,13 @@ class DroneControl:
         """
         Pass-through method to get collision info
         """
-        return self.client.simGetCollisionInfo(drone)
+        return self.vehicle_client(drone).simGetCollisionInfo(drone)
     
     def hoverAsync(self, drone):
         """
         Pass-through method for hoverAsync
         """
-        return self.client.hoverAsync(drone)
+        return self.vehicle_client(drone).hoverAsync(drone)
 
     def setCameraHeading(self, camera_heading, drone):
         """
@@ -204,7 +287,7 @@ class DroneControl:
     
     def setCameraAngle(self, camera_angle, drone, cam="0"):
         camera_pose = airsim.Pose(airsim.Vector3r(0, 0, 0), airsim.to_quaternion(math.radians(camera_angle[0]), math.radians(camera_angle[1]), math.radians(camera_angle[2]))) #radians
-        self.client.simSetCameraPose(cam, camera_pose, vehicle_name=drone)
+        self.vehicle_client(drone).simSetCameraPose(cam, camera_pose, vehicle_name=drone)
 
     def getImage(self, drone, cam=0):
         """
@@ -260,6 +343,9 @@ class DroneControl:
             self.yolo.display(bbox, img_rgb)
 
     def predict_yv4(self, img_rgb):
+        if not self.inference:
+            # no detector loaded: report no detection
+            return None
         bbox = self.yolo.predict(img_rgb)
         if bbox == None:
             return None
@@ -277,12 +363,18 @@ class DroneControl:
         pass
 
     def captureImgNumpy(self, drone, cam = 0):
-        responses = self.client.simGetImages([airsim.ImageRequest(
+        responses = self.vehicle_client(drone).simGetImages([airsim.ImageRequest(
             cam, airsim.ImageType.Scene, False, False)],vehicle_name=drone)  # scene vision image in png format
-        response = responses[0]
-        img1d = np.fromstring(response.image_data_uint8, dtype=np.uint8) # get numpy array
-        img_rgb = img1d.reshape(response.height, response.width, 3)
-        return img_rgb
+        return response_to_numpy(responses[0])
+
+    def captureImgsNumpy(self, drone, camList):
+        """
+        Get the images of several cameras of a drone with one simGetImages RPC
+        Returns one image per camera, of size 0 where AirSim returned an empty image.
+        """
+        requests = [airsim.ImageRequest(cam, airsim.ImageType.Scene, False, False) for cam in camList]
+        responses = self.vehicle_client(drone).simGetImages(requests, vehicle_name=drone)
+        return [response_to_numpy(response) for response in responses]
 
     def turnDroneBySelfFrame(self, drone, turn_spd, duration):
         """
@@ -312,32 +404,46 @@ class DroneControl:
         Method to move drone with indicated velocity
         velocity = [x_val, y_val, z_val]
         """
-        self.client.moveByVelocityBodyFrameAsync(vehicle_name=drone, 
+        self.moveDroneBySelfFrameAsync(drone, velocity, duration).join()
+
+    def moveDroneBySelfFrameAsync(self, drone, velocity, duration):
+        """
+        Non-blocking moveDroneBySelfFrame, returns the future to join
+        """
+        return self.vehicle_client(drone).moveByVelocityBodyFrameAsync(vehicle_name=drone, 
                                              vx=velocity[0], 
                                              vy=velocity[1], 
                                              vz=velocity[2],
-                                             duration=duration).join()
+                                             duration=duration)
 
     # moveToPositionAsync(self, x, y, z, velocity, timeout_sec = 3e+38, drivetrain = DrivetrainType.MaxDegreeOfFreedom, yaw_mode = YawMode(),
     #    lookahead = -1, adaptive_lookahead = 1, vehicle_name = '')
     def moveDroneToPos(self, drone, position):
         z = position[2]-self.z_offset
-        self.client.moveToPositionAsync(vehicle_name=drone,
+        self.vehicle_client(drone).moveToPositionAsync(vehicle_name=drone,
                                         x=position[0], y=position[1], z=z, velocity=1, timeout_sec=60, 
                                         drivetrain=airsim.DrivetrainType.MaxDegreeOfFreedom, 
                                         yaw_mode=airsim.YawMode(True, 0)).join()
 
-    def changeDroneAlt(self, drone, altitude):
+    def changeDroneAlt(self, drone, altitude, pos=None):
+        self.changeDroneAltAsync(drone, altitude, pos).join()
+
+    def changeDroneAltAsync(self, drone, altitude, pos=None):
+        """
+        Non-blocking changeDroneAlt, returns the future to join
+        pos: the current spawn-relative position if already known (e.g. Telemetry.kinematics.position)
+        """
         ## getMultirotorState use the spawn coordinate rather than global coordinate from UE4, use offset to translate from UE4 to spawn coordinate (settings.json)
-        pos = self.getMultirotorState(drone).kinematics_estimated.position
+        if pos is None:
+            pos = self.getMultirotorState(drone).kinematics_estimated.position
         #print("init_alt:", pos.z_val)
         #print("z_offset:", self.z_offset)
         z = altitude-self.z_offset
         #print("z:",z)
-        self.client.moveToPositionAsync(vehicle_name=drone,
+        return self.vehicle_client(drone).moveToPositionAsync(vehicle_name=drone,
                                         x=pos.x_val, y=pos.y_val, z=z, velocity=1, timeout_sec=60, 
                                         drivetrain=airsim.DrivetrainType.MaxDegreeOfFreedom, 
-                                        yaw_mode=airsim.YawMode(True, 0)).join()
+                                        yaw_mode=airsim.YawMode(True, 0))
 
     def check_pos_from_spawn(self, drone):
         pos = self.getMultirotorState(drone).kinematics_estimated.position
@@ -351,19 +457,13 @@ class DroneControl:
         return pos
 
     def getYawDeg(self, drone):
-        pos = self.client.simGetObjectPose(drone)
-        w = pos.orientation.w_val
-        x = pos.orientation.x_val
-        y = pos.orientation.y_val
-        z = pos.orientation.z_val
-        t3 = +2.0 * (w * z + x * y)
-        t4 = +1.0 - 2.0 * (y * y + z * z)
-        yaw = math.atan2(t3, t4)
+        pos = self.vehicle_client(drone).simGetObjectPose(drone)
+        yaw = quaternion_to_yaw(pos.orientation)
         #print("yaw: ", yaw*180/math.pi)
         return yaw
 
     def getDronePosition(self, drone):
-        pos = self.client.simGetObjectPose(drone).position
+        pos = self.vehicle_client(drone).simGetObjectPose(drone).position
         return pos
 
     def getSettingsString(self):
@@ -379,10 +479,14 @@ class DroneControl:
         print("Z_offset:", z)
         return float(z)
     
-    def testAreaCoverage(self, drone, camList, cam_shifted_angle):
+    def testAreaCoverage(self, drone, camList, cam_shifted_angle, telemetry=None):
         #print("Drone: ", drone)
-        pos = self.client.simGetObjectPose(drone).position
-        yaw = self.getYawDeg(drone)
+        if telemetry is None:
+            pos = self.client.simGetObjectPose(drone).position
+            yaw = self.getYawDeg(drone)
+        else:
+            pos = telemetry.position
+            yaw = quaternion_to_yaw(telemetry.orientation)
 
         reward = covered_area(pos.x_val, pos.y_val, yaw, camList, cam_shifted_angle)
         #print("pos.x and y: ", pos.x_val, pos.y_val)
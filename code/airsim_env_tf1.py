@@ -1,11 +1,9 @@
-import airsim
 import numpy as np
 import config
-from geopy import distance
-from DroneControlAPI_yv4 import DroneControl
+from collision_monitor import CollisionMonitor
 
 import time
-import itertools
+import asyncio
 
 clockspeed = 1
 timeslice = 0.5 / clockspeed
@@ -47,32 +45,107 @@ speed_limit = 0.2
 ACTION = ['00', '+x', '+y', '+rz', '-x', '-y', '-rz']
 
 droneList = ['Drone0', 'Drone1', 'Drone2']
+camList = [0, 1, 2, 4]
+# initial [pitch, roll, yaw] of the cameras, by camera ID
+camera_angles = {0: [-50, 0, 0], 1: [-50, 0, 90], 2: [-50, 0, -90], 3: [-50, 0, 0], 4: [-50, 0, 0]}
 yolo_weights = 'data/drone.h5'
 
+# per-drone status codes: whether the target was detected and, if so, whether it is in the focus box
+EXIST_NONE, EXIST_MISS, EXIST_FOUND = 0, 1, 2
+FOCUS_NONE, FOCUS_IN, FOCUS_OUT = 0, 1, 2
+EXIST_STATUS = ['none', 'miss', 'found']
+FOCUS_STATUS = ['none', 'in', 'out']
+
+def status_reward_table():
+    '''
+    Base reward of a drone while the episode runs, indexed by its
+    [exist code, focus code]
+    '''
+    table = np.full((len(EXIST_STATUS), len(FOCUS_STATUS)), config.reward['none'], dtype=float)
+    table[EXIST_MISS, :] = config.reward['miss']
+    table[EXIST_FOUND, FOCUS_IN] = config.reward['in']
+    table[EXIST_FOUND, FOCUS_OUT] = config.reward['out']
+    return table
+
 class Env:
-    def __init__(self):
-        # connect to the AirSim simulator
-        self.dc = DroneControl(droneList)
+    def __init__(self, ip='127.0.0.1', port=41451, inference=True, batch_capture=True, concurrent_motion=False,
+                 telemetry=True, monitor_rate=0., monitor_debounce=None, sim='airsim', num_drone=len(droneList),
+                 camList=camList, async_rpc=False, rpc_pool=0, verbose=True):
+        # the fleet: Drone0..Drone<num_drone-1>, as named in settings.json
+        self.droneList = ['Drone%d' % i for i in range(num_drone)]
+        # the per-step prints (rewards, flags, positions); off, their arguments are not even formatted
+        self.log = print if verbose else lambda *args: None
+        self.camList = list(camList)
+        if sim == 'kinematic':
+            # headless stand-in: no AirSim needed, sim time instead of wall-clock time
+            from kinematic_sim import KinematicDroneControl
+            self.dc = KinematicDroneControl(self.droneList, inference=inference)
+            self.clock, self.sleep = self.dc.clock, self.dc.sleep
+        else:
+            # connect to the AirSim simulator
+            from DroneControlAPI_yv4 import DroneControl
+            self.dc = DroneControl(self.droneList, inference=inference, ip=ip, port=port, pool_size=rpc_pool)
+            self.clock, self.sleep = time.monotonic, time.sleep
+        if async_rpc and sim != 'airsim':
+            raise ValueError('async_rpc needs the AirSim RPC server, not sim=%s' % sim)
+        if rpc_pool and sim != 'airsim':
+            raise ValueError('rpc_pool needs the AirSim RPC server, not sim=%s' % sim)
+        # rpc_pool connections to AirSim: each drone's capture, motion and sensor reads in its own thread
+        self.rpc_pool = rpc_pool
+        # step through step_async: all the requests of a phase in flight on one asyncio connection
+        self.async_rpc = async_rpc
+        self.ip, self.port = ip, port
+        # the AsyncDroneControl of step_async and the event loop step runs it in, created on first use
+        self.adc = None
+        self.loop = None
+        # fetch all cameras of a drone with one simGetImages RPC instead of one per camera
+        self.batch_capture = batch_capture
+        # move all drones at once and settle without sleeping, instead of one drone after the other
+        self.concurrent_motion = concurrent_motion
+        # read pose, kinematics, collision and distance sensors once per drone per step, instead of per use
+        self.telemetry_snapshot = telemetry
+        # snapshot taken when the sim was last paused (None: not taken)
+        self.telemetry = None
+        self.dsensors = ["Distance" + str(i) for i in range(1,dsensor_num+1)]
+        # collision / landing checks during the settle window. monitor_rate=0 (the default) is the original
+        # loop: polls back to back, collided after 11 polls seen collided or landed, landed as last read.
+        # monitor_rate > 0 polls that many times per second, with both flags debounced over monitor_debounce polls
+        debounce_landed = monitor_rate > 0
+        if sim == 'kinematic' and monitor_rate == 0:
+            # sim time only advances in sleep, so back to back polls would never end the window. The 11 polls
+            # take about 0.11 s at the rate they reach against a local AirSim: check every 0.1 s of sim time
+            # instead, flagged after 2 checks
+            monitor_rate = 10.
+            if monitor_debounce is None:
+                monitor_debounce = 2
+        if monitor_debounce is None:
+            monitor_debounce = 11 if monitor_rate == 0 else 3
+        self.monitor = CollisionMonitor(self.dc, self.droneList, rate=monitor_rate, debounce=monitor_debounce, floor_z=floorZ,
+                                        debounce_landed=debounce_landed, clock=self.clock, sleep=self.sleep)
 
         self.action_size = 3
         self.altitude = -8
         #self.altitude = -2.5
         self.init_pos = [0,0,self.altitude]
-        self.camList = [0,1,2,4]
         #self.camera_angle = [-50, 0, 0]
-        self.camera_angle = [[-50, 0, 90], [-50, 0, -90], [-50, 0, 0], [-50, 0, 0]] 
-        self.best_area = [0, 0, 0]
+        self.camera_angle = self.initial_camera_angle()
+        self.best_area = np.zeros(len(self.droneList))
+        self.reward_table = status_reward_table()
+        # first detection box (x, y, w, h) of every camera in the last step, nan where none (or not run)
+        self.detections = self.no_detections()
 
         # initialize gps origin for distance calculation
         self.gps_origin = []
-        for drone in droneList:
+        for drone in self.droneList:
             gps = self.dc.getGpsData(drone)
             self.gps_origin.append((gps.latitude, gps.longitude))
 
     def capture_state_image(self):
+        if self.batch_capture:
+            return self.capture_state_image_batched()
         # all of the drones take image.
         responses = []
-        for drone in droneList:
+        for drone in self.droneList:
             response = []
             for camID in self.camList:
                 while True:
@@ -81,49 +154,99 @@ class Env:
                     if img.size != 0:
                         #print("ImageCaptured!")
                         break
-                    print("Img is None.")
+                    self.log("Img is None.")
                 response.append(img)
             responses.append(response)
         return responses
 
+    def capture_state_image_batched(self):
+        # all of the drones take image, one RPC per drone for all of its cameras (the drones in parallel with rpc_pool).
+        return self.dc.dispatch(self.capture_drone, self.droneList)
+
+    def capture_drone(self, drone):
+        response = [None] * len(self.camList)
+        pending = list(range(len(self.camList)))
+        # request again only the cameras that returned an empty image
+        while pending:
+            imgs = self.dc.captureImgsNumpy(drone, [self.camList[i] for i in pending])
+            retry = []
+            for i, img in zip(pending, imgs):
+                if img.size != 0:
+                    response[i] = img
+                else:
+                    self.log("Img is None.")
+                    retry.append(i)
+            pending = retry
+        return response
+
     def capture_state_dist_gps(self):
         # get drone distance from origin using GPS position.
+        from geopy import distance
         drone_dist = []
-        for id, drone in enumerate(droneList):
+        for id, drone in enumerate(self.droneList):
             gps = self.dc.getGpsData(drone)
             gps_drone = (gps.latitude, gps.longitude)
             dist = distance.distance(self.gps_origin[id], gps_drone).m
             drone_dist.append(dist)
-            print("Drone distance from origin: ", dist)
+            self.log("Drone distance from origin: ", dist)
         return np.array(drone_dist)
 
     def capture_state_dist_imu(self):
         # Alternative way of getting drone distance from origin using IMU position.
         drone_dist = []
-        for drone in droneList:
+        for drone in self.droneList:
             pos = self.dc.getDronePosition(drone)
             # distance from origin to drone
             dist = np.linalg.norm([pos.x_val, pos.y_val])
             drone_dist.append(dist)
-            print("Drone distance from origin: ", dist)
+            self.log("Drone distance from origin: ", dist)
         return np.array(drone_dist)
 
-    def capture_state_position(self):
+    def capture_state_position(self, telemetry=None):
         drone_pos = []
-        for drone in droneList:
-            pos = self.dc.getDronePosition(drone)
+        for id, drone in enumerate(self.droneList):
+            if telemetry is None:
+                pos = self.dc.getDronePosition(drone)
+            else:
+                pos = telemetry[id].position
             drone_pos += [pos.x_val, pos.y_val, pos.z_val]
         return np.array(drone_pos)
 
+    def initial_camera_angle(self):
+        # [pitch, roll, yaw] of each camera of camList, shared by the drones
+        return np.array([camera_angles.get(cam, [-50, 0, 0]) for cam in self.camList], dtype=float)
+
+    def set_camera_angles(self, drone):
+        for angle, cam in zip(self.camera_angle, self.camList):
+            self.dc.setCameraAngle(angle, drone, cam=str(cam))
+
+    def no_detections(self):
+        return np.full((len(self.droneList), len(self.camList), 4), np.nan, dtype=np.float32)
+
+    def capture_telemetry(self, dist_sensors=()):
+        if not self.telemetry_snapshot:
+            return None
+        if self.rpc_pool:
+            return self.dc.dispatch(self.dc.getTelemetry, self.droneList, [dist_sensors] * len(self.droneList))
+        distances = self.dc.getDistanceDataArray(dist_sensors)
+        return [self.dc.getTelemetry(drone, distances=distances[id]) for id, drone in enumerate(self.droneList)]
+
+    def current_position(self, id):
+        # spawn-relative position of a paused drone from the last snapshot (None: read it), for the
+        # concurrent moves, which all start from the paused state
+        if self.telemetry is None:
+            return None
+        return self.telemetry[id].kinematics.position
+
 
     def capture_state_speed(self):
         quad_spd = []
-        for drone in droneList:
+        for drone in self.droneList:
             quad_vel = self.dc.getMultirotorState(drone).kinematics_estimated.linear_velocity
             quad_vel_vec = [quad_vel.x_val, quad_vel.y_val, quad_vel.z_val]
             quad_spd_val = np.linalg.norm(quad_vel_vec)
             quad_spd.append(quad_spd_val)
-            print("Drone speed: ", quad_spd_val)
+            self.log("Drone speed: ", quad_spd_val)
         return quad_spd
 
     def nested_list_to_list(self, responses):
@@ -132,38 +255,38 @@ class Env:
         for imglist in responses:
             for img in imglist:
                 obs_responses.append(img) 
-        print("obs_responses len: ", len(obs_responses)) 
+        self.log("obs_responses len: ", len(obs_responses)) 
         return obs_responses
 
     def reset(self):
         '''
         Method to reset AirSim env to starting position
         '''
-        print("RESET")
+        self.log("RESET")
         self.dc.resetAndRearm_Drones()
         self.dc.reset_area()
-        self.best_area = [0, 0, 0]
+        self.best_area = np.zeros(len(self.droneList))
+        self.detections = self.no_detections()
 
         # all drones takeoff
         self.dc.simPause(False)
-        for drone in droneList:
-            print(f'{drone} taking off...')
+        for drone in self.droneList:
+            self.log(f'{drone} taking off...')
             #self.dc.moveDrone(drone, [0,0,-1], 2 * timeslice)
             #self.dc.moveDrone(drone, [0,0,0], 0.1 * timeslice)
             self.dc.moveDroneToPos(drone, self.init_pos)
             self.dc.hoverAsync(drone).join()
             #self.camera_angle = [-50, 0, 0]
-            self.camera_angle = [[-50, 0, 90], [-50, 0, -90], [-50, 0, 0], [-50, 0, 0]] 
-            self.dc.setCameraAngle(self.camera_angle[0], drone, cam="1")
-            self.dc.setCameraAngle(self.camera_angle[1], drone, cam="2")
-            self.dc.setCameraAngle(self.camera_angle[2], drone, cam="4")
-            self.dc.setCameraAngle(self.camera_angle[3], drone, cam="0")
+            self.camera_angle = self.initial_camera_angle()
+            self.set_camera_angles(drone)
             
         # Initial image capturing by drones
         responses = self.capture_state_image()
 
+        self.telemetry = self.capture_telemetry()
+
         # get drone distance from origin using GPS position.
-        drone_dist = self.capture_state_position()
+        drone_dist = self.capture_state_position(self.telemetry)
 
         # convert responses from nested list into list. Used all of the images captured by drones.
         obs_responses = self.nested_list_to_list(responses)  
@@ -172,7 +295,11 @@ class Env:
         return observation
 
     def step(self, quad_offset_list):
-        print("STEP")
+        if self.async_rpc:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+            return self.loop.run_until_complete(self.step_async(quad_offset_list))
+        self.log("STEP")
         # move with given velocity
         quad_offset = []
         for qoffset in quad_offset_list: # [(xyz),(xyz),(xyz)]
@@ -180,97 +307,14 @@ class Env:
         self.dc.simPause(False)
         
         # Move the drones
-        cam_shifted = [0,0,0]
-        for id, drone in enumerate(droneList):
-            self.dc.changeDroneAlt(drone, -8)
+        if self.concurrent_motion:
+            cam_shifted = self.move_drones_concurrent(quad_offset)
+        else:
+            cam_shifted = self.move_drones(quad_offset)
 
-            # if quad_offset has length of 3, run continuous action.
-            if len(quad_offset[id]) == 3:
-                self.dc.moveDroneBySelfFrame(drone, [quad_offset[id][0],quad_offset[id][1],0], 5*timeslice) # 2*timeslice 
-                self.stabilize(drone)
-                self.camera_angle[0][2] += quad_offset[id][2]*angle_spd
-                self.camera_angle[1][2] += quad_offset[id][2]*angle_spd
-                self.camera_angle[2][2] += quad_offset[id][2]*angle_spd
-                self.camera_angle[3][2] += quad_offset[id][2]*angle_spd
-                self.dc.setCameraAngle(self.camera_angle[0], drone, cam="1")
-                self.dc.setCameraAngle(self.camera_angle[1], drone, cam="2")
-                self.dc.setCameraAngle(self.camera_angle[2], drone, cam="4")
-                self.dc.setCameraAngle(self.camera_angle[3], drone, cam="0")
-
-                cam_shifted[id] = quad_offset[id][2]*angle_spd
-
-            # else run discrete action.
-            else:
-                # front or back
-                if quad_offset[id][3] == 1 or quad_offset[id][3] == 4:
-                    self.dc.moveDroneBySelfFrame(drone, [quad_offset[id][0],0,0], 5*timeslice) # 2*timeslice 
-                    self.stabilize(drone)
-                    #self.dc.changeDroneAlt(drone, -8)
-                # left or right
-                elif quad_offset[id][3] == 2 or quad_offset[id][3] == 5:
-                    #self.dc.turnDroneBySelfFrame(drone, quad_offset[id][1]*angle_spd, 5*timeslice) # 2*timeslice
-                    self.dc.moveDroneBySelfFrame(drone, [0,quad_offset[id][1],0], 5*timeslice) # 2*timeslice 
-                    self.stabilize(drone)
-                    #self.dc.changeDroneAlt(drone, -8)
-                # cam left or right
-                elif quad_offset[id][3] == 3 or quad_offset[id][3] == 6:
-                    #self.camera_angle[2] += quad_offset[id][2]*angle_spd
-                    #self.dc.setCameraAngle(self.camera_angle, drone)
-                    self.camera_angle[0][2] += quad_offset[id][2]*angle_spd
-                    self.camera_angle[1][2] += quad_offset[id][2]*angle_spd
-                    self.camera_angle[2][2] += quad_offset[id][2]*angle_spd
-                    self.camera_angle[3][2] += quad_offset[id][2]*angle_spd
-                    self.dc.setCameraAngle(self.camera_angle[0], drone, cam="1")
-                    self.dc.setCameraAngle(self.camera_angle[1], drone, cam="2")
-                    self.dc.setCameraAngle(self.camera_angle[2], drone, cam="4")
-                    self.dc.setCameraAngle(self.camera_angle[3], drone, cam="0")
-
-                    cam_shifted[id] = quad_offset[id][2]*angle_spd
-
-                # top and bottom
-                # elif quad_offset[id][3] == 3 or quad_offset[id][3] == 6:
-                #     self.dc.moveDroneBySelfFrame(drone, [0,0,quad_offset[id][2]], 2* timeslice)
-                #     self.stabilize(drone)
-                # for stop action quad_offset[id][3] == 0 
-                else:
-                    pass 
-
-                # print("camera_angle_action:", self.camera_angle[0][2])
-                # print("camera_angle_action:", self.camera_angle[1][2])
-                # print("camera_angle_action:", self.camera_angle[2][2])
-                # print("camera_angle_action:", self.camera_angle[3][2])
-
-                #self.dc.moveDrone(drone, [quad_offset[id][0], quad_offset[id][1], quad_offset[id][2]], 2* timeslice)
-
-        # Get follower drones position and linear velocity        
-        landed = [False, False, False]
-        collided = [False, False, False]
-        has_collided = [False, False, False]
-        collision_count = [0, 0, 0]
-
-        start_time = time.time()
-        while time.time() - start_time < timeslice:
-            # get quadrotor states
-            quad_pos = []
-            quad_vel = []
-            for drone in droneList:
-                #quad_pos.append(self.dc.getMultirotorState(drone).kinematics_estimated.position)
-                quad_pos.append(self.dc.getDronePosition(drone))
-                quad_vel.append(self.dc.getMultirotorState(drone).kinematics_estimated.linear_velocity)
-
-            # decide whether collision occured
-            for id, drone in enumerate(droneList):
-                collided[id] = self.dc.simGetCollisionInfo(drone).has_collided
-                land = (quad_vel[id].x_val == 0 and quad_vel[id].y_val == 0 and quad_vel[id].z_val == 0)
-                landed[id] = land or quad_pos[id].z_val > floorZ
-                collision = collided[id] or landed[id]
-                if collision:
-                    collision_count[id] += 1
-                if collision_count[id] > 10:
-                    has_collided[id] = True
-                    break
-            if any(has_collided):
-                break
+        # Watch follower drones position and linear velocity for collision or landing
+        has_collided = self.monitor.watch(timeslice)
+        landed = self.monitor.landed
 
         self.dc.simPause(True)
         #time.sleep(1)
@@ -278,42 +322,112 @@ class Env:
         # all of the drones take image
         responses = self.capture_state_image()
 
+        # the sim is paused: read the drones' state once for the rest of the step and the next moves
+        self.telemetry = self.capture_telemetry(self.dsensors)
+        return self.outcome(responses, cam_shifted, has_collided, landed)
+
+    async def step_async(self, quad_offset_list):
+        '''
+        Method to step on the asyncio client (async_dc): the requests of each
+        phase (moves and camera poses, the collision polls, then the
+        captures, poses and distance sensors of every drone) are in flight
+        together. The drones move concurrently and the state is read into a
+        telemetry snapshot. All calls must run in the same event loop
+        '''
+        self.log("STEP")
+        adc = await self.async_dc()
+        quad_offset = [[float(i) for i in qoffset] for qoffset in quad_offset_list]
+        await adc.simPause(False)
+
+        # Move the drones
+        cam_shifted, hovers = await self.move_drones_async(adc, quad_offset)
+
+        # Watch follower drones position and linear velocity for collision or landing, all drones per poll
+        has_collided = await self.monitor.watch_async(
+            timeslice, lambda: asyncio.gather(*[adc.getTelemetry(drone) for drone in self.droneList]))
+        landed = self.monitor.landed
+        await asyncio.gather(*hovers)
+
+        await adc.simPause(True)
+
+        # all of the drones take image, and the drones' state is read, at once
+        responses, self.telemetry = await self.capture_async(adc)
+        return self.outcome(responses, cam_shifted, has_collided, landed)
+
+    async def async_dc(self):
+        if self.adc is None:
+            from async_rpc import AsyncDroneControl
+            self.adc = await AsyncDroneControl(self.droneList, self.ip, self.port, self.dc.z_offset).connect()
+        return self.adc
+
+    async def capture_async(self, adc):
+        # the images and the telemetry snapshot of all drones, requested together
+        responses, telemetry = await asyncio.gather(
+            asyncio.gather(*[self.capture_drone_async(adc, drone) for drone in self.droneList]),
+            asyncio.gather(*[adc.getTelemetry(drone, self.dsensors) for drone in self.droneList]))
+        return list(responses), list(telemetry)
+
+    async def capture_drone_async(self, adc, drone):
+        # one drone's cameras with one simGetImages request, again for those that returned an empty image
+        response = [None] * len(self.camList)
+        pending = list(range(len(self.camList)))
+        while pending:
+            imgs = await adc.captureImgsNumpy(drone, [self.camList[i] for i in pending])
+            retry = []
+            for i, img in zip(pending, imgs):
+                if img.size != 0:
+                    response[i] = img
+                else:
+                    self.log("Img is None.")
+                    retry.append(i)
+            pending = retry
+        return response
+
+    async def move_drones_async(self, adc, quad_offset):
+        # move_drones_concurrent on the asyncio client; returns the hover tasks to await after the collision window
+        plans = [self.plan_motion(qoffset) for qoffset in quad_offset]
+        cam_shifted, angles = self.turn_camera_angles(plans)
+        await asyncio.gather(*[adc.changeDroneAlt(drone, -8, self.current_position(id))
+                               for id, drone in enumerate(self.droneList)])
+        commands = [adc.moveDroneBySelfFrame(drone, velocity, 5*timeslice)
+                    for drone, (velocity, _) in zip(self.droneList, plans) if velocity is not None]
+        for drone, angle in zip(self.droneList, angles):
+            if angle is not None:
+                commands += [adc.setCameraAngle(cam_angle, drone, cam) for cam_angle, cam in zip(angle, self.camList)]
+        await asyncio.gather(*commands)
+        return cam_shifted, [asyncio.ensure_future(adc.hover(drone))
+                             for drone, (velocity, _) in zip(self.droneList, plans) if velocity is not None]
+
+    def outcome(self, responses, cam_shifted, has_collided, landed):
+        '''
+        Method to compute the observation, reward, done and info of a step
+        from the images, and the telemetry snapshot (if taken) of the drones
+        after their move
+        '''
+        telemetry = self.telemetry
+
         # get drone distance from origin using GPS position.
         #drone_dist = self.capture_state_dist_gps()
-        drone_dist = self.capture_state_position()
+        drone_dist = self.capture_state_position(telemetry)
 
-        # get drone position from IMU 
-        drone_pos = []
-        for drone in droneList:
-            drone_pos.append(self.dc.getDronePosition(drone)) 
+        # get drone position from IMU, one (x, y, z) row per drone
+        positions = drone_dist.reshape(-1, 3)
 
         # calculate the gaps distance between drones, and determine the spread reward.
-        spread_reward = 'far'
-        pos_comb = itertools.combinations(drone_pos, 2)
-        drone_spread = 0
-        for com in pos_comb:
-            drone_spread = np.linalg.norm([com[0].x_val - com[1].x_val, com[0].y_val - com[1].y_val])
-            if drone_spread <= spread_thd:
-                spread_reward = 'near'
-                break
-        # determine spread reward 
-        # if total_spread <= spread_thd:
-        #     spread_reward = 'near'
-        print('spread_reward: ', spread_reward)
+        spread_reward = self.check_spread(positions)
+        self.log('spread_reward: ', spread_reward)
 
         # penalty for distance sensor
-        dsensor_reward = [False, False, False]
-        for id, drone in enumerate(droneList):
-            for i in range(1,dsensor_num+1):
-                dsensor = "Distance" + str(i)
-                dist_sensor = self.dc.getDistanceData(dsensor, drone).distance
-                if dist_sensor <= dsensor_thrd:
-                    dsensor_reward[id] = True
-                    break
+        if telemetry is None:
+            dist_sensors = self.dc.getDistanceDataArray(self.dsensors)
+        else:
+            dist_sensors = np.stack([t.distances for t in telemetry])
+        # a drone is penalized if any of its sensors is within dsensor_thrd
+        dsensor_reward = np.any(dist_sensors <= dsensor_thrd, axis=1)
             #print("dist_sensor: ", dist_sensor)
-        print("dsensor_reward: ", dsensor_reward)
+        self.log("dsensor_reward: ", dsensor_reward)
         # quad_spd = [] 
-        # for drone in droneList:
+        # for drone in self.droneList:
         #     quad_vel = self.dc.getMultirotorState(drone).kinematics_estimated.linear_velocity
         #     quad_vel_vec = [quad_vel.x_val, quad_vel.y_val, quad_vel.z_val]
         #     quad_spd_val = np.linalg.norm(quad_vel_vec)
@@ -321,11 +435,13 @@ class Env:
         #     print("drone speed: ", quad_spd_val)
         
         # Get image reward from drones
-        exist_reward = {}
-        focus_reward = {}
+        # the status codes of a drone are those of its last camera checked
+        exist_reward = np.full(len(self.droneList), EXIST_NONE, dtype=np.int8)
+        focus_reward = np.full(len(self.droneList), FOCUS_NONE, dtype=np.int8)
         #size_reward = {}
-        success = [False, False, False]
-        for id, drone in enumerate(droneList):
+        success = np.zeros(len(self.droneList), dtype=bool)
+        self.detections = self.no_detections()
+        for id, drone in enumerate(self.droneList):
             for camid in range(len(self.camList)):
                 img = responses[id][camid]
                 #try:
@@ -333,20 +449,18 @@ class Env:
                     
                 # if no detection is found, where bbox is [0,0,0,0].
                 if bboxes == [] or bboxes == None:
-                    exist_status = 'miss'
-                    exist_reward[id] = exist_status
-                    focus_status = 'none' 
-                    focus_reward[id] = focus_status
+                    exist_reward[id] = EXIST_MISS
+                    focus_reward[id] = FOCUS_NONE
                     #size_status = 'none'
                     #size_reward[id] = size_status
                 # if there is detection found in image.
                 else:
                     bbox = bboxes[0] # get first detection only
-                    exist_status = 'found'
-                    exist_reward[id] = exist_status
+                    self.detections[id, camid] = bbox[2]
+                    exist_reward[id] = EXIST_FOUND
 
                     focus_status = self.check_focus(bbox, img)
-                    focus_reward[id] = focus_status
+                    focus_reward[id] = FOCUS_IN if focus_status == 'in' else FOCUS_OUT
 
                     #size_status = self.check_size(bbox, img)
                     #size_reward[id] = size_status
@@ -359,48 +473,36 @@ class Env:
                     #break
 
             #print(f'Drone[{id}] status: [{exist_status}], [{focus_status}], [{size_status}]')
-        print("Success: ", success)
+        self.log("Success: ", success)
 
         # Get area reward from drones
-        area_reward = {}
-        for id, drone in enumerate(droneList):
-            #print("cam_shifted: ", cam_shifted[id])
-            cal_reward = self.dc.testAreaCoverage(drone, self.camList, cam_shifted[id])
-            if cal_reward > self.best_area[id]:
-                self.best_area[id] = cal_reward 
-                area_reward[id] = self.best_area[id]
-            else:
-                # no point is given if the drone does not move to new area
-                area_reward[id] = 0
-        print("area_reward_best:", area_reward)
+        area = np.array([self.dc.testAreaCoverage(drone, self.camList, cam_shifted[id],
+                                                  None if telemetry is None else telemetry[id])
+                         for id, drone in enumerate(self.droneList)])
+        # no point is given if the drone does not move to new area
+        improved = area > self.best_area
+        self.best_area = np.where(improved, area, self.best_area)
+        area_reward = np.where(improved, area, 0.)
+        self.log("area_reward_best:", area_reward)
+
         # decide if episode should be terminated
-        done = False
+        out_range, out_small_range = self.check_range(positions)
+        self.log("drone_pos z_val: ", positions[:, 2])
+        self.log("has_collided: ", has_collided)
+        self.log("out_range: ", out_range)
+        self.log("out_small_range: ", out_small_range)
 
-        # fly below min height or above max height
-        out_range = [False, False, False]
-        out_small_range = [False, False, False]
-        for id, drone in enumerate(droneList):
-            if drone_pos[id].x_val > max_small_x or drone_pos[id].x_val < min_small_x or drone_pos[id].y_val > max_small_y or drone_pos[id].y_val < min_small_y: 
-                out_small_range[id] = True
-            print("drone_pos[id].z_val: ", drone_pos[id].z_val)
-            if drone_pos[id].z_val > min_height or drone_pos[id].z_val < max_height or drone_pos[id].x_val > max_x or drone_pos[id].x_val < min_x or drone_pos[id].y_val > max_y or drone_pos[id].y_val < min_y: 
-                out_range[id] = True
-
-        print("has_collided: ", has_collided)
-        print("out_range: ", out_range)
-        print("out_small_range: ", out_small_range)
-
-        # done if 2 targets are found
-        done = any(has_collided) or any(out_range) or sum(success) == target_num    
+        # done if target_num targets are found
+        done = self.check_done(has_collided, out_range, success)
 
         # compute reward
         reward = self.compute_reward(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success, out_small_range, done)
 
         # log info
         loginfo = []
-        for id, drone in enumerate(droneList):
+        for id, drone in enumerate(self.droneList):
             info = {}
-            info['Z'] = drone_pos[id].z_val
+            info['Z'] = float(positions[id, 2])
             if landed[id]:
                 info['status'] = 'landed'
             elif has_collided[id]:
@@ -409,11 +511,11 @@ class Env:
                 info['status'] = 'dead'
             elif success[id] == True:
                 info['status'] = 'success'   
-            elif exist_reward[id] == 'found':
+            elif exist_reward[id] == EXIST_FOUND:
                 info['status'] = 'found_out'
             elif any(dsensor_reward):
                 info['status'] = 'dsensor_close'     
-            elif exist_reward[id] == 'miss':
+            elif exist_reward[id] == EXIST_MISS:
                 info['status'] = 'miss'
             else:
                 info['status'] = 'none'
@@ -425,11 +527,127 @@ class Env:
         observation = [obs_responses, drone_dist]
         return observation, reward, done, loginfo
 
+    def check_spread(self, positions):
+        '''
+        Method to return 'near' if any two drones are within spread_thd of
+        each other in the xy plane, else 'far'
+        '''
+        xy = positions[:, :2]
+        gaps = np.linalg.norm(xy[:, None] - xy[None], axis=-1)
+        pairs = np.triu_indices(len(xy), 1)
+        return 'near' if np.any(gaps[pairs] <= spread_thd) else 'far'
+
+    def check_range(self, positions):
+        '''
+        Method to flag the drones out of the flying range (out_range), and
+        those near its boundary (out_small_range)
+        '''
+        x, y, z = positions[:, 0], positions[:, 1], positions[:, 2]
+        out_small_range = (x > max_small_x) | (x < min_small_x) | (y > max_small_y) | (y < min_small_y)
+        # fly below min height or above max height
+        out_range = (z > min_height) | (z < max_height) | (x > max_x) | (x < min_x) | (y > max_y) | (y < min_y)
+        return out_range, out_small_range
+
+    def check_done(self, has_collided, out_range, success):
+        return bool(np.any(has_collided) or np.any(out_range) or np.sum(success) == target_num)
+
+    def plan_motion(self, qoffset):
+        '''
+        Method to translate one drone's action into a body-frame velocity
+        (None: no move) and a camera turn (None: no turn)
+        '''
+        # if quad_offset has length of 3, run continuous action.
+        if len(qoffset) == 3:
+            return [qoffset[0], qoffset[1], 0], qoffset[2]
+        # else run discrete action.
+        # front or back
+        if qoffset[3] == 1 or qoffset[3] == 4:
+            return [qoffset[0], 0, 0], None
+        # left or right
+        if qoffset[3] == 2 or qoffset[3] == 5:
+            return [0, qoffset[1], 0], None
+        # cam left or right
+        if qoffset[3] == 3 or qoffset[3] == 6:
+            return None, qoffset[2]
+        # for stop action quad_offset[id][3] == 0
+        return None, None
+
+    def turn_camera_angles(self, plans):
+        # the camera turns of all drones, in drone order: the shift of each drone, and the camera
+        # angles to set on it (a copy as of its turn, None if it does not turn)
+        cam_shifted = np.zeros(len(self.droneList))
+        angles = []
+        for id, (_, turn) in enumerate(plans):
+            if turn is None:
+                angles.append(None)
+                continue
+            self.camera_angle[:, 2] += turn*angle_spd
+            cam_shifted[id] = turn*angle_spd
+            angles.append(self.camera_angle.copy())
+        return cam_shifted, angles
+
+    def turn_cameras(self, drone, turn):
+        self.camera_angle[:, 2] += turn*angle_spd
+        self.set_camera_angles(drone)
+        return turn*angle_spd
+
+    def move_drones(self, quad_offset):
+        # one drone after the other, each move joined before the next drone starts;
+        # each drone's position is read live when its turn comes (the snapshot predates the earlier moves)
+        cam_shifted = np.zeros(len(self.droneList))
+        for id, drone in enumerate(self.droneList):
+            self.dc.changeDroneAlt(drone, -8)
+            velocity, turn = self.plan_motion(quad_offset[id])
+            if velocity is not None:
+                self.dc.moveDroneBySelfFrame(drone, velocity, 5*timeslice) # 2*timeslice 
+                self.stabilize(drone)
+            if turn is not None:
+                cam_shifted[id] = self.turn_cameras(drone, turn)
+        return cam_shifted
+
+    def move_drones_concurrent(self, quad_offset):
+        # issue every drone's command of a phase first, then join them together
+        plans = [self.plan_motion(qoffset) for qoffset in quad_offset]
+        if self.rpc_pool:
+            cam_shifted, angles = self.turn_camera_angles(plans)
+            positions = [self.current_position(id) for id in range(len(self.droneList))]
+            self.dc.dispatch(self.move_drone, self.droneList, positions, plans, angles)
+            return cam_shifted
+        cam_shifted = np.zeros(len(self.droneList))
+        moves = [self.dc.changeDroneAltAsync(drone, -8, self.current_position(id)) for id, drone in enumerate(self.droneList)]
+        for move in moves:
+            move.join()
+        moves = [self.dc.moveDroneBySelfFrameAsync(drone, velocity, 5*timeslice)
+                 for drone, (velocity, _) in zip(self.droneList, plans) if velocity is not None]
+        for id, drone in enumerate(self.droneList):
+            if plans[id][1] is not None:
+                cam_shifted[id] = self.turn_cameras(drone, plans[id][1])
+        for move in moves:
+            move.join()
+        # settle without blocking: hover is issued and the collision window runs meanwhile
+        for drone, (velocity, _) in zip(self.droneList, plans):
+            if velocity is not None:
+                self.dc.hoverAsync(drone)
+        return cam_shifted
+
+    def move_drone(self, drone, pos, plan, angle):
+        # one drone's move_drones_concurrent, in its dispatcher thread with rpc_pool
+        self.dc.changeDroneAlt(drone, -8, pos)
+        velocity, _ = plan
+        move = None if velocity is None else self.dc.moveDroneBySelfFrameAsync(drone, velocity, 5*timeslice)
+        if angle is not None:
+            for cam_angle, cam in zip(angle, self.camList):
+                self.dc.setCameraAngle(cam_angle, drone, cam=str(cam))
+        if move is not None:
+            move.join()
+            # settle without blocking, as move_drones_concurrent
+            self.dc.hoverAsync(drone)
+
     def stabilize(self, drone):
         #print("stabilize")
-        time.sleep(0.1)
+        self.sleep(0.1)
         self.dc.moveDroneBySelfFrame(drone, [0,0,-1], 0.125)
-        time.sleep(0.1)
+        self.sleep(0.1)
         self.dc.moveDroneBySelfFrame(drone, [0,0,1], 0.1)
 
     def check_focus(self, bbox, image):
@@ -469,60 +687,46 @@ class Env:
 
     # assign rewards
     def compute_reward(self, exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success, out_small_range, done):
-        reward = [None] * len(droneList)
-        for id, drone in enumerate(droneList):         
-            #img = responses[id]
-            exist_status = exist_reward[id]
-            focus_status = focus_reward[id]
-            #size_status = size_reward[id]
-            area_rwd_pt = area_reward[id]
-            
-            # if distance sensor is too near any obstacle, give penalty
-            # if any(dsensor_reward):
-            #     reward[id] = config.reward['dsensor_close']
-            #     continue
-
-            # Assign reward value based on status
-            if done:
-                if sum(success) == target_num:
-                    reward[id] = config.reward['success']
-                else:
-                    reward[id] = config.reward['dead']
-            elif exist_status == 'miss':
-                reward[id] = config.reward['miss']
-            elif exist_status == 'found' and focus_status == 'in':
-                reward[id] = config.reward['in']
-            elif exist_status == 'found' and focus_status == 'out':
-                reward[id] = config.reward['out']
+        '''
+        Method to compute the reward of every drone from its status codes
+        (exist_reward: EXIST_*, focus_reward: FOCUS_*) and the per-drone
+        area reward, success and out_small_range arrays
+        '''
+        # Assign reward value based on status
+        if done:
+            if np.sum(success) == target_num:
+                reward = np.full(len(exist_reward), config.reward['success'], dtype=float)
             else:
-                reward[id] = config.reward['none']
-
-            # team rewards
-            reward[id] += area_rwd_pt
+                reward = np.full(len(exist_reward), config.reward['dead'], dtype=float)
+        else:
+            reward = self.reward_table[exist_reward, focus_reward]
 
-            # if drones are not spread enough, give penalty
-            if spread_reward == 'near':
-                reward[id] += config.reward['near']
+        # team rewards
+        reward += area_reward
 
-            # if distance sensor is too near any obstacle, give penalty
-            if any(dsensor_reward):
-                reward[id] += config.reward['dsensor_close']
+        # if drones are not spread enough, give penalty
+        if spread_reward == 'near':
+            reward += config.reward['near']
 
-            # if drone is near to the boundary 
-            if out_small_range[id] == True:
-                reward[id] += config.reward['out_small']
+        # if distance sensor is too near any obstacle, give penalty
+        if np.any(dsensor_reward):
+            reward += config.reward['dsensor_close']
 
+        # if drone is near to the boundary 
+        reward[out_small_range] += config.reward['out_small']
 
-            # Append GPS rewards
-            # if img_status != 'dead':            
-            #     gps = gps_dist[droneidx]
-            #     if gps > 9 or gps < 2.3:
-            #         reward[id] = reward[id] + config.reward['dead']
-            #     else:
-            #         reward[id] = reward[id] + config.reward['forward']
+        # Append GPS rewards
+        # if img_status != 'dead':            
+        #     gps = gps_dist[droneidx]
+        #     if gps > 9 or gps < 2.3:
+        #         reward[id] = reward[id] + config.reward['dead']
+        #     else:
+        #         reward[id] = reward[id] + config.reward['forward']
         return reward
     
     
     def disconnect(self):
+        if self.adc is not None:
+            self.adc.close()
         self.dc.shutdown_AirSim()
         print('Disconnected.')
\ No newline at end of file
@@ -0,0 +1,157 @@
+import math
+import asyncio
+import itertools
+import numpy as np
+import msgpack
+import airsim
+from DroneControlAPI_yv4 import Telemetry, response_to_numpy
+
+REQUEST, RESPONSE = 0, 1
+
+
+class RpcError(Exception):
+    pass
+
+
+class AsyncRpcClient(object):
+    """
+    msgpack-rpc client on an asyncio stream, speaking the protocol of the
+    AirSim RPC server. Any number of calls can be in flight on the one
+    connection: each request is written at once and its reply is matched by
+    msgid, in whatever order the server answers.
+
+    Arguments are packed as the airsim client does (airsim types as their
+    attribute dicts); results come back as plain dicts / lists.
+    """
+
+    def __init__(self, ip='127.0.0.1', port=41451, timeout=3600):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.msgids = itertools.count()
+        self.receiver = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.ip, self.port)
+        self.receiver = asyncio.ensure_future(self.receive())
+        return self
+
+    def close(self):
+        if self.writer is not None:
+            self.receiver.cancel()
+            self.writer.close()
+            self.writer = None
+
+    @staticmethod
+    def pack(msg):
+        return msgpack.packb(msg, use_bin_type=True, default=lambda o: o.to_msgpack())
+
+    async def call(self, method, *params):
+        """
+        Coroutine returning the result of one RPC
+        """
+        msgid = next(self.msgids)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[msgid] = future
+        self.writer.write(self.pack([REQUEST, msgid, method, list(params)]))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self.pending.pop(msgid, None)
+
+    async def receive(self):
+        unpacker = msgpack.Unpacker(raw=False)
+        try:
+            while True:
+                data = await self.reader.read(1 << 16)
+                if not data:
+                    raise ConnectionError('AirSim RPC connection closed')
+                unpacker.feed(data)
+                for msgtype, msgid, error, result in unpacker:
+                    future = self.pending.get(msgid)
+                    if msgtype != RESPONSE or future is None or future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(RpcError(error))
+                    else:
+                        future.set_result(result)
+        except Exception as e:
+            # fail the calls in flight instead of leaving them waiting
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(e)
+
+
+class AsyncDroneControl(object):
+    """
+    Coroutine versions of the DroneControl calls of Env.step, on an
+    AsyncRpcClient, so the requests for all drones, cameras and sensors of a
+    step can be in flight together (gather them). Results are converted to
+    the airsim types DroneControl returns.
+    """
+
+    def __init__(self, droneList, ip='127.0.0.1', port=41451, z_offset=0.):
+        self.droneList = droneList
+        self.client = AsyncRpcClient(ip, port)
+        self.z_offset = z_offset
+
+    async def connect(self):
+        await self.client.connect()
+        return self
+
+    def close(self):
+        self.client.close()
+
+    async def simPause(self, pause):
+        await self.client.call('simPause', pause)
+
+    async def getMultirotorState(self, drone):
+        return airsim.MultirotorState.from_msgpack(await self.client.call('getMultirotorState', drone))
+
+    async def simGetObjectPose(self, drone):
+        return airsim.Pose.from_msgpack(await self.client.call('simGetObjectPose', drone))
+
+    async def getDistanceDataArray(self, dist_sensors, drones=None):
+        """
+        Returns a (len(drones), len(dist_sensors)) float32 array of distances
+        """
+        drones = self.droneList if drones is None else drones
+        readings = await asyncio.gather(*[self.client.call('getDistanceSensorData', dist_sensor, drone)
+                                          for drone in drones for dist_sensor in dist_sensors])
+        distances = np.array([reading['distance'] for reading in readings], dtype=np.float32)
+        return distances.reshape(len(drones), len(dist_sensors))
+
+    async def getTelemetry(self, drone, dist_sensors=()):
+        pose, state, distances = await asyncio.gather(
+            self.simGetObjectPose(drone), self.getMultirotorState(drone),
+            self.getDistanceDataArray(dist_sensors, [drone]))
+        return Telemetry(pose.position, pose.orientation, state.kinematics_estimated, state.collision.has_collided,
+                         distances[0])
+
+    async def captureImgsNumpy(self, drone, camList):
+        requests = [airsim.ImageRequest(cam, airsim.ImageType.Scene, False, False) for cam in camList]
+        responses = await self.client.call('simGetImages', requests, drone, False)
+        return [response_to_numpy(airsim.ImageResponse.from_msgpack(response)) for response in responses]
+
+    async def setCameraAngle(self, camera_angle, drone, cam="0"):
+        camera_pose = airsim.Pose(airsim.Vector3r(0, 0, 0), airsim.to_quaternion(
+            math.radians(camera_angle[0]), math.radians(camera_angle[1]), math.radians(camera_angle[2])))
+        await self.client.call('simSetCameraPose', str(cam), camera_pose, drone, False)
+
+    async def moveDroneBySelfFrame(self, drone, velocity, duration):
+        # returns when the move is done, as the joined moveByVelocityBodyFrameAsync future
+        await self.client.call('moveByVelocityBodyFrame', velocity[0], velocity[1], velocity[2], duration,
+                               airsim.DrivetrainType.MaxDegreeOfFreedom, airsim.YawMode(), drone)
+
+    async def changeDroneAlt(self, drone, altitude, pos=None):
+        if pos is None:
+            pos = (await self.getMultirotorState(drone)).kinematics_estimated.position
+        z = altitude-self.z_offset
+        await self.client.call('moveToPosition', pos.x_val, pos.y_val, z, 1, 60,
+                               airsim.DrivetrainType.MaxDegreeOfFreedom, airsim.YawMode(True, 0), -1, 1, drone)
+
+    async def hover(self, drone):
+        await self.client.call('hover', drone)
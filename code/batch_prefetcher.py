@@ -0,0 +1,83 @@
+import time
+import queue
+import threading
+
+
+class BatchPrefetcher(object):
+    """
+    Assembles the next minibatches of a ReplayMemory in a background thread
+    while the session trains on the current one.
+
+    depth + 1 sets of buffers are allocated once and cycled: up to depth
+    filled sets wait in the ready queue, and the set returned by the last
+    get() stays untouched until the next get(). The NumPy gathers and the
+    codec decoding release the GIL, so the worker overlaps with sess.run.
+    """
+
+    def __init__(self, memory, batch_size, depth=2):
+        self.memory = memory
+        self.batch_size = batch_size
+        self.depth = depth
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        for _ in range(depth + 1):
+            self.free.put(memory.make_buffers(batch_size))
+        self.current = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        # stats since the last report()
+        self.gets = 0
+        self.depth_sum = 0
+        self.stall_time = 0.
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                buf = self.free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                batch = self.memory.sample(self.batch_size, buf)
+            except Exception as e:
+                # hand the error to the training thread instead of dying silently
+                self.ready.put(e)
+                return
+            self.ready.put((buf, batch))
+
+    def get(self):
+        """
+        Method to pop a ready minibatch, in the tuple format of
+        ReplayMemory.sample. Its buffers are valid until the next call.
+        """
+        self.start()
+        if self.current is not None:
+            self.free.put(self.current)
+            self.current = None
+        self.depth_sum += self.ready.qsize()
+        self.gets += 1
+        start = time.time()
+        item = self.ready.get()
+        self.stall_time += time.time() - start
+        if isinstance(item, Exception):
+            raise item
+        self.current, batch = item
+        return batch
+
+    def report(self):
+        depth = self.depth_sum / float(self.gets) if self.gets else 0.
+        line = 'Prefetch: %d batches, avg queue depth %.2f/%d, stall %.2f s (%.1f ms per batch)' \
+            % (self.gets, depth, self.depth, self.stall_time, self.stall_time / max(self.gets, 1) * 1e3)
+        self.gets, self.depth_sum, self.stall_time = 0, 0, 0.
+        return line
@@ -0,0 +1,170 @@
+import time
+import resource
+import argparse
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+from keras.optimizers import Adam
+from bench_replay import make_agent, synthetic_frame, fill, num_drone, num_cam
+
+
+def acting_model(agent):
+    return agent.acting_critic if hasattr(agent, 'acting_critic') else agent.acting_actor
+
+
+def bench_embedding_cache(agent, state_size, pos_size, steps, seed=0):
+    """
+    Check that the embedding cache gives the outputs of the full model along
+    an episode, and time both
+    """
+    rng = np.random.RandomState(seed)
+    frame_shape = (1,) + tuple(state_size[1:])
+    model, cache = acting_model(agent), agent.cache
+    history = np.stack([synthetic_frame(rng, frame_shape)] * state_size[0], axis=1)
+    full_time, cached_time, max_diff = 0., 0., 0.
+    cache.encoded_frames = 0
+    for t in range(steps):
+        state = [history, rng.rand(1, pos_size)]
+        start = time.perf_counter()
+        full = model.predict(state)
+        full_time += time.perf_counter() - start
+        start = time.perf_counter()
+        cached = cache.predict(state)
+        cached_time += time.perf_counter() - start
+        max_diff = max(max_diff, max(float(np.max(np.abs(a - b))) for a, b in zip(full, cached)))
+        history = np.append(history[:, 1:], [synthetic_frame(rng, frame_shape)], axis=1)
+    print('embedding cache parity: max |full - cached| = %g over %d steps' % (max_diff, steps))
+    print('frames encoded per step: full %d, cached %.2f'
+          % (state_size[0], cache.encoded_frames / float(steps)))
+    print('act predict: full %.2f ms, cached %.2f ms' % (full_time / steps * 1e3, cached_time / steps * 1e3))
+    return max_diff
+
+
+def legacy_update_target_model(agent):
+    """
+    The get_weights / NumPy / set_weights target update the agents used
+    before build_target_update
+    """
+    if not hasattr(agent, 'tau'):
+        agent.target_critic.set_weights(agent.critic.get_weights())
+        return
+    agent.target_actor.set_weights(
+        agent.tau * np.array(agent.actor.get_weights()) \
+        + (1 - agent.tau) * np.array(agent.target_actor.get_weights())
+    )
+    agent.target_critic.set_weights(
+        agent.tau * np.array(agent.critic.get_weights()) \
+        + (1 - agent.tau) * np.array(agent.target_critic.get_weights())
+    )
+
+
+def bench_target_update(agent, repeat):
+    for label, fn in [('numpy', lambda: legacy_update_target_model(agent)), ('in-graph', agent.update_target_model)]:
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        print('update_target_model %-8s: %8.2f ms' % (label, (time.perf_counter() - start) / repeat * 1e3))
+
+
+def init_new_variables(sess):
+    names = set(name.decode() for name in sess.run(tf.report_uninitialized_variables()))
+    sess.run(tf.variables_initializer([v for v in tf.global_variables() if v.op.name in names]))
+
+
+def legacy_actor_optimizer(agent):
+    """
+    RDDPG actor update as a separate K.function, as before build_train_optimizer
+    """
+    params_grad = []
+    for i, pred_Q in enumerate(agent.critic.outputs):
+        # the gradient of each drone's Q with respect to its own action input
+        action_grad = tf.gradients(pred_Q, agent.critic.inputs[2 + i])
+        target = -action_grad[0] / agent.batch_size
+        params_grad += tf.gradients(agent.actor.outputs[i], agent.actor.trainable_weights, target)
+    params_grad, global_norm = tf.clip_by_global_norm(params_grad, 5.0)
+    updates = tf.train.AdamOptimizer(agent.actor_lr).apply_gradients(zip(params_grad, agent.actor.trainable_weights))
+    return K.function(agent.actor.inputs + agent.critic.inputs[2:], [global_norm], updates=[updates])
+
+
+def legacy_critic_optimizer(agent):
+    """
+    RDDPG critic update as a separate K.function, as before build_train_optimizer
+    """
+    ys = [K.placeholder(shape=(None, 1), dtype='float32') for _ in range(agent.num_drone)]
+    weights = K.placeholder(shape=(None, 1), dtype='float32')
+    preds = agent.critic.outputs
+    td_error = sum(K.abs(pred - y) for pred, y in zip(preds, ys)) / agent.num_drone
+    avgloss = sum(K.mean(weights * K.square(pred - y)) for pred, y in zip(preds, ys)) / agent.num_drone
+    updates = Adam(lr=agent.critic_lr).get_updates(agent.critic.trainable_weights, [], avgloss)
+    return K.function(agent.critic.inputs + ys + [weights], [avgloss, td_error], updates=updates)
+
+
+def legacy_train_model(agent, actor_update, critic_update):
+    """
+    RDDPG update as separate predict / K.function round trips, as
+    train_model did before build_train_optimizer
+    """
+    images, vels, actions, rewards, next_images, next_vels, dones, weights, indices = agent.memory.sample(agent.batch_size)
+    actions = [actions[:, i] for i in range(agent.num_drone)]
+    rewards = rewards.reshape(-1, 1)
+    dones = dones.reshape(-1, 1)
+    weights = weights.reshape(-1, 1)
+    states = [images, vels]
+    next_states = [next_images, next_vels]
+    policies = agent.actor.predict(states)
+    target_actions = agent.target_actor.predict(next_states)
+    target_Qs = agent.target_critic.predict(next_states + target_actions)
+    targets = [rewards + agent.gamma * (1 - dones) * target_Q for target_Q in target_Qs]
+    actor_loss = actor_update(states + policies)
+    critic_loss, td_error = critic_update(states + actions + targets + [weights])
+    return actor_loss[0], critic_loss
+
+
+def bench_train(agent, name, state_size, pos_size, repeat):
+    fill(agent.memory, agent.memory_size, state_size, pos_size, agent.memory.actions.shape[1:])
+    steps = [('fused', agent.train_model)]
+    if name == 'rddpg':
+        actor_update, critic_update = legacy_actor_optimizer(agent), legacy_critic_optimizer(agent)
+        init_new_variables(agent.sess)
+        steps.insert(0, ('separate', lambda: legacy_train_model(agent, actor_update, critic_update)))
+    for label, fn in steps:
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        sec = (time.perf_counter() - start) / repeat
+        print('train_model %-8s batch %d: %8.2f ms  %6.2f updates/s' % (label, agent.batch_size, sec * 1e3, 1 / sec))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Agent acting / update micro-benchmarks')
+    parser.add_argument('--agent',      type=str,   default='rdqn', choices=['rdqn', 'rddpg'])
+    parser.add_argument('--img_height', type=int,   default=112)
+    parser.add_argument('--img_width',  type=int,   default=176)
+    parser.add_argument('--seqsize',    type=int,   default=5)
+    parser.add_argument('--benchmarks', type=str,   nargs='+', default=['cache', 'target', 'train'],
+                        choices=['cache', 'target', 'train'])
+    parser.add_argument('--batch_size', type=int,   default=32)
+    parser.add_argument('--memory_size',type=int,   default=200)
+    parser.add_argument('--steps',      type=int,   default=50)
+    parser.add_argument('--repeat',     type=int,   default=20)
+    parser.add_argument('--tolerance',  type=float, default=1e-5)
+    parser.add_argument('--image_dtype',type=str,   default='uint8', choices=['uint8', 'float32'],
+                        help='dtype of the image feeds (float32: the pre-uint8 data path, for comparison)')
+    args = parser.parse_args()
+
+    state_size = [args.seqsize, args.img_height, args.img_width, num_drone*num_cam]
+    pos_size = num_drone*3
+    agent = make_agent(args.agent, state_size, pos_size, args.batch_size, args.memory_size, embedding_cache=True,
+                       image_dtype=args.image_dtype)
+    if 'target' in args.benchmarks:
+        bench_target_update(agent, args.repeat)
+    if 'cache' in args.benchmarks:
+        diff = bench_embedding_cache(agent, state_size, pos_size, args.steps)
+        if diff > args.tolerance:
+            raise SystemExit('embedding cache outputs differ from the full model')
+    if 'train' in args.benchmarks:
+        bench_train(agent, args.agent, state_size, pos_size, args.repeat)
+    # ru_maxrss is in KB on Linux
+    print('peak RSS: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
@@ -0,0 +1,510 @@
+import io
+import os
+import json
+import time
+import argparse
+import itertools
+import tempfile
+import contextlib
+import numpy as np
+import config
+import airsim_env_tf1
+from airsim_env_tf1 import Env
+from rpc_standin import StandinServer
+from collision_monitor import CollisionMonitor
+from capture_profile import model_frame, capture_size
+from step_profiler import StepProfiler, instrument_env
+
+
+def bench_capture(port, steps, **server_args):
+    """
+    Time Env.capture_state_image per step, one RPC per camera against one
+    RPC per drone
+    """
+    server = StandinServer(airsim_env_tf1.droneList, port=port, **server_args).start()
+    try:
+        for batch_capture in [False, True]:
+            env = Env(port=port, inference=False, batch_capture=batch_capture)
+            env.capture_state_image()
+            calls = server.calls['simGetImages']
+            start = time.perf_counter()
+            for _ in range(steps):
+                responses = env.capture_state_image()
+            sec = (time.perf_counter() - start) / steps
+            assert all(img.size for response in responses for img in response)
+            print('capture %-9s: %7.2f ms/step  %5.1f simGetImages RPCs/step'
+                  % ('batched' if batch_capture else 'per-cam', sec * 1e3, (server.calls['simGetImages'] - calls) / float(steps)))
+    finally:
+        server.stop()
+
+
+def bench_step(port, steps, num_drones, seed=0, **server_args):
+    """
+    Time Env.step with the drones moved one after the other against all at
+    once, for 1..num_drones drones
+    """
+    rng = np.random.RandomState(seed)
+    for n in range(1, num_drones + 1):
+        server = StandinServer(['Drone%d' % i for i in range(n)], port=port, **server_args).start()
+        try:
+            for concurrent_motion in [False, True]:
+                env = Env(port=port, inference=False, concurrent_motion=concurrent_motion, num_drone=n)
+                env.reset()
+                start = time.perf_counter()
+                for _ in range(steps):
+                    env.step(rng.uniform(-1, 1, (n, env.action_size)))
+                sec = (time.perf_counter() - start) / steps
+                print('step %d drones %-10s: %7.2f ms/step'
+                      % (n, 'concurrent' if concurrent_motion else 'sequential', sec * 1e3))
+        finally:
+            server.stop()
+
+
+def bench_async(port, steps, num_drones, seed=0, **server_args):
+    """
+    Time Env.step with the drones moved concurrently on the threaded client
+    against step_async on the pipelined asyncio client
+    """
+    rng = np.random.RandomState(seed)
+    server = StandinServer(['Drone%d' % i for i in range(num_drones)], port=port, **server_args).start()
+    try:
+        for async_rpc in [False, True]:
+            env = Env(port=port, inference=False, concurrent_motion=True, num_drone=num_drones, async_rpc=async_rpc)
+            env.reset()
+            env.step(rng.uniform(-1, 1, (num_drones, env.action_size)))
+            calls = server.num_calls()
+            start = time.perf_counter()
+            for _ in range(steps):
+                env.step(rng.uniform(-1, 1, (num_drones, env.action_size)))
+            sec = (time.perf_counter() - start) / steps
+            print('step %d drones %-8s: %7.2f ms/step  %6.1f RPCs/step'
+                  % (num_drones, 'asyncio' if async_rpc else 'threaded', sec * 1e3,
+                     (server.num_calls() - calls) / float(steps)))
+            if env.adc is not None:
+                env.adc.close()
+    finally:
+        server.stop()
+
+
+def bench_pool(port, steps, sizes, seed=0, **server_args):
+    """
+    Time Env.step (concurrent motion) and its capture and telemetry reads
+    with all drones on one connection against one connection per drone
+    (rpc_pool), for each fleet size
+    """
+    rng = np.random.RandomState(seed)
+    for n in sizes:
+        server = StandinServer(['Drone%d' % i for i in range(n)], port=port, **server_args).start()
+        try:
+            for rpc_pool in [0, n]:
+                env = Env(port=port, inference=False, concurrent_motion=True, num_drone=n, rpc_pool=rpc_pool)
+                env.reset()
+                start = time.perf_counter()
+                for _ in range(steps):
+                    env.step(rng.uniform(-1, 1, (n, env.action_size)))
+                step = (time.perf_counter() - start) / steps
+                start = time.perf_counter()
+                for _ in range(steps):
+                    env.capture_state_image()
+                    env.capture_telemetry(env.dsensors)
+                reads = (time.perf_counter() - start) / steps
+                print('pool %2d drones %2d connections: step %7.2f ms  capture+telemetry %7.2f ms'
+                      % (n, max(rpc_pool, 1), step * 1e3, reads * 1e3))
+                if env.dc.dispatcher is not None:
+                    env.dc.dispatcher.shutdown()
+        finally:
+            server.stop()
+
+
+def bench_profile(port, steps, num_drones, img_height, img_width, full_size=(224, 352), **server_args):
+    """
+    Bytes of image data and time per step of capturing all cameras and
+    turning them into network input, with the frames captured at the
+    settings.json size of full_size against the model resolution
+    """
+    droneList = ['Drone%d' % i for i in range(num_drones)]
+    for height, width in [full_size, (img_height, img_width)]:
+        server = StandinServer(droneList, port=port, img_height=height, img_width=width, **server_args).start()
+        try:
+            env = Env(port=port, inference=False, num_drone=num_drones)
+            assert capture_size(json.loads(env.dc.getSettingsString())) == (height, width)
+            env.capture_state_image()
+            capture = transform = 0.
+            nbytes = 0
+            for _ in range(steps):
+                start = time.perf_counter()
+                responses = env.capture_state_image()
+                capture += time.perf_counter() - start
+                start = time.perf_counter()
+                frames = [model_frame(img, img_height, img_width) for response in responses for img in response]
+                transform += time.perf_counter() - start
+                nbytes += sum(img.nbytes for response in responses for img in response)
+            assert all(frame.shape == (img_height, img_width) for frame in frames)
+            print('profile %3dx%3d: %8.1f KB/step  capture %7.2f ms  transform %6.2f ms  (%d frames/step)'
+                  % (width, height, nbytes / 1024. / steps, capture * 1e3 / steps, transform * 1e3 / steps, len(frames)))
+        finally:
+            server.stop()
+
+
+def bench_sensors(port, steps, **server_args):
+    """
+    Time reading all distance sensors of all drones, one blocking RPC after
+    the other against getDistanceDataArray
+    """
+    server = StandinServer(airsim_env_tf1.droneList, port=port, **server_args).start()
+    try:
+        env = Env(port=port, inference=False)
+        dc, drones, sensors = env.dc, env.droneList, env.dsensors
+        reads = [('sequential', lambda: np.array([[dc.getDistanceData(sensor, drone).distance for sensor in sensors]
+                                                  for drone in drones])),
+                 ('array', lambda: dc.getDistanceDataArray(sensors))]
+        for label, read in reads:
+            read()
+            start = time.perf_counter()
+            for _ in range(steps):
+                distances = read()
+            sec = (time.perf_counter() - start) / steps
+            print('distance sensors %-10s: %7.2f ms for %s readings' % (label, sec * 1e3, 'x'.join(map(str, distances.shape))))
+    finally:
+        server.stop()
+
+
+def bench_monitor(port, steps, rate, **server_args):
+    """
+    RPCs and CPU time of the collision window, polled back to back (the old
+    loop) against at a fixed rate
+    """
+    server = StandinServer(airsim_env_tf1.droneList, port=port, **server_args).start()
+    try:
+        env = Env(port=port, inference=False)
+        for label, poll_rate, debounce in [('busy', 0, 11), ('%g Hz' % rate, rate, 3)]:
+            monitor = CollisionMonitor(env.dc, env.droneList, rate=poll_rate, debounce=debounce,
+                                       floor_z=airsim_env_tf1.floorZ, debounce_landed=poll_rate > 0)
+            calls = server.num_calls()
+            start, cpu = time.perf_counter(), time.process_time()
+            for _ in range(steps):
+                monitor.watch(airsim_env_tf1.timeslice)
+            sec, cpu = (time.perf_counter() - start) / steps, (time.process_time() - cpu) / steps
+            print('monitor %-7s: %6.1f RPCs/window  %6.1f ms CPU/window  (%.0f ms window)'
+                  % (label, (server.num_calls() - calls) / float(steps), cpu * 1e3, sec * 1e3))
+    finally:
+        server.stop()
+
+
+def bench_rpcs(port, steps, seed=0, **server_args):
+    """
+    Count the RPCs per Env.step by method, reading the drones' state per use
+    against once per step from a telemetry snapshot
+    """
+    rng = np.random.RandomState(seed)
+    methods = ['simGetObjectPose', 'getMultirotorState', 'simGetCollisionInfo', 'getDistanceSensorData']
+    timeslice = airsim_env_tf1.timeslice
+    # no collision window: its RPC count depends on how long it runs, not on the step's reads
+    airsim_env_tf1.timeslice = 0
+    server = StandinServer(airsim_env_tf1.droneList, port=port, **server_args).start()
+    try:
+        for telemetry in [False, True]:
+            env = Env(port=port, inference=False, telemetry=telemetry)
+            env.reset()
+            env.step(rng.uniform(-1, 1, (len(env.droneList), env.action_size)))
+            before = server.calls.copy()
+            for _ in range(steps):
+                env.step(rng.uniform(-1, 1, (len(env.droneList), env.action_size)))
+            calls = server.calls - before
+            print('rpcs %-9s: %6.1f RPCs/step  (%s)'
+                  % ('snapshot' if telemetry else 'per-use', sum(calls.values()) / float(steps),
+                     ', '.join('%s %.1f' % (method, calls[method] / float(steps)) for method in methods)))
+    finally:
+        server.stop()
+        airsim_env_tf1.timeslice = timeslice
+
+
+def bench_kinematic(steps, seed=0):
+    """
+    Env steps per second on the headless kinematic sim, with Env's
+    per-step prints off
+    """
+    rng = np.random.RandomState(seed)
+    for concurrent_motion in [False, True]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = Env(sim='kinematic', concurrent_motion=concurrent_motion, verbose=False)
+            env.reset()
+            episodes = 0
+            start = time.perf_counter()
+            for _ in range(steps):
+                _, _, done, _ = env.step(rng.uniform(-1, 1, (len(env.droneList), env.action_size)))
+                if done:
+                    episodes += 1
+                    env.reset()
+            sec = time.perf_counter() - start
+        print('kinematic %-10s: %7.1f steps/s  %d episodes  %.0fx real time'
+              % ('concurrent' if concurrent_motion else 'sequential', steps / sec, episodes, env.dc.clock() / sec))
+
+
+def bench_spans(steps, seed=0):
+    """
+    Env steps per second on the kinematic sim without and with the step
+    spans, the cost of one timed call, and the span summary of the run
+    """
+    profiler = StepProfiler(os.path.join(tempfile.mkdtemp(), 'spans.csv'))
+    for spans in [False, True]:
+        rng = np.random.RandomState(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = Env(sim='kinematic', concurrent_motion=True, verbose=False)
+            if spans:
+                instrument_env(profiler, env)
+            env.reset()
+            start = time.perf_counter()
+            for _ in range(steps):
+                _, _, done, _ = env.step(rng.uniform(-1, 1, (len(env.droneList), env.action_size)))
+                if done:
+                    env.reset()
+            sec = time.perf_counter() - start
+        print('spans %-3s: %7.1f steps/s' % ('on' if spans else 'off', steps / sec))
+    summary = profiler.flush(0)
+    noop = lambda: None
+    timed = profiler.wrap('noop', noop)
+    for fn, label in [(noop, 'plain'), (timed, 'timed')]:
+        start = time.perf_counter()
+        for _ in range(100000):
+            fn()
+        print('spans %s call: %6.3f us' % (label, (time.perf_counter() - start) * 10))
+    print(summary)
+
+
+def compute_reward_loop(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success, out_small_range, done):
+    """
+    Env.compute_reward as a per-drone if/elif chain over the string statuses
+    ('miss' / 'found', 'none' / 'in' / 'out'), as it was before the status
+    codes and the reward table (the baseline of bench_fleet / bench_reward)
+    """
+    reward = [None] * len(exist_reward)
+    for id in range(len(exist_reward)):
+        if done:
+            reward[id] = config.reward['success'] if sum(success) == airsim_env_tf1.target_num else config.reward['dead']
+        elif exist_reward[id] == 'miss':
+            reward[id] = config.reward['miss']
+        elif exist_reward[id] == 'found' and focus_reward[id] == 'in':
+            reward[id] = config.reward['in']
+        elif exist_reward[id] == 'found' and focus_reward[id] == 'out':
+            reward[id] = config.reward['out']
+        else:
+            reward[id] = config.reward['none']
+        reward[id] += area_reward[id]
+        if spread_reward == 'near':
+            reward[id] += config.reward['near']
+        if any(dsensor_reward):
+            reward[id] += config.reward['dsensor_close']
+        if out_small_range[id]:
+            reward[id] += config.reward['out_small']
+    return reward
+
+
+def status_strings(exist_reward, focus_reward):
+    return ([airsim_env_tf1.EXIST_STATUS[code] for code in exist_reward],
+            [airsim_env_tf1.FOCUS_STATUS[code] for code in focus_reward])
+
+
+def fleet_outcome_loop(env, positions, exist_reward, focus_reward, area, has_collided, success, dsensor_reward):
+    """
+    The per-drone Python loops Env.step used for the spread, range,
+    termination and reward before they were NumPy array operations (the
+    baseline of bench_fleet)
+    """
+    n = len(positions)
+    spread_reward = 'far'
+    for i, j in itertools.combinations(range(n), 2):
+        if np.linalg.norm([positions[i][0] - positions[j][0], positions[i][1] - positions[j][1]]) <= airsim_env_tf1.spread_thd:
+            spread_reward = 'near'
+            break
+    area_reward = {}
+    for id in range(n):
+        if area[id] > env.best_area[id]:
+            area_reward[id] = area[id]
+        else:
+            area_reward[id] = 0
+    out_range, out_small_range = [False] * n, [False] * n
+    for id in range(n):
+        x, y, z = positions[id]
+        if x > airsim_env_tf1.max_small_x or x < airsim_env_tf1.min_small_x or y > airsim_env_tf1.max_small_y or y < airsim_env_tf1.min_small_y:
+            out_small_range[id] = True
+        if z > airsim_env_tf1.min_height or z < airsim_env_tf1.max_height or x > airsim_env_tf1.max_x or x < airsim_env_tf1.min_x \
+                or y > airsim_env_tf1.max_y or y < airsim_env_tf1.min_y:
+            out_range[id] = True
+    done = any(has_collided) or any(out_range) or sum(success) == airsim_env_tf1.target_num
+    exist_reward, focus_reward = status_strings(exist_reward, focus_reward)
+    reward = compute_reward_loop(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success,
+                                 out_small_range, done)
+    return reward, done
+
+
+def fleet_outcome(env, positions, exist_reward, focus_reward, area, has_collided, success, dsensor_reward):
+    """
+    Env.step's spread, range, termination and reward, as NumPy array operations
+    """
+    spread_reward = env.check_spread(positions)
+    area_reward = np.where(area > env.best_area, area, 0.)
+    out_range, out_small_range = env.check_range(positions)
+    done = env.check_done(has_collided, out_range, success)
+    reward = env.compute_reward(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success,
+                                out_small_range, done)
+    return reward, done
+
+
+def bench_fleet(sizes, steps, seed=0):
+    """
+    Time the reward and termination of a step against the fleet size, the
+    per-drone loops against the array operations (on random synthetic drone
+    states, no sim needed), checking both give the same rewards
+    """
+    rng = np.random.RandomState(seed)
+    for n in sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = Env(sim='kinematic', num_drone=n)
+        env.best_area = rng.uniform(0, 5, n)
+        cases = []
+        for _ in range(steps):
+            positions = np.column_stack([rng.uniform(-25, 25, n), rng.uniform(-50, 50, n), rng.uniform(-9.5, -6.5, n)])
+            exist_reward = rng.choice([airsim_env_tf1.EXIST_MISS, airsim_env_tf1.EXIST_FOUND], n)
+            focus_reward = np.where(exist_reward == airsim_env_tf1.EXIST_FOUND,
+                                    rng.choice([airsim_env_tf1.FOCUS_IN, airsim_env_tf1.FOCUS_OUT], n), airsim_env_tf1.FOCUS_NONE)
+            cases.append((positions, exist_reward, focus_reward, rng.uniform(0, 10, n), rng.rand(n) < 0.01,
+                          rng.rand(n) < 0.01, rng.rand(n) < 0.05))
+        times = {}
+        for label, outcome in [('loop', fleet_outcome_loop), ('array', fleet_outcome)]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                results = [outcome(env, *case) for case in cases]
+                times[label] = (time.perf_counter() - start) / steps
+            if label == 'loop':
+                expected = results
+        assert all(np.array_equal(np.asarray(a[0], dtype=float), b[0]) and a[1] == b[1] for a, b in zip(expected, results))
+        print('fleet %2d drones: loop %7.1f us/step  array %7.1f us/step'
+              % (n, times['loop'] * 1e6, times['array'] * 1e6))
+
+
+def record_status_tuples(sizes, steps, seed=0):
+    """
+    The arguments of every Env.compute_reward call over steps random-action
+    steps of the kinematic sim per fleet size, as JSON-able dicts
+    """
+    rng = np.random.RandomState(seed)
+    records = []
+    for n in sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = Env(sim='kinematic', num_drone=n, concurrent_motion=True)
+            compute_reward = env.compute_reward
+
+            def record(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success, out_small_range, done):
+                records.append({
+                    'exist_reward': np.asarray(exist_reward).tolist(), 'focus_reward': np.asarray(focus_reward).tolist(),
+                    'area_reward': np.asarray(area_reward, dtype=float).tolist(), 'spread_reward': spread_reward,
+                    'dsensor_reward': np.asarray(dsensor_reward).tolist(), 'success': np.asarray(success).tolist(),
+                    'out_small_range': np.asarray(out_small_range).tolist(), 'done': done})
+                return compute_reward(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success,
+                                      out_small_range, done)
+            env.compute_reward = record
+            env.reset()
+            for _ in range(steps):
+                _, _, done, _ = env.step(rng.uniform(-1.5, 1.5, (n, env.action_size)))
+                if done:
+                    env.reset()
+    return records
+
+
+def bench_reward(sizes, steps, status_record='', seed=0):
+    """
+    Check Env.compute_reward (status codes, reward table lookup) against the
+    per-drone string-status chain bit for bit on recorded status tuples, and
+    time both per fleet size. The tuples are recorded on the kinematic sim;
+    with status_record they are read from that JSON lines file if it exists,
+    else written to it
+    """
+    if status_record and os.path.exists(status_record):
+        with open(status_record) as f:
+            records = [json.loads(line) for line in f]
+    else:
+        records = record_status_tuples(sizes, steps, seed)
+        if status_record:
+            with open(status_record, 'w') as f:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+    with contextlib.redirect_stdout(io.StringIO()):
+        env = Env(sim='kinematic')
+    cases = {}
+    for record in records:
+        args = [np.array(record[key]) for key in ['exist_reward', 'focus_reward', 'area_reward']]
+        args += [record['spread_reward']] + [np.array(record[key]) for key in ['dsensor_reward', 'success', 'out_small_range']]
+        args += [record['done']]
+        cases.setdefault(len(record['exist_reward']), []).append(args)
+    for n, fleet_cases in sorted(cases.items()):
+        string_cases = [list(status_strings(args[0], args[1])) + args[2:] for args in fleet_cases]
+        start = time.perf_counter()
+        expected = [compute_reward_loop(*args) for args in string_cases]
+        loop = (time.perf_counter() - start) / len(fleet_cases)
+        start = time.perf_counter()
+        results = [env.compute_reward(*args) for args in fleet_cases]
+        table = (time.perf_counter() - start) / len(fleet_cases)
+        # bitwise: compare the float64 bit patterns
+        mismatch = sum(not np.array_equal(np.asarray(a, dtype=np.float64).view(np.int64), b.view(np.int64))
+                       for a, b in zip(expected, results))
+        assert not mismatch, '%d of %d rewards differ' % (mismatch, len(fleet_cases))
+        print('reward %2d drones: if/elif %7.1f us  table %7.1f us  (%d status tuples, bitwise identical)'
+              % (n, loop * 1e6, table * 1e6, len(fleet_cases)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Env micro-benchmarks against a stand-in AirSim RPC server')
+    parser.add_argument('--port',       type=int,   default=41461)
+    parser.add_argument('--benchmarks', type=str,   nargs='+', default=['capture', 'sensors', 'monitor', 'rpcs', 'step', 'async', 'pool', 'profile', 'kinematic', 'spans', 'fleet', 'reward'],
+                        choices=['capture', 'sensors', 'monitor', 'rpcs', 'step', 'async', 'pool', 'profile', 'kinematic', 'spans', 'fleet', 'reward'])
+    parser.add_argument('--steps',      type=int,   default=20)
+    parser.add_argument('--latency',    type=float, default=0.002,
+                        help='seconds added to every RPC by the stand-in server')
+    parser.add_argument('--image_latency', type=float, default=0.001,
+                        help='seconds added per image rendered by the stand-in server')
+    parser.add_argument('--empty_rate', type=float, default=0.05,
+                        help='fraction of images returned empty, to exercise the retry')
+    parser.add_argument('--time_scale', type=float, default=0.1,
+                        help='wall-clock seconds per simulated second of a move')
+    parser.add_argument('--num_drone',  type=int,   default=3)
+    parser.add_argument('--img_height', type=int,   default=112)
+    parser.add_argument('--img_width',  type=int,   default=176)
+    parser.add_argument('--fleet_sizes', type=int,  nargs='+', default=[3, 8, 16, 32])
+    parser.add_argument('--pool_sizes', type=int,   nargs='+', default=[3, 10],
+                        help='fleet sizes of the connection pool benchmark')
+    parser.add_argument('--status_record', type=str, default='',
+                        help='JSON lines file of compute_reward arguments to check against (recorded if missing)')
+    parser.add_argument('--monitor_rate', type=float, default=20.,
+                        help='polls per second of the fixed-rate collision monitor')
+    args = parser.parse_args()
+
+    if 'capture' in args.benchmarks:
+        bench_capture(args.port, args.steps, latency=args.latency, image_latency=args.image_latency,
+                      empty_rate=args.empty_rate)
+    if 'sensors' in args.benchmarks:
+        bench_sensors(args.port, args.steps, latency=args.latency)
+    if 'monitor' in args.benchmarks:
+        bench_monitor(args.port, args.steps, args.monitor_rate, latency=args.latency)
+    if 'rpcs' in args.benchmarks:
+        bench_rpcs(args.port, args.steps, latency=args.latency, image_latency=args.image_latency,
+                   empty_rate=args.empty_rate, time_scale=args.time_scale)
+    if 'step' in args.benchmarks:
+        bench_step(args.port, args.steps, args.num_drone, latency=args.latency, image_latency=args.image_latency,
+                   empty_rate=args.empty_rate, time_scale=args.time_scale)
+    if 'async' in args.benchmarks:
+        bench_async(args.port, args.steps, args.num_drone, latency=args.latency, image_latency=args.image_latency,
+                    empty_rate=args.empty_rate, time_scale=args.time_scale)
+    if 'pool' in args.benchmarks:
+        bench_pool(args.port, args.steps, args.pool_sizes, latency=args.latency, image_latency=args.image_latency,
+                   empty_rate=args.empty_rate, time_scale=args.time_scale)
+    if 'profile' in args.benchmarks:
+        bench_profile(args.port, args.steps, args.num_drone, args.img_height, args.img_width, latency=args.latency,
+                      image_latency=args.image_latency, empty_rate=args.empty_rate)
+    if 'kinematic' in args.benchmarks:
+        bench_kinematic(args.steps * 10)
+    if 'spans' in args.benchmarks:
+        bench_spans(args.steps * 10)
+    if 'fleet' in args.benchmarks:
+        bench_fleet(args.fleet_sizes, args.steps * 50)
+    if 'reward' in args.benchmarks:
+        bench_reward(args.fleet_sizes, args.steps * 10, args.status_record)
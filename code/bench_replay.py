@@ -0,0 +1,183 @@
+import time
+import random
+import argparse
+import tempfile
+import importlib
+from collections import deque
+import numpy as np
+from batch_prefetcher import BatchPrefetcher
+from replay_memory import ReplayMemory, MmapReplayMemory, CompressedReplayMemory
+
+num_drone = 3
+num_cam = 4
+
+
+class LegacyMemory(object):
+    """
+    deque replay with per-sample batch assembly, as train_model did before
+    ReplayMemory. Kept here as the baseline for the benchmarks.
+    """
+
+    def __init__(self, capacity, state_size, pos_size, action_shape):
+        self.memory = deque(maxlen=capacity)
+        self.state_size = list(state_size)
+        self.pos_size = pos_size
+        self.action_shape = tuple(action_shape)
+
+    def __len__(self):
+        return len(self.memory)
+
+    def append(self, state, actions, reward, next_state, done):
+        self.memory.append((state, actions, reward, next_state, done))
+
+    def sample(self, batch_size):
+        batch = random.sample(self.memory, batch_size)
+        images = np.zeros([batch_size] + self.state_size)
+        vels = np.zeros([batch_size, self.pos_size])
+        actions = np.zeros((batch_size,) + self.action_shape)
+        rewards = np.zeros((batch_size))
+        next_images = np.zeros([batch_size] + self.state_size)
+        next_vels = np.zeros([batch_size, self.pos_size])
+        dones = np.zeros((batch_size))
+        for i, sample in enumerate(batch):
+            images[i], vels[i] = sample[0]
+            actions[i] = sample[1]
+            rewards[i] = sample[2]
+            next_images[i], next_vels[i] = sample[3]
+            dones[i] = sample[4]
+        return images, vels, actions, rewards, next_images, next_vels, dones, np.ones(batch_size), None
+
+    def update_priorities(self, indices, td_errors):
+        pass
+
+
+def synthetic_frame(rng, frame_shape, block=8):
+    """
+    Random frame made of flat block x block patches, so that the codecs see
+    roughly the redundancy of a rendered scene rather than white noise
+    """
+    h, w, c = frame_shape[1:]
+    small = rng.randint(0, 256, (1, -(-h // block), -(-w // block), c)).astype(np.uint8)
+    return small.repeat(block, axis=1).repeat(block, axis=2)[:, :h, :w]
+
+
+def fill(memory, n, state_size, pos_size, action_shape, ep_len=100, seed=0):
+    """
+    Fill memory with n synthetic transitions, built the way the training
+    loop builds them (rolling uint8 history, shared state/next_state)
+    """
+    rng = np.random.RandomState(seed)
+    frame_shape = (1,) + tuple(state_size[1:])
+    count = 0
+    while count < n:
+        image = synthetic_frame(rng, frame_shape)
+        history = np.stack([image] * state_size[0], axis=1)
+        state = [history, rng.rand(1, pos_size)]
+        for t in range(ep_len):
+            image = synthetic_frame(rng, frame_shape)
+            history = np.append(history[:, 1:], [image], axis=1)
+            next_state = [history, rng.rand(1, pos_size)]
+            done = t == ep_len - 1
+            memory.append(state, rng.rand(*action_shape), rng.rand(), next_state, done)
+            state = next_state
+            count += 1
+            if count == n:
+                break
+    return memory
+
+
+def time_calls(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def make_agent(name, state_size, pos_size, batch_size, memory_size, **kwargs):
+    """
+    Build an RDQN or RDDPG agent with the default hyperparameters of its
+    training script (kwargs are passed on to the agent)
+    """
+    module = importlib.import_module(name + '_tf1')
+    if name == 'rdqn':
+        return module.RDQNAgent(
+            state_size=state_size, pos_size=pos_size, action_size=7, lr=1e-4,
+            gamma=0.99, batch_size=batch_size, memory_size=memory_size,
+            epsilon=1, epsilon_end=0.05, decay_step=20000, load_model=False, **kwargs)
+    return module.RDDPGAgent(
+        state_size=state_size, pos_size=pos_size, action_size=3, actor_lr=1e-4,
+        critic_lr=5e-4, tau=5e-3, gamma=0.99, lambd=0.90, batch_size=batch_size,
+        memory_size=memory_size, epsilon=1, epsilon_end=0.05, decay_step=20000,
+        load_model=False, **kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay sampling / train_model micro-benchmark')
+    parser.add_argument('--agent',      type=str,   default=None, choices=['rdqn', 'rddpg'],
+                        help='also time a full agent.train_model() call')
+    parser.add_argument('--batch_sizes',type=int,   nargs='+', default=[32, 128, 512])
+    parser.add_argument('--memory_size',type=int,   default=2000)
+    parser.add_argument('--img_height', type=int,   default=112)
+    parser.add_argument('--img_width',  type=int,   default=176)
+    parser.add_argument('--seqsize',    type=int,   default=5)
+    parser.add_argument('--repeat',     type=int,   default=10)
+    parser.add_argument('--replay_dir', type=str,   default=None,
+                        help='directory for the mmap replay files (default: a temporary directory)')
+    parser.add_argument('--frame_codecs', type=str, nargs='*', default=['zlib', 'lz4', 'png'])
+    parser.add_argument('--codec_workers', type=int, default=4)
+    parser.add_argument('--prefetch',   type=int,   default=2,
+                        help='queue depth of the prefetched train_model row (0: skip it)')
+    args = parser.parse_args()
+
+    state_size = [args.seqsize, args.img_height, args.img_width, num_drone*num_cam]
+    pos_size = num_drone*3
+    if args.agent is None:
+        action_shape = (num_drone,)
+        memories = [
+            ('deque', LegacyMemory(args.memory_size, state_size, pos_size, action_shape)),
+            ('ring', ReplayMemory(args.memory_size, state_size, pos_size, action_shape)),
+            ('mmap', MmapReplayMemory(args.memory_size, state_size, pos_size, action_shape,
+                                      replay_dir=args.replay_dir or tempfile.mkdtemp(prefix='replay_'))),
+        ]
+        for codec in args.frame_codecs:
+            try:
+                memories.append((codec, CompressedReplayMemory(args.memory_size, state_size, pos_size, action_shape,
+                                                               codec=codec, workers=args.codec_workers)))
+            except ImportError as e:
+                print('Skipping %s: %s' % (codec, e))
+        for label, memory in memories:
+            start = time.perf_counter()
+            fill(memory, args.memory_size, state_size, pos_size, action_shape)
+            if isinstance(memory, CompressedReplayMemory):
+                print('fill        %-6s %8.2f s   compression %.2fx'
+                      % (label, time.perf_counter() - start, memory.compression_ratio()))
+        # the mmap store is timed from the page cache; capacities beyond RAM
+        # additionally pay for disk reads
+        for batch_size in args.batch_sizes:
+            for label, memory in memories:
+                sec = time_calls(lambda: memory.sample(batch_size), args.repeat)
+                print('sample      %-6s batch %4d: %8.2f ms  %8.1f samples/s'
+                      % (label, batch_size, sec * 1e3, batch_size / sec))
+    else:
+        agent = make_agent(args.agent, state_size, pos_size, args.batch_sizes[0], args.memory_size)
+        action_shape = agent.memory.actions.shape[1:]
+        memories = [
+            ('deque', LegacyMemory(args.memory_size, state_size, pos_size, action_shape)),
+            ('ring', agent.memory),
+        ]
+        for _, memory in memories:
+            fill(memory, args.memory_size, state_size, pos_size, action_shape)
+        for batch_size in args.batch_sizes:
+            agent.batch_size = batch_size
+            for label, memory in memories:
+                agent.memory = memory
+                sec = time_calls(agent.train_model, args.repeat)
+                print('train_model %-6s batch %4d: %8.2f ms' % (label, batch_size, sec * 1e3))
+            if args.prefetch:
+                agent.prefetcher = BatchPrefetcher(agent.memory, batch_size, args.prefetch)
+                sec = time_calls(agent.train_model, args.repeat)
+                print('train_model %-6s batch %4d: %8.2f ms  (%s)'
+                      % ('prefetch', batch_size, sec * 1e3, agent.prefetcher.report()))
+                agent.prefetcher.stop()
+                agent.prefetcher = None
@@ -0,0 +1,87 @@
+import os
+import json
+import argparse
+import cv2
+
+settings_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UE4', 'setting_json', 'settings.json')
+# AirSim's Scene capture size when settings.json does not set one
+default_size = (144, 256)
+
+
+def model_frame(img, img_height, img_width):
+    """
+    One camera frame as the networks take it: (img_height, img_width) uint8
+    grayscale, min-max normalized. Frames captured at that size already (see
+    write_profile) are not resized
+    """
+    if img.shape[:2] != (img_height, img_width):
+        img = cv2.resize(img, (img_width, img_height))
+    dimg = cv2.cvtColor(img[:,:,:3], cv2.COLOR_BGR2GRAY)
+    return cv2.normalize(dimg, None, 0, 255, cv2.NORM_MINMAX)
+
+
+def scene_capture(capture_settings):
+    # the Scene (ImageType 0) entry of a CaptureSettings list, None if there is none
+    for capture in capture_settings:
+        if capture.get('ImageType', 0) == 0:
+            return capture
+    return None
+
+
+def capture_size(settings):
+    """
+    (height, width) of the Scene images AirSim sends for a settings dict,
+    from CameraDefaults
+    """
+    capture = scene_capture(settings.get('CameraDefaults', {}).get('CaptureSettings', []))
+    if capture is None:
+        return default_size
+    return capture.get('Height', default_size[0]), capture.get('Width', default_size[1])
+
+
+def capture_profile(settings, img_height, img_width):
+    """
+    Set the Scene CaptureSettings of a settings dict to img_height x
+    img_width: in CameraDefaults and in any camera of a vehicle that sets its
+    own. Other capture settings (FOV, ...) are kept
+    """
+    cameras = [settings.setdefault('CameraDefaults', {})]
+    for vehicle in settings.get('Vehicles', {}).values():
+        cameras += [camera for camera in vehicle.get('Cameras', {}).values() if 'CaptureSettings' in camera]
+    for camera in cameras:
+        capture_settings = camera.setdefault('CaptureSettings', [])
+        capture = scene_capture(capture_settings)
+        if capture is None:
+            capture = {'ImageType': 0}
+            capture_settings.append(capture)
+        capture['Width'] = img_width
+        capture['Height'] = img_height
+    return settings
+
+
+def write_profile(img_height, img_width, path=settings_path, out=None):
+    """
+    Write the settings.json at path (to out, default: in place) with the
+    Scene images captured at the model resolution
+    """
+    with open(path) as f:
+        settings = json.load(f)
+    capture_profile(settings, img_height, img_width)
+    with open(path if out is None else out, 'w') as f:
+        json.dump(settings, f, indent='\t')
+    return settings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Set the camera capture size of settings.json to the model input size')
+    parser.add_argument('--img_height', type=int,   default=112)
+    parser.add_argument('--img_width',  type=int,   default=176)
+    parser.add_argument('--settings',   type=str,   default=settings_path)
+    parser.add_argument('--out',        type=str,   default=None,
+                        help='where to write the settings (default: update --settings in place)')
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        height, width = capture_size(json.load(f))
+    write_profile(args.img_height, args.img_width, args.settings, args.out)
+    print('Scene capture %dx%d -> %dx%d: %s' % (width, height, args.img_width, args.img_height, args.out or args.settings))
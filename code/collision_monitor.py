@@ -0,0 +1,106 @@
+import time
+import asyncio
+import numpy as np
+
+
+class CollisionMonitor(object):
+    """
+    Watches the drones for collisions and landings during the settle window
+    of Env.step, polling their state at a fixed rate instead of as fast as
+    the RPC channel allows.
+
+    A drone counts as landed when its velocity is exactly zero or it is below
+    floor_z. has_collided is debounced: a drone is flagged once it was seen
+    collided or landed on debounce polls of the window. landed is debounced
+    the same way with debounce_landed, else it is the last poll's reading.
+    rate=0 polls back to back; with debounce=11 and debounce_landed=False
+    that is the original settle loop.
+
+    clock and sleep are injectable so the timing can be driven without the
+    simulator.
+    """
+
+    def __init__(self, dc, droneList, rate=20., debounce=3, floor_z=0., clock=time.monotonic, sleep=time.sleep,
+                 debounce_landed=True):
+        self.dc = dc
+        self.droneList = droneList
+        self.rate = rate
+        self.debounce = debounce
+        self.debounce_landed = debounce_landed
+        self.floor_z = floor_z
+        self.clock = clock
+        self.sleep = sleep
+        self.reset()
+
+    def reset(self):
+        n = len(self.droneList)
+        self.collision_count = np.zeros(n, dtype=int)
+        self.landed_count = np.zeros(n, dtype=int)
+        self.has_collided = np.zeros(n, dtype=bool)
+        self.landed = np.zeros(n, dtype=bool)
+        self.polls = 0
+
+    def poll(self):
+        """
+        Method to read every drone's state once (in parallel with a
+        DroneControl connection pool) and update the flags
+        """
+        self.update(self.dc.dispatch(self.dc.getTelemetry, self.droneList))
+
+    def update(self, telemetries):
+        """
+        Method to update the flags from one Telemetry per drone
+        """
+        landed = np.zeros(len(self.droneList), dtype=bool)
+        for id, telemetry in enumerate(telemetries):
+            vel = telemetry.kinematics.linear_velocity
+            land = (vel.x_val == 0 and vel.y_val == 0 and vel.z_val == 0) or telemetry.position.z_val > self.floor_z
+            if land:
+                self.landed_count[id] += 1
+                landed[id] = True
+            if land or telemetry.has_collided:
+                self.collision_count[id] += 1
+        self.polls += 1
+        self.landed = self.landed_count >= self.debounce if self.debounce_landed else landed
+        self.has_collided = self.collision_count >= self.debounce
+
+    def watch(self, duration):
+        """
+        Method to poll for duration seconds, or until a drone is flagged
+        has_collided. Returns has_collided (a bool array)
+        """
+        self.reset()
+        start = self.clock()
+        while self.clock() - start < duration:
+            self.poll()
+            if self.has_collided.any():
+                break
+            if self.rate > 0:
+                next_poll = start + self.polls / float(self.rate)
+                wait = min(next_poll, start + duration) - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+                if next_poll >= start + duration:
+                    break
+        return self.has_collided
+
+    async def watch_async(self, duration, read):
+        """
+        watch for an asyncio step: read is a coroutine function returning
+        one Telemetry per drone (e.g. the drones' reads gathered), and the
+        waits between polls yield to the event loop
+        """
+        self.reset()
+        start = self.clock()
+        while self.clock() - start < duration:
+            self.update(await read())
+            if self.has_collided.any():
+                break
+            if self.rate > 0:
+                next_poll = start + self.polls / float(self.rate)
+                wait = min(next_poll, start + duration) - self.clock()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if next_poll >= start + duration:
+                    break
+        return self.has_collided
@@ -0,0 +1,85 @@
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+from keras.layers import TimeDistributed, BatchNormalization, Lambda
+
+
+class EmbeddingCache(object):
+    """
+    Acting-time inference for the RDQN critic / RDDPG actor that encodes each
+    frame only once.
+
+    The models start with BatchNormalization on the (cast) image history
+    followed by a TimeDistributed conv stack, so every frame is encoded
+    independently of the others. The cache builds a per-frame encoder that shares those
+    layers' weights, keeps the embeddings of the last seqsize frames, and
+    runs the recurrent head by feeding the embeddings in place of the
+    TimeDistributed(Flatten) output. get_action then only pushes the newest
+    frame through the conv stack.
+
+    Cached embeddings are only valid for the weights they were computed
+    with: call invalidate() whenever the model's weights change.
+    """
+
+    def __init__(self, model, sess):
+        self.model = model
+        self.sess = sess
+        image = model.inputs[0]
+        self.seqsize = int(image.shape[1])
+        bn = [l for l in model.layers if isinstance(l, BatchNormalization)][0]
+        tds = [l for l in model.layers if isinstance(l, TimeDistributed)]
+        # the uint8 -> float32 cast between the image input and the BN
+        casts = [l for l in model.layers if isinstance(l, Lambda) and l.output is bn.input and l.input is image]
+        if bn.input is not image and not casts:
+            raise ValueError('EmbeddingCache expects BatchNormalization on the (cast) image input')
+
+        # per-frame encoder: inference-mode BN with the model's moving statistics, then the wrapped layers
+        self.frames = tf.placeholder(image.dtype, (None,) + tuple(int(d) for d in image.shape[2:]))
+        x = self.frames
+        for cast in casts:
+            x = cast.call(x)
+        x = tf.nn.batch_normalization(x, bn.moving_mean, bn.moving_variance, bn.beta, bn.gamma, bn.epsilon)
+        for td in tds:
+            x = td.layer.call(x)
+        self.encoded = x
+        # fed with the cached embeddings
+        self.embedding = tds[-1].output
+        self.feed_inputs = model.inputs[1:]
+
+        self.cache = None
+        self.cached_frames = None
+        self.encoded_frames = 0
+
+    def invalidate(self):
+        self.cache = None
+        self.cached_frames = None
+
+    def encode(self, frames):
+        self.encoded_frames += len(frames)
+        return self.sess.run(self.encoded, feed_dict={self.frames: frames, K.learning_phase(): 0})
+
+    def update(self, history):
+        """
+        Method to bring the cache up to date with a (1, seqsize, H, W, C)
+        history, encoding only the frames it has not seen
+        """
+        frames = history[0]
+        if self.cache is not None and np.array_equal(frames[:-1], self.cached_frames[1:]):
+            self.cache = np.roll(self.cache, -1, axis=0)
+            self.cache[-1] = self.encode(frames[-1:])[0]
+            self.cached_frames = np.roll(self.cached_frames, -1, axis=0)
+            self.cached_frames[-1] = frames[-1]
+        else:
+            # new episode or new weights
+            self.cache = self.encode(frames)
+            self.cached_frames = np.array(frames)
+
+    def predict(self, inputs):
+        """
+        Method with the signature of model.predict for a single state
+        [history, vel, ...]
+        """
+        self.update(inputs[0])
+        feed = {self.embedding: self.cache[np.newaxis], K.learning_phase(): 0}
+        feed.update(zip(self.feed_inputs, inputs[1:]))
+        return self.sess.run(self.model.outputs, feed_dict=feed)
@@ -0,0 +1,180 @@
+import os
+import json
+import atexit
+import threading
+import numpy as np
+
+manifest_name = 'manifest.json'
+version = 1
+# record kinds
+RESET, STEP = 0, 1
+
+
+class EpisodeRecorder(object):
+    """
+    Env wrapper that streams every reset / step to disk: the actions, the
+    camera frames and positions of the observation, the detections, rewards,
+    done flags and info dicts.
+
+    Records are appended in chunks of chunk_steps (one uncompressed .npz per
+    chunk, written by a background thread); a chunk file is never rewritten.
+    After each chunk the JSON manifest listing the chunks is atomically
+    replaced, so a crash loses at most the unflushed records. Anything else
+    is passed through to the wrapped env.
+    """
+
+    def __init__(self, env, path, chunk_steps=64):
+        self.env = env
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self.pending = []
+        self.thread = None
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if os.path.exists(os.path.join(path, manifest_name)):
+            # append to an earlier recording
+            with open(os.path.join(path, manifest_name)) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'version': version, 'records': 0, 'chunks': []}
+        atexit.register(self.close)
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def reset(self):
+        observation = self.env.reset()
+        self.record(RESET, None, observation, None, False, None)
+        return observation
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        self.record(STEP, action, observation, reward, done, info)
+        return observation, reward, done, info
+
+    def disconnect(self):
+        self.close()
+        self.env.disconnect()
+
+    def record(self, kind, action, observation, reward, done, info):
+        images, positions = observation
+        self.pending.append({
+            'kind': kind,
+            'action': None if action is None else np.asarray(action, dtype=np.float32),
+            'frames': np.stack(images),
+            'positions': np.asarray(positions),
+            'detections': np.array(getattr(self.env, 'detections', np.empty(0)), dtype=np.float32),
+            'reward': None if reward is None else np.asarray(reward, dtype=float),
+            'done': done,
+            'info': json.dumps(info, default=lambda o: o.item()),
+        })
+        if len(self.pending) >= self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        # actions and rewards of the resets are blanks shaped like those of the steps
+        steps = [r for r in records if r['kind'] == STEP]
+        action_shape = steps[0]['action'].shape if steps else (0,)
+        reward_shape = steps[0]['reward'].shape if steps else (0,)
+        arrays = {
+            'kind': np.array([r['kind'] for r in records], dtype=np.uint8),
+            'actions': np.stack([np.zeros(action_shape, np.float32) if r['action'] is None else r['action'] for r in records]),
+            'frames': np.stack([r['frames'] for r in records]),
+            'positions': np.stack([r['positions'] for r in records]),
+            'detections': np.stack([r['detections'] for r in records]),
+            'rewards': np.stack([np.full(reward_shape, np.nan) if r['reward'] is None else r['reward'] for r in records]),
+            'dones': np.array([r['done'] for r in records], dtype=bool),
+            'infos': np.array([r['info'] for r in records]),
+        }
+        self.wait()
+        name = 'chunk_%06d.npz' % len(self.manifest['chunks'])
+        self.manifest['chunks'].append(name)
+        self.manifest['records'] += len(records)
+        manifest = dict(self.manifest, chunks=list(self.manifest['chunks']))
+        self.thread = threading.Thread(target=self.write, args=(name, arrays, manifest))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def write(self, name, arrays, manifest):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        # commit: atomically replace the manifest
+        tmp = os.path.join(self.path, manifest_name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, manifest_name))
+
+    def close(self):
+        self.flush()
+        self.wait()
+
+
+class ReplayEnv(object):
+    """
+    Env stand-in that serves a recording of EpisodeRecorder back, in order
+    and at disk speed, with the reset / step / disconnect interface of Env.
+
+    step() returns the recorded outcome whatever the action; with
+    check_actions it raises ValueError when the action differs from the
+    recorded one. reset() skips what is left of the current episode. At the
+    end of the recording EOFError is raised, or with loop it starts over.
+    """
+
+    def __init__(self, path, check_actions=False, loop=False):
+        self.path = path
+        self.check_actions = check_actions
+        self.loop = loop
+        with open(os.path.join(path, manifest_name)) as f:
+            self.manifest = json.load(f)
+        if not self.manifest['chunks']:
+            raise ValueError('Empty recording: %s' % path)
+        self.chunk_index = -1
+        self.chunk = None
+        self.pos = 0
+        self.detections = None
+
+    def next_record(self):
+        while self.chunk is None or self.pos >= len(self.chunk['kind']):
+            self.chunk_index += 1
+            if self.chunk_index >= len(self.manifest['chunks']):
+                if not self.loop:
+                    raise EOFError('End of recording: %s' % self.path)
+                self.chunk_index = 0
+            with np.load(os.path.join(self.path, self.manifest['chunks'][self.chunk_index])) as arrays:
+                self.chunk = {key: arrays[key] for key in arrays.files}
+            self.pos = 0
+        i = self.pos
+        self.pos += 1
+        return {key: value[i] for key, value in self.chunk.items()}
+
+    def observation(self, record):
+        self.detections = record['detections']
+        return [list(record['frames']), record['positions']]
+
+    def reset(self):
+        record = self.next_record()
+        while record['kind'] != RESET:
+            record = self.next_record()
+        return self.observation(record)
+
+    def step(self, action):
+        record = self.next_record()
+        if record['kind'] != STEP:
+            raise ValueError('Recording has a reset here: the episode ended earlier than when it was recorded')
+        if self.check_actions and not np.allclose(np.asarray(action, dtype=np.float32), record['actions']):
+            raise ValueError('Action %s differs from the recorded %s' % (action, record['actions']))
+        return self.observation(record), record['rewards'].tolist(), bool(record['dones']), json.loads(str(record['infos']))
+
+    def disconnect(self):
+        pass
@@ -0,0 +1,72 @@
+import zlib
+import numpy as np
+
+# codecs that can be selected with --frame_codec ('none' stores raw uint8 frames)
+codec_names = ['none', 'zlib', 'lz4', 'png']
+
+
+class ZlibCodec(object):
+    """
+    zlib (deflate) on the raw uint8 bytes of a frame
+    """
+    name = 'zlib'
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def encode(self, frame):
+        return zlib.compress(np.ascontiguousarray(frame).tobytes(), self.level)
+
+    def decode(self, data, out):
+        out[...] = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(out.shape)
+
+
+class Lz4Codec(object):
+    """
+    LZ4 frame format on the raw uint8 bytes of a frame (needs the lz4 package)
+    """
+    name = 'lz4'
+
+    def __init__(self):
+        import lz4.frame
+        self.lz4 = lz4.frame
+
+    def encode(self, frame):
+        return self.lz4.compress(np.ascontiguousarray(frame).tobytes())
+
+    def decode(self, data, out):
+        out[...] = np.frombuffer(self.lz4.decompress(data), dtype=np.uint8).reshape(out.shape)
+
+
+class PngCodec(object):
+    """
+    Lossless PNG via cv2.imencode. PNG has at most 4 channels, so the
+    (height, width, channels) frame is encoded as a (height, width*channels)
+    grayscale image.
+    """
+    name = 'png'
+
+    def __init__(self, level=1):
+        import cv2
+        self.cv2 = cv2
+        self.params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+
+    def encode(self, frame):
+        ok, data = self.cv2.imencode('.png', frame.reshape(frame.shape[0], -1), self.params)
+        if not ok:
+            raise ValueError('PNG encoding failed')
+        return data.tobytes()
+
+    def decode(self, data, out):
+        img = self.cv2.imdecode(np.frombuffer(data, dtype=np.uint8), self.cv2.IMREAD_UNCHANGED)
+        out[...] = img.reshape(out.shape)
+
+
+def make_codec(name):
+    if name == 'zlib':
+        return ZlibCodec()
+    if name == 'lz4':
+        return Lz4Codec()
+    if name == 'png':
+        return PngCodec()
+    raise ValueError('Unknown frame codec: %s' % name)
@@ -19,10 +19,11 @@ grid_pad = np.pad(grid, pad_size, mode='constant', constant_values=-1).astype(fl
 # Display the cells
 #np.savetxt("grid.csv", grid_pad, delimiter=",", fmt='%s')
 
-def reset_grid():
+def reset_grid(record_grid=True):
     global grid_pad
     grid_pad = np.pad(grid, pad_size, mode='constant', constant_values=-1).astype(float)
-    record()
+    if record_grid:
+        record()
 
 def add_data(i, j, data):
     #print("i:", i)
@@ -56,7 +57,7 @@ def rad_to_deg(rad):
     return rad*180/math.pi
 
 # main function 
-def covered_area(pos_x, pos_y, yaw, camList, cam_shifted_angle):
+def covered_area(pos_x, pos_y, yaw, camList, cam_shifted_angle, record_grid=True):
     # Note: calculated angles are in radians.
     
     # separation angle between camera in drone
@@ -72,7 +73,7 @@ def covered_area(pos_x, pos_y, yaw, camList, cam_shifted_angle):
         #print("cam_yaw: ", rad_to_deg(cam_yaw))
         pos = np.array([pos_x, pos_y])
         trans = np.array([proj_dist* math.cos(cam_yaw), proj_dist* math.sin(cam_yaw)])
-        f_pos = np.sum([pos, trans], axis=0)
+        f_pos = pos + trans
         #print("pos: ", pos)
         #print("trans: ", trans)
         #print("f_pos: ", f_pos)
@@ -91,11 +92,17 @@ def covered_area(pos_x, pos_y, yaw, camList, cam_shifted_angle):
         spread_j = [j + j1 for j in range(-spread_size, spread_size+1)]
         #print("spread_i: ", spread_i)
         #print("spread_j: ", spread_j)
-        for i in spread_i:
-            for j in spread_j:
-                add_data(i, j, cell_value)
-
-    record()
+        # add_data over the whole block: fill the cells that are not -1
+        if spread_size <= i1 < grid_pad.shape[0] - spread_size and spread_size <= j1 < grid_pad.shape[1] - spread_size:
+            block = grid_pad[i1 - spread_size:i1 + spread_size + 1, j1 - spread_size:j1 + spread_size + 1]
+            block[block != -1] = cell_value
+        else:
+            # at the edge of the grid the indices wrap around (or raise) as the per-cell loop did
+            block = np.ix_(spread_i, spread_j)
+            grid_pad[block] = np.where(grid_pad[block] != -1, cell_value, grid_pad[block])
+
+    if record_grid:
+        record()
     #print("Done")
 
     # get total summation for the reward
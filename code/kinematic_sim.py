@@ -0,0 +1,448 @@
+import math
+from collections import namedtuple
+import numpy as np
+from grid_coverage import covered_area, reset_grid
+
+# Stand-ins for the airsim message types Env reads (only the fields it uses)
+Vector3r = namedtuple('Vector3r', ['x_val', 'y_val', 'z_val'])
+Quaternionr = namedtuple('Quaternionr', ['w_val', 'x_val', 'y_val', 'z_val'])
+Pose = namedtuple('Pose', ['position', 'orientation'])
+KinematicsState = namedtuple('KinematicsState', ['position', 'orientation', 'linear_velocity', 'angular_velocity'])
+CollisionInfo = namedtuple('CollisionInfo', ['has_collided'])
+GeoPoint = namedtuple('GeoPoint', ['latitude', 'longitude', 'altitude'])
+MultirotorState = namedtuple('MultirotorState', ['collision', 'kinematics_estimated', 'gps_location'])
+DistanceSensorData = namedtuple('DistanceSensorData', ['distance'])
+# same fields as DroneControlAPI_yv4.Telemetry
+Telemetry = namedtuple('Telemetry', ['position', 'orientation', 'kinematics', 'has_collided', 'distances'])
+
+IDENTITY = Quaternionr(1., 0., 0., 0.)
+ZERO = Vector3r(0., 0., 0.)
+# color the target is drawn in; the ground texture stays within 40..199, so a 255 in the last channel is the target
+TARGET_COLOR = np.array([0, 0, 255], dtype=np.uint8)
+
+
+def vector(v):
+    # from a NumPy (3,) array
+    return Vector3r(*v.tolist())
+
+
+class BoxWorld(object):
+    """
+    Map of the kinematic sim in the UE4 frame (NED, meters): axis-aligned
+    obstacle boxes, each given as (min xyz, max xyz), and the target to
+    search for, standing on the ground
+    """
+
+    def __init__(self, boxes, target=(12., 25., 0.), target_size=(0.6, 1.8)):
+        self.boxes = np.array(boxes, dtype=float).reshape(-1, 2, 3)
+        # (min, max) corners of the boxes inflated by a radius, by radius
+        self.inflated = {}
+        self.target = np.array(target, dtype=float)
+        self.target_width, self.target_height = target_size
+        # the target's center, for projection and line of sight
+        self.target_center = self.target - [0., 0., self.target_height / 2.]
+
+    def raycast(self, origins, dirs, max_range):
+        """
+        Distance along each ray (origins (n, 3), unit dirs (n, k, 3)) to the
+        nearest box, max_range if none is hit. Returns (n, k)
+        """
+        if not len(self.boxes):
+            return np.full(dirs.shape[:2], max_range)
+        o = origins[:, None, None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv = 1. / dirs[:, :, None, :]
+            t1 = (self.boxes[None, None, :, 0] - o) * inv
+            t2 = (self.boxes[None, None, :, 1] - o) * inv
+        # fmin/fmax skip the nan of a ray lying exactly on a box face
+        near = np.fmin(t1, t2).max(axis=-1)
+        far = np.fmax(t1, t2).min(axis=-1)
+        hit = (far >= np.maximum(near, 0.)) & (far > 0.)
+        dist = np.where(hit, np.maximum(near, 0.), max_range)
+        return np.minimum(dist.min(axis=-1), max_range)
+
+    def inside(self, positions, radius):
+        p = positions[:, None, :]
+        return ((p > self.boxes[:, 0] - radius) & (p < self.boxes[:, 1] + radius)).all(axis=-1).any(axis=-1)
+
+    def sweep(self, starts, ends, radius):
+        """
+        Fraction of each segment starts -> ends (n, 3) at which it first
+        enters a box inflated by radius, inf if it does not. Returns (n,)
+        """
+        if radius not in self.inflated:
+            self.inflated[radius] = self.boxes[:, 0] - radius, self.boxes[:, 1] + radius
+        low, high = self.inflated[radius]
+        # only the boxes the segment's bounding box overlaps can be hit
+        overlap = ((np.minimum(starts, ends)[:, None] < high) & (np.maximum(starts, ends)[:, None] > low)).all(axis=-1)
+        if not overlap.any():
+            return np.full(len(starts), np.inf)
+        o = starts[:, None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv = 1. / (ends - starts)[:, None, :]
+            t1 = (low - o) * inv
+            t2 = (high - o) * inv
+        near = np.fmin(t1, t2).max(axis=-1)
+        far = np.fmax(t1, t2).min(axis=-1)
+        entry = np.maximum(near, 0.)
+        hit = (far > entry) & (entry <= 1.)
+        return np.where(hit, entry, np.inf).min(axis=-1)
+
+
+def default_world():
+    # pillars inside the small boundary and walls just outside the out_range limits of Env
+    pillars = [[(x - 1., y - 1., -20.), (x + 1., y + 1., 0.)] for x, y in [(8, -15), (-8, 10), (10, 30), (-12, -30)]]
+    walls = [[(-23., -43., -20.), (23., -42., 0.)], [(-23., 42., -20.), (23., 43., 0.)],
+             [(-23., -43., -20.), (-22., 43., 0.)], [(22., -43., -20.), (23., 43., 0.)]]
+    return BoxWorld(pillars + walls)
+
+
+class Future(object):
+    """
+    Returned by the *Async methods like an AirSim future: join() runs the
+    sim until the drone's command is done or replaced by a newer one
+    """
+
+    def __init__(self, sim, id, command):
+        self.sim = sim
+        self.id = id
+        self.command = command
+
+    def join(self):
+        while self.sim.command[self.id] is self.command and not self.command.get('done'):
+            event = self.sim.next_event()
+            if event is None:
+                # paused: the command never ends
+                break
+            self.sim.advance(event - self.sim.time)
+
+
+class KinematicDroneControl(object):
+    """
+    Headless stand-in for DroneControl: a kinematic multirotor model in a
+    BoxWorld, procedural camera images and a synthetic target detector, with
+    the methods Env uses. Nothing needs AirSim or a GPU, so Env runs as
+    fast as NumPy allows.
+
+    Each drone follows its last command (body-frame velocity for a
+    duration, or hover) with a first-order velocity lag of time constant
+    tau, integrated in closed form; a move to a position flies there in a
+    straight line at its speed. Drones never yaw, so body frame is world
+    frame. Time is simulated: it only advances in sleep() and in join() of
+    the async moves, in one step from one command end to the next. Each
+    step is swept along a straight line against the boxes (inflated by
+    radius): a drone that enters one collides and stops where it entered;
+    the ground stops it at z=0. A hovering drone slower than rest_speed
+    comes to rest, and drones at rest are not integrated.
+
+    Images show a blocky ground texture shifted with the camera's view,
+    with the target drawn as a TARGET_COLOR rectangle when it is in view
+    and not hidden by a box. predict_yv4 finds that rectangle.
+    """
+
+    def __init__(self, droneList, drone_id=0, inference=True, world=None, img_height=144, img_width=256,
+                 tau=0.2, rest_speed=1e-3, radius=0.5, dsensor_num=8, dsensor_range=40., vel_noise=0.02, seed=0):
+        self.droneList = droneList
+        self.index = {drone: id for id, drone in enumerate(droneList)}
+        self.inference = inference
+        self.world = default_world() if world is None else world
+        self.img_height = img_height
+        self.img_width = img_width
+        self.tau = tau
+        self.rest_speed = rest_speed
+        self.radius = radius
+        self.dsensor_range = dsensor_range
+        # AirSim never reports an exactly zero velocity for a flying drone, which Env reads as landed
+        self.vel_noise = vel_noise
+        self.rng = np.random.RandomState(seed)
+        n = len(droneList)
+        # spawn points in the UE4 frame, 6 m apart in rows of up to 8 along y (rows 6 m apart along x);
+        # positions given to the move methods are relative to them
+        rows, cols = (n - 1) // 8 + 1, min(n, 8)
+        self.spawn = np.zeros((n, 3))
+        self.spawn[:, 0] = 6. * (np.arange(n) // 8 - (rows - 1) / 2.)
+        self.spawn[:, 1] = 6. * (np.arange(n) % 8 - (cols - 1) / 2.)
+        self.z_offset = 0.
+        # Distance1..N sensors, horizontal and evenly spread around the drone
+        angles = 2 * np.pi * np.arange(dsensor_num) / dsensor_num
+        self.dsensor_dirs = np.stack([np.cos(angles), np.sin(angles), np.zeros(dsensor_num)], axis=1)
+        self.dsensor_names = {"Distance" + str(i + 1): i for i in range(dsensor_num)}
+        # camera fov 90 degrees; back_center (cam 4) faces backwards before its pose is set
+        self.focal = (img_width / 2.) / math.tan(math.radians(45))
+        self.cam_base_yaw = {'0': 0., '1': 0., '2': 0., '3': 0., '4': 180.}
+        # blocky ground texture, tiled 2x2 so any view offset is a plain slice
+        block = 8
+        tile = self.rng.randint(40, 200, (img_height // block + 1, img_width // block + 1, 3)).astype(np.uint8)
+        tile = np.repeat(np.repeat(tile, block, axis=0), block, axis=1)[:img_height, :img_width]
+        self.texture = np.tile(tile, (2, 2, 1))
+        self.gps_origin = (47.641468, -122.140165)
+        self.time = 0.
+        self.paused = False
+        self.resetAndRearm_Drones()
+
+    # sim clock, for Env's collision monitor and settle sleeps
+    def clock(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        end = self.time + seconds
+        while self.time < end - 1e-9:
+            event = self.next_event()
+            self.integrate((end if event is None else min(end, event)) - self.time)
+
+    def next_event(self):
+        # sim time at which the first running command ends (None: none runs, or paused)
+        if self.paused:
+            return None
+        events = []
+        for id, command in enumerate(self.command):
+            if command['type'] == 'velocity':
+                events.append(command['until'])
+            elif command['type'] == 'position':
+                dist = np.linalg.norm(command['target'] - self.pos[id])
+                events.append(min(command['until'], self.time + dist / command['speed']))
+        return max(min(events), self.time + 1e-6) if events else None
+
+    def integrate(self, dt):
+        # advance the drones by dt, within which no command ends
+        self.time += dt
+        if self.paused:
+            return
+        # drones at rest with nothing to do, and crashed ones, stay put
+        moving = self.vel.any(axis=1).tolist()
+        collided = self.collided.tolist()
+        ids = [id for id, command in enumerate(self.command)
+               if not collided[id] and (command['type'] != 'hover' or moving[id])]
+        hit = np.zeros(len(self.droneList), dtype=bool)
+        if ids:
+            hit[ids] = self.fly(ids, dt)
+        for id, command in enumerate(self.command):
+            if command['type'] == 'velocity':
+                done = self.time >= command['until'] - 1e-9
+            elif command['type'] == 'position':
+                done = self.time >= command['until'] - 1e-9 or (self.pos[id] == command['target']).all()
+            else:
+                continue
+            # a crashed drone gives up its command
+            if done or hit[id] or self.collided[id]:
+                command['done'] = True
+                self.command[id] = {'type': 'hover', 'done': True}
+
+    def fly(self, ids, dt):
+        # move the drones ids along their commands for dt; returns which of them hit a box
+        # all of them (the usual case): no gather / scatter
+        every = len(ids) == len(self.droneList)
+        start, vel = (self.pos, self.vel) if every else (self.pos[ids], self.vel[ids])
+        desired = np.zeros_like(vel)
+        for k, id in enumerate(ids):
+            if self.command[id]['type'] == 'velocity':
+                desired[k] = self.command[id]['velocity']
+        # first-order lag towards the desired velocity, in closed form
+        decay = math.exp(-dt / self.tau)
+        lag = vel - desired
+        pos = start + desired * dt + lag * (self.tau * (1. - decay))
+        vel = desired + lag * decay
+        for k, id in enumerate(ids):
+            command = self.command[id]
+            if command['type'] == 'position':
+                delta = command['target'] - start[k]
+                dist = math.sqrt(delta.dot(delta))
+                if dist <= command['speed'] * dt + 1e-6:
+                    pos[k], vel[k] = command['target'], 0.
+                else:
+                    vel[k] = delta * (command['speed'] / dist)
+                    pos[k] = start[k] + vel[k] * dt
+        # swept along the straight line of the step: the boxes stop the drone where it enters them
+        entry = self.world.sweep(start, pos, self.radius)
+        hit = entry <= 1.
+        if hit.any():
+            self.collided[np.array(ids)[hit]] = True
+            pos[hit] = start[hit] + (pos[hit] - start[hit]) * np.maximum(entry[hit] - 1e-3, 0.)[:, None]
+        # the ground at z=0
+        ground = pos[:, 2] > 0.
+        stop = hit | ground
+        if stop.any():
+            pos[ground, 2] = 0.
+            vel[stop] = 0.
+        # at rest once the velocity has died out
+        vel[np.abs(vel).max(axis=1) < self.rest_speed] = 0.
+        if every:
+            self.pos, self.vel = pos, vel
+        else:
+            self.pos[ids], self.vel[ids] = pos, vel
+        return hit
+
+    def command_drone(self, drone, command):
+        id = self.index[drone]
+        command.setdefault('done', False)
+        self.command[id] = command
+        return Future(self, id, command)
+
+    # connection / episode
+    def resetAndRearm_Drones(self):
+        self.pos = self.spawn.copy()
+        self.vel = np.zeros_like(self.pos)
+        self.collided = np.zeros(len(self.droneList), dtype=bool)
+        self.command = [{'type': 'hover', 'done': True} for _ in self.droneList]
+        self.cam_yaw = {drone: {} for drone in self.droneList}
+        self.cam_pitch = {drone: {} for drone in self.droneList}
+
+    def shutdown_AirSim(self):
+        pass
+
+    def simPause(self, pause):
+        self.paused = pause
+
+    def dispatch(self, fn, drones, *args):
+        # one simulation: the drones' work runs one after the other
+        return list(map(fn, drones, *args))
+
+    def reset_area(self):
+        reset_grid(record_grid=False)
+
+    # state
+    def reported_velocity(self, id):
+        # a drone standing on the ground reports zero velocity, as in AirSim
+        if self.pos[id, 2] >= 0. and not self.vel[id].any():
+            return ZERO
+        return vector(self.vel[id] + self.rng.normal(0., self.vel_noise, 3))
+
+    def getMultirotorState(self, drone):
+        id = self.index[drone]
+        kinematics = KinematicsState(vector(self.pos[id] - self.spawn[id]), IDENTITY, self.reported_velocity(id), ZERO)
+        return MultirotorState(CollisionInfo(bool(self.collided[id])), kinematics, self.getGpsData(drone))
+
+    def getGpsData(self, drone):
+        x, y, z = self.pos[self.index[drone]]
+        lat = self.gps_origin[0] + x / 111111.
+        lon = self.gps_origin[1] + y / (111111. * math.cos(math.radians(self.gps_origin[0])))
+        return GeoPoint(lat, lon, 122. - z)
+
+    def getDronePosition(self, drone):
+        return vector(self.pos[self.index[drone]])
+
+    def getYawDeg(self, drone):
+        return 0.
+
+    def simGetCollisionInfo(self, drone):
+        return CollisionInfo(bool(self.collided[self.index[drone]]))
+
+    def getDistanceDataArray(self, dist_sensors, drones=None):
+        drones = self.droneList if drones is None else drones
+        ids = [self.index[drone] for drone in drones]
+        cols = [self.dsensor_names[dist_sensor] for dist_sensor in dist_sensors]
+        if not cols:
+            return np.empty((len(ids), 0), dtype=np.float32)
+        dirs = np.broadcast_to(self.dsensor_dirs[cols], (len(ids), len(cols), 3))
+        return self.world.raycast(self.pos[ids], dirs, self.dsensor_range).astype(np.float32)
+
+    def getDistanceData(self, dist_sensor, drone):
+        return DistanceSensorData(float(self.getDistanceDataArray([dist_sensor], [drone])[0, 0]))
+
+    def getTelemetry(self, drone, dist_sensors=(), distances=None):
+        id = self.index[drone]
+        kinematics = KinematicsState(vector(self.pos[id] - self.spawn[id]), IDENTITY, self.reported_velocity(id), ZERO)
+        if distances is None:
+            distances = self.getDistanceDataArray(dist_sensors, [drone])[0]
+        return Telemetry(vector(self.pos[id]), IDENTITY, kinematics, bool(self.collided[id]), distances)
+
+    # motion
+    def moveDroneBySelfFrameAsync(self, drone, velocity, duration):
+        return self.command_drone(drone, {'type': 'velocity', 'velocity': np.array(velocity, dtype=float),
+                                          'until': self.time + duration})
+
+    def moveDroneBySelfFrame(self, drone, velocity, duration):
+        self.moveDroneBySelfFrameAsync(drone, velocity, duration).join()
+
+    def moveToPositionAsync(self, drone, position, speed, timeout_sec=60):
+        target = self.spawn[self.index[drone]] + position
+        return self.command_drone(drone, {'type': 'position', 'target': target, 'speed': speed,
+                                          'until': self.time + timeout_sec})
+
+    def moveDroneToPos(self, drone, position):
+        self.moveToPositionAsync(drone, [position[0], position[1], position[2] - self.z_offset], 1).join()
+
+    def changeDroneAltAsync(self, drone, altitude, pos=None):
+        if pos is None:
+            pos = self.getMultirotorState(drone).kinematics_estimated.position
+        return self.moveToPositionAsync(drone, [pos.x_val, pos.y_val, altitude - self.z_offset], 1)
+
+    def changeDroneAlt(self, drone, altitude, pos=None):
+        self.changeDroneAltAsync(drone, altitude, pos).join()
+
+    def hoverAsync(self, drone):
+        return self.command_drone(drone, {'type': 'hover', 'done': True})
+
+    def setCameraAngle(self, camera_angle, drone, cam="0"):
+        self.cam_pitch[drone][str(cam)] = camera_angle[0]
+        self.cam_yaw[drone][str(cam)] = camera_angle[2]
+
+    # images
+    def render(self, drone, cam):
+        id = self.index[drone]
+        cam = str(cam)
+        pitch = math.radians(self.cam_pitch[drone].get(cam, -50.))
+        yaw = math.radians(self.cam_base_yaw.get(cam, 0.) + self.cam_yaw[drone].get(cam, 0.))
+        h, w = self.img_height, self.img_width
+        x, y, z = self.pos[id].tolist()
+        # ground texture: shifted with the drone's position and the camera heading
+        oy = int(x * 8 + math.degrees(yaw) * 2) % h
+        ox = int(y * 8 + math.degrees(yaw) * 5) % w
+        img = self.texture[oy:oy + h, ox:ox + w].copy()
+
+        # pinhole projection of the target, in plain floats: the camera's forward, right and down
+        # (forward x right) axes dotted with the target's offset
+        cos_p, sin_p, cos_y, sin_y = math.cos(pitch), math.sin(pitch), math.cos(yaw), math.sin(yaw)
+        tx, ty, tz = self.world.target_center.tolist()
+        rx, ry, rz = tx - x, ty - y, tz - z
+        depth = rx * cos_p * cos_y + ry * cos_p * sin_y - rz * sin_p
+        if depth < 0.5:
+            return img
+        u = w / 2. + self.focal * (ry * cos_y - rx * sin_y) / depth
+        v = h / 2. + self.focal * (rx * sin_p * cos_y + ry * sin_p * sin_y + rz * cos_p) / depth
+        half_w = self.focal * self.world.target_width / depth / 2.
+        half_h = self.focal * self.world.target_height / depth / 2.
+        x0, x1 = int(max(u - half_w, 0)), int(min(u + half_w, w))
+        y0, y1 = int(max(v - half_h, 0)), int(min(v + half_h, h))
+        # too small for the detector, or out of view
+        if x1 - x0 < 4 or y1 - y0 < 4:
+            return img
+        dist = math.sqrt(rx * rx + ry * ry + rz * rz)
+        if self.world.raycast(self.pos[id:id + 1], np.array([[[rx / dist, ry / dist, rz / dist]]]), dist)[0, 0] < dist:
+            return img
+        img[y0:y1, x0:x1] = TARGET_COLOR
+        return img
+
+    def captureImgNumpy(self, drone, cam = 0):
+        return self.render(drone, cam)
+
+    def captureImgsNumpy(self, drone, camList):
+        return [self.render(drone, cam) for cam in camList]
+
+    # synthetic detector
+    def predict_yv4(self, img_rgb):
+        if not self.inference:
+            return None
+        # the target is at least 4 px wide and high, so every other pixel is enough to find it
+        mask = img_rgb[::2, ::2, 2] == TARGET_COLOR[2]
+        if not mask.any():
+            return []
+        rows, cols = mask.any(axis=1), mask.any(axis=0)
+        y0, y1 = 2 * np.argmax(rows), 2 * (len(rows) - np.argmax(rows[::-1]))
+        x0, x1 = 2 * np.argmax(cols), 2 * (len(cols) - np.argmax(cols[::-1]))
+        # darknet format: (label, confidence, (center x, center y, w, h))
+        return [('person', 0.99, ((x0 + x1) / 2., (y0 + y1) / 2., float(x1 - x0), float(y1 - y0)))]
+
+    def convert_bbox(self, x, y, w, h):
+        xmin = int(round(x - (w / 2)))
+        xmax = int(round(x + (w / 2)))
+        ymin = int(round(y - (h / 2)))
+        ymax = int(round(y + (h / 2)))
+        return xmin, ymin, xmax, ymax
+
+    def testAreaCoverage(self, drone, camList, cam_shifted_angle, telemetry=None):
+        pos = self.pos[self.index[drone]]
+        return covered_area(pos[0], pos[1], 0., camList, cam_shifted_angle, record_grid=False)
@@ -0,0 +1,119 @@
+import time
+import threading
+import numpy as np
+
+
+class Learner(object):
+    """
+    Trains an agent from its replay memory in a background thread while the
+    main loop keeps stepping the environment.
+
+    Every publish_rate updates the trained weights are published to the
+    agent's acting network (agent.publish_weights), and every target_rate
+    updates the target networks are updated (1: after every update).
+
+    The updates are capped at updates_per_step per env step reported with
+    add_steps since start() (the synchronous loop's epoch / train_rate), so
+    the replay ratio does not depend on how fast the simulator steps; the
+    thread waits for env steps when it is ahead. None: no cap.
+    """
+
+    def __init__(self, agent, publish_rate=10, target_rate=1, updates_per_step=None):
+        self.agent = agent
+        self.publish_rate = publish_rate
+        self.target_rate = target_rate
+        self.updates_per_step = updates_per_step
+        self.lock = threading.Lock()
+        # notified on add_steps and stop
+        self.stepped = threading.Condition(self.lock)
+        self.steps = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.error = None
+        self.updates = 0
+        # losses accumulated since the last pop_stats()
+        self.loss_sum = None
+        self.loss_num = 0
+
+    def started(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is None:
+            print('Starting learner thread')
+            with self.lock:
+                self.steps = 0
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.lock:
+            self.stepped.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def add_steps(self, steps=1):
+        """
+        Method to report env steps (transitions appended to the replay memory)
+        """
+        with self.lock:
+            self.steps += steps
+            self.stepped.notify_all()
+
+    def wait_for_steps(self):
+        # block while the updates are ahead of the env steps; False when stopped
+        if self.updates_per_step is None:
+            return not self.stop_event.is_set()
+        with self.lock:
+            while self.updates >= self.steps * self.updates_per_step:
+                if self.stop_event.is_set():
+                    return False
+                self.stepped.wait()
+        return not self.stop_event.is_set()
+
+    def run(self):
+        try:
+            while self.wait_for_steps():
+                losses = np.atleast_1d(np.array(self.agent.train_model(), dtype=np.float64))
+                with self.lock:
+                    self.loss_sum = losses if self.loss_sum is None else self.loss_sum + losses
+                    self.loss_num += 1
+                    self.updates += 1
+                    updates = self.updates
+                if updates % self.target_rate == 0:
+                    self.agent.update_target_model()
+                if updates % self.publish_rate == 0:
+                    self.agent.publish_weights()
+        except Exception as e:
+            # re-raised in the main loop by pop_stats
+            self.error = e
+
+    def pop_stats(self):
+        """
+        Method to get the number of updates and the mean losses since the
+        last call
+        """
+        if self.error is not None:
+            raise self.error
+        with self.lock:
+            num, loss_sum = self.loss_num, self.loss_sum
+            self.loss_num, self.loss_sum = 0, None
+        if not num:
+            return 0, None
+        return num, loss_sum / num
+
+
+class Throughput(object):
+    """
+    Wall-clock env steps/s and updates/s of an episode
+    """
+
+    def __init__(self):
+        self.start = time.time()
+
+    def report(self, steps, updates):
+        elapsed = max(time.time() - self.start, 1e-9)
+        return 'Throughput: %.2f env steps/s, %.2f updates/s (%d steps, %d updates in %.1f s)' \
+            % (steps / elapsed, updates / elapsed, steps, updates, elapsed)
@@ -4,20 +4,23 @@ import math
 import argparse
 import numpy as np
 from datetime import datetime as dt
-from airsim_env_tf1 import Env, ACTION
+from airsim_env_tf1 import Env, ACTION, camList
+from episode_recorder import EpisodeRecorder, ReplayEnv
+from step_profiler import StepProfiler, instrument_env
 
 num_drone = 3
 agent_name = "random"
 
 class RandomAgentDiscrete(object):
 
-    def __init__(self, action_size):
+    def __init__(self, action_size, num_drone=num_drone):
         self.action_size = action_size
+        self.num_drone = num_drone
         self.name = agent_name + "_d"
 
     def get_action(self):
         actions = []
-        for i in range(num_drone):
+        for i in range(self.num_drone):
             action = np.random.choice(self.action_size)
             actions.append(action)
         return actions
@@ -25,13 +28,14 @@ class RandomAgentDiscrete(object):
 
 class RandomAgentContinuous(object):
 
-    def __init__(self, action_size):
+    def __init__(self, action_size, num_drone=num_drone):
         self.action_size = action_size
+        self.num_drone = num_drone
         self.name = agent_name + "_c"
 
     def get_action(self):
         actions = []
-        for i in range(num_drone):
+        for i in range(self.num_drone):
             action = np.random.uniform(-1.5, 1.5, self.action_size)
             actions.append(action)
         return actions
@@ -64,15 +68,43 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--verbose',    action='store_true')
     parser.add_argument('--continuous', action='store_true')
+    # move all drones at once in Env.step and settle without sleeping
+    parser.add_argument('--concurrent_motion', action='store_true')
+    parser.add_argument('--async_rpc',  action='store_true')
+    # collision monitor polls per second, debounced over 3 polls (0: the original back-to-back polling)
+    parser.add_argument('--monitor_rate', type=float, default=0.)
+    parser.add_argument('--rpc_pool',   type=int,   default=0,
+                        help='AirSim connections for per-drone threads (0: one shared connection)')
+    # time the phases of the steps; p50/p95/max per episode appended to save_stat/<agent>_spans.csv
+    parser.add_argument('--spans',      action='store_true')
+    # kinematic: the headless NumPy stand-in for AirSim (kinematic_sim.py),
+    # replay: serve the observations of a --record recording back (episode_recorder.py)
+    parser.add_argument('--sim',        type=str,   default='airsim', choices=['airsim', 'kinematic', 'replay'])
+    parser.add_argument('--replay_from', type=str,  default='save_record')
+    # stream every env step (actions, frames, positions, detections, rewards) to this directory
+    parser.add_argument('--record',     type=str,   default='')
+    # fleet size and the cameras of each drone
+    parser.add_argument('--num_drone',  type=int,   default=num_drone)
+    parser.add_argument('--cameras',    type=int,   nargs='+', default=camList)
     args = parser.parse_args()
 
     if args.continuous:
         print("RandomAgentContinuous")
-        agent = RandomAgentContinuous(3)
+        agent = RandomAgentContinuous(3, args.num_drone)
     else:
         print("RandomAgentDiscrete")
-        agent = RandomAgentDiscrete(7)
-    env = Env()
+        agent = RandomAgentDiscrete(7, args.num_drone)
+    if args.sim == 'replay':
+        env = ReplayEnv(args.replay_from)
+    else:
+        env = Env(concurrent_motion=args.concurrent_motion, async_rpc=args.async_rpc, rpc_pool=args.rpc_pool, monitor_rate=args.monitor_rate, sim=args.sim, verbose=args.verbose or args.sim != 'kinematic', num_drone=args.num_drone, camList=args.cameras)
+    profiler = None
+    if args.spans:
+        profiler = StepProfiler('save_stat/' + agent.name + '_spans.csv')
+        if args.sim != 'replay':
+            instrument_env(profiler, env)
+    if args.record:
+        env = EpisodeRecorder(env, args.record)
 
     episode = 0
     
@@ -87,20 +119,17 @@ if __name__ == '__main__':
             print(f'Sub Loop: timestep: {timestep}')
             timestep += 1
             actions = agent.get_action()
-            action1, action2, action3 = actions[0], actions[1], actions[2]
             if not args.continuous:
                 # if discrete then do interpret action
-                real_action1, real_action2, real_action3 = interpret_action(action1), interpret_action(action2), interpret_action(action3)
-                print('ACTION: %s' % (ACTION[action1]))
-                print('ACTION: %s' % (ACTION[action2]))
-                print('ACTION: %s' % (ACTION[action3]))
+                real_actions = [interpret_action(action) for action in actions]
+                for action in actions:
+                    print('ACTION: %s' % (ACTION[action]))
             else:
-                real_action1, real_action2, real_action3 = action1, action2, action3
-                print('ACTION: %s' % (action1))
-                print('ACTION: %s' % (action2))
-                print('ACTION: %s' % (action3))
-            _, reward, done, info = env.step([real_action1, real_action2, real_action3])
-            info1, info2, info3 = info[0]['status'], info[1]['status'], info[2]['status']
+                real_actions = actions
+                for action in actions:
+                    print('ACTION: %s' % (action))
+            _, reward, done, info = env.step(real_actions)
+            infos = [i['status'] for i in info]
             print("Done: ", done)
             print("Timestep: ", timestep)
 
@@ -113,13 +142,14 @@ if __name__ == '__main__':
 
             # stack history here
             if args.verbose:
-                print('Step %d Action1 %s Action2 %s Action3 %s Reward %.2f Info1 %s Info2 %s Info3 %s:' % (timestep, real_action1, real_action2, real_action3, reward, info1, info2, info3))
+                print('Step %d Actions %s Reward %.2f Infos %s:' % (timestep, real_actions, reward, infos))
         # done
         print('Ep %d: BestReward %.3f Step %d Score %.3f' % (episode, bestReward, timestep, score))
         stats = [
-                episode, timestep, score, bestReward, \
-                info[0]['status'], info[1]['status'], info[2]['status']
-            ]
+                episode, timestep, score, bestReward] + [i['status'] for i in info]
+
+        if profiler is not None:
+            print(profiler.flush(episode))
 
         # log stats
         with open('save_stat/'+ agent.name + '_stat.csv', 'a', encoding='utf-8', newline='') as f:
@@ -1,10 +1,9 @@
 import os
 import csv
 import time
-import random
 import argparse
+import threading
 from copy import deepcopy
-from collections import deque
 from datetime import datetime as dt
 import numpy as np
 import tensorflow as tf
@@ -15,7 +14,17 @@ from keras.optimizers import Adam
 from keras.models import Model
 from PIL import Image
 import cv2
-from airsim_env_tf1 import Env
+from airsim_env_tf1 import Env, camList
+from replay_memory import make_replay_memory
+from frame_codec import codec_names
+from replay_snapshot import ReplaySnapshot
+from batch_prefetcher import BatchPrefetcher
+from learner import Learner, Throughput
+from embedding_cache import EmbeddingCache
+from target_update import build_target_update
+from episode_recorder import EpisodeRecorder, ReplayEnv
+from capture_profile import model_frame
+from step_profiler import StepProfiler, instrument_env
 
 np.set_printoptions(suppress=True, precision=4)
 agent_name = 'rddpg'
@@ -26,8 +35,14 @@ class RDDPGAgent(object):
     
     def __init__(self, state_size, pos_size, action_size, actor_lr, critic_lr, tau,
                 gamma, lambd, batch_size, memory_size, 
-                epsilon, epsilon_end, decay_step, load_model):
+                epsilon, epsilon_end, decay_step, load_model,
+                replay_backend='memory', replay_dir=None,
+                per=False, per_alpha=0.6, per_beta=0.4,
+                frame_codec='none', codec_workers=4, prefetch=0,
+                decoupled=False, embedding_cache=False, image_dtype='uint8', num_drone=num_drone):
         self.state_size = state_size
+        # one actor and one critic head per drone
+        self.num_drone = num_drone
         self.pos_size = pos_size
         self.action_size = action_size
         self.action_high = 1.5
@@ -43,6 +58,8 @@ class RDDPGAgent(object):
         self.epsilon_end = epsilon_end
         self.decay_step = decay_step
         self.epsilon_decay = (epsilon - epsilon_end) / decay_step
+        # dtype of the image feeds; the graph casts to float32 ('float32' only for benchmarks)
+        self.image_dtype = image_dtype
 
         # adjust gpu usage here
         tf_config = tf.ConfigProto()
@@ -52,25 +69,43 @@ class RDDPGAgent(object):
 
         self.actor, self.critic = self.build_model()
         self.target_actor, self.target_critic = self.build_model()
-        self.actor_update = self.build_actor_optimizer()
-        self.critic_update = self.build_critic_optimizer()
+        # with a learner thread, actions come from a copy of the actor that only changes on publish_weights
+        self.acting_actor = self.build_model()[0] if decoupled else self.actor
+        self.train_update = self.build_train_optimizer()
+        # the critic contains the actor's shared layers, so these cover both networks
+        self.target_init = build_target_update([self.actor, self.critic], [self.target_actor, self.target_critic])
+        self.target_update = build_target_update([self.actor, self.critic], [self.target_actor, self.target_critic], self.tau)
         self.sess.run(tf.global_variables_initializer())
         print("loading model: ", load_model)
         if load_model:
             self.load_model('./save_model/'+ agent_name)
             print("Loaded model for agent.")
         print("done loading")
-        self.target_actor.set_weights(self.actor.get_weights())
-        self.target_critic.set_weights(self.critic.get_weights())
-
-        self.memory = deque(maxlen=self.memory_size)
+        self.sess.run(self.target_init)
+        self.acting_lock = threading.Lock()
+        # encodes only the newest frame of the history at act time
+        self.cache = EmbeddingCache(self.acting_actor, self.sess) if embedding_cache else None
+        if decoupled:
+            self.publish_weights()
+            # build the predict functions before another thread calls them
+            for model in [self.actor, self.critic, self.target_actor, self.target_critic, self.acting_actor]:
+                model._make_predict_function()
+
+        self.memory = make_replay_memory(replay_backend, self.memory_size, self.state_size, self.pos_size,
+                                         action_shape=(self.num_drone, self.action_size), replay_dir=replay_dir,
+                                         per=per, per_alpha=per_alpha, per_beta=per_beta, per_beta_steps=decay_step,
+                                         frame_codec=frame_codec, codec_workers=codec_workers)
+        self.memory.image_dtype = np.dtype(image_dtype)
+        self.prefetcher = BatchPrefetcher(self.memory, self.batch_size, prefetch) if prefetch else None
         print("Done initialize agent.")
 
     def build_model(self):
         # shared network
         # image process
-        image = Input(shape=self.state_size)
-        image_process = BatchNormalization()(image)
+        # uint8 frames are fed as is and cast on-device; the BatchNormalization normalizes them
+        image = Input(shape=self.state_size, dtype=self.image_dtype)
+        image_process = Lambda(lambda x: K.cast(x, 'float32'))(image)
+        image_process = BatchNormalization()(image_process)
         image_process = TimeDistributed(
             Conv2D(16, (3, 3), activation='elu', padding='same', kernel_initializer='he_normal'))(image_process)
         #72 128
@@ -118,80 +153,46 @@ class RDDPGAgent(object):
         state_process = Add()([image_process, vel_process])
 
         # Actor
-        policy1 = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_process)
-        policy1 = BatchNormalization()(policy1)
-        policy1 = ELU()(policy1)
-        policy1 = Dense(32, kernel_initializer='he_normal', use_bias=False)(policy1)
-        policy1 = BatchNormalization()(policy1)
-        policy1 = ELU()(policy1)
-        policy1 = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(policy1)
-        policy1 = Lambda(lambda x: K.clip(x, self.action_low, self.action_high))(policy1)
-
-        policy2 = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_process)
-        policy2 = BatchNormalization()(policy2)
-        policy2 = ELU()(policy2)
-        policy2 = Dense(32, kernel_initializer='he_normal', use_bias=False)(policy2)
-        policy2 = BatchNormalization()(policy2)
-        policy2 = ELU()(policy2)
-        policy2 = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(policy2)
-        policy2 = Lambda(lambda x: K.clip(x, self.action_low, self.action_high))(policy2)
-
-        policy3 = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_process)
-        policy3 = BatchNormalization()(policy3)
-        policy3 = ELU()(policy3)
-        policy3 = Dense(32, kernel_initializer='he_normal', use_bias=False)(policy3)
-        policy3 = BatchNormalization()(policy3)
-        policy3 = ELU()(policy3)
-        policy3 = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(policy3)
-        policy3 = Lambda(lambda x: K.clip(x, self.action_low, self.action_high))(policy3)
-
-        actor = Model(inputs=[image, vel], outputs=[policy1, policy2, policy3])
+        policies = []
+        for _ in range(self.num_drone):
+            policy = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_process)
+            policy = BatchNormalization()(policy)
+            policy = ELU()(policy)
+            policy = Dense(32, kernel_initializer='he_normal', use_bias=False)(policy)
+            policy = BatchNormalization()(policy)
+            policy = ELU()(policy)
+            policy = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(policy)
+            policy = Lambda(lambda x: K.clip(x, self.action_low, self.action_high))(policy)
+            policies.append(policy)
+
+        actor = Model(inputs=[image, vel], outputs=policies)
         
         # Critic
-        action1 = Input(shape=[self.action_size])
-        action_process1 = Dense(48, kernel_initializer='he_normal', use_bias=False)(action1)
-        action_process1 = BatchNormalization()(action_process1)
-        action_process1 = Activation('tanh')(action_process1)
-
-        action2 = Input(shape=[self.action_size])
-        action_process2 = Dense(48, kernel_initializer='he_normal', use_bias=False)(action2)
-        action_process2 = BatchNormalization()(action_process2)
-        action_process2 = Activation('tanh')(action_process2)
+        actions, action_processes = [], []
+        for _ in range(self.num_drone):
+            action = Input(shape=[self.action_size])
+            action_process = Dense(48, kernel_initializer='he_normal', use_bias=False)(action)
+            action_process = BatchNormalization()(action_process)
+            action_process = Activation('tanh')(action_process)
+            actions.append(action)
+            action_processes.append(action_process)
 
-        action3 = Input(shape=[self.action_size])
-        action_process3 = Dense(48, kernel_initializer='he_normal', use_bias=False)(action3)
-        action_process3 = BatchNormalization()(action_process3)
-        action_process3 = Activation('tanh')(action_process3)
-
-        action_process = Add()([action_process1, action_process2, action_process3])
+        action_process = Add()(action_processes) if self.num_drone > 1 else action_processes[0]
 
         state_action = Add()([state_process, action_process])
 
-        Qvalue1 = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_action)
-        Qvalue1 = BatchNormalization()(Qvalue1)
-        Qvalue1 = ELU()(Qvalue1)
-        Qvalue1 = Dense(32, kernel_initializer='he_normal', use_bias=False)(Qvalue1)
-        Qvalue1 = BatchNormalization()(Qvalue1)
-        Qvalue1 = ELU()(Qvalue1)
-        Qvalue1 = Dense(1, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue1)
-
-        Qvalue2 = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_action)
-        Qvalue2 = BatchNormalization()(Qvalue2)
-        Qvalue2 = ELU()(Qvalue2)
-        Qvalue2 = Dense(32, kernel_initializer='he_normal', use_bias=False)(Qvalue2)
-        Qvalue2 = BatchNormalization()(Qvalue2)
-        Qvalue2 = ELU()(Qvalue2)
-        Qvalue2 = Dense(1, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue2)
-
-        Qvalue3 = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_action)
-        Qvalue3 = BatchNormalization()(Qvalue3)
-        Qvalue3 = ELU()(Qvalue3)
-        Qvalue3 = Dense(32, kernel_initializer='he_normal', use_bias=False)(Qvalue3)
-        Qvalue3 = BatchNormalization()(Qvalue3)
-        Qvalue3 = ELU()(Qvalue3)
-        Qvalue3 = Dense(1, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue3)
+        Qvalues = []
+        for _ in range(self.num_drone):
+            Qvalue = Dense(32, kernel_initializer='he_normal', use_bias=False)(state_action)
+            Qvalue = BatchNormalization()(Qvalue)
+            Qvalue = ELU()(Qvalue)
+            Qvalue = Dense(32, kernel_initializer='he_normal', use_bias=False)(Qvalue)
+            Qvalue = BatchNormalization()(Qvalue)
+            Qvalue = ELU()(Qvalue)
+            Qvalue = Dense(1, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue)
+            Qvalues.append(Qvalue)
         
-        critic = Model(inputs=[image, vel, action1, action2, action3], outputs=[Qvalue1, Qvalue2, Qvalue3])
+        critic = Model(inputs=[image, vel] + actions, outputs=Qvalues)
 
         actor.summary()
         critic.summary()
@@ -201,145 +202,107 @@ class RDDPGAgent(object):
         
         return actor, critic
 
-    def build_actor_optimizer(self):
-        pred_Q1, pred_Q2, pred_Q3 = self.critic.output
-        ## split out actions from self.critic.input as self.critic.input consists of all actions (length of 9: action1 + action2 + action3) 
-        ##action1, action2, action3 = [self.critic.input[2][x:x+self.action_size] for x in range(0, self.critic.input[2].shape[1], self.action_size)]
-        #action1, action2, action3 = tf.split(self.critic.input[2],num_or_size_splits=self.action_size, axis=1)
-        #print("action1: ", action1)
-        print("pred: ", pred_Q1)
-        action_grad1 = tf.gradients(pred_Q1, self.critic.input[2])
-        action_grad2 = tf.gradients(pred_Q2, self.critic.input[3])
-        action_grad3 = tf.gradients(pred_Q3, self.critic.input[4])
-        print("action_grad: ", action_grad1)
-        target1 = -action_grad1[0] / self.batch_size
-        target2 = -action_grad2[0] / self.batch_size
-        target3 = -action_grad3[0] / self.batch_size
-        print("target: ", target1)
-        params_grad1 = tf.gradients(
-            self.actor.output[0], self.actor.trainable_weights, target1)
-        params_grad2 = tf.gradients(
-            self.actor.output[1], self.actor.trainable_weights, target2)
-        params_grad3 = tf.gradients(
-            self.actor.output[2], self.actor.trainable_weights, target3)
-        
-        params_grad = params_grad1 + params_grad2 + params_grad3
-
-        #params_grad1, global_norm1 = tf.clip_by_global_norm(params_grad1, 5.0)
-        #params_grad2, global_norm2 = tf.clip_by_global_norm(params_grad2, 5.0)
-        #params_grad3, global_norm3 = tf.clip_by_global_norm(params_grad3, 5.0)
+    def build_train_optimizer(self):
+        """
+        Fused DDPG update: target actions, target Q, the critic loss and the
+        actor gradients in one graph execution, with states and next_states
+        fed once. Unlike the separate updates, where the critic's gradients
+        were taken after the actor's step, all the gradients are computed
+        from the pre-update weights. The actor's are then applied first and
+        the critic's after them (the order of the old updates), so the layers
+        the two networks share are not written concurrently.
+        (bench_agent.py times it against the separate steps it replaces.)
+        """
+        image, vel = self.actor.inputs
+        actions = self.critic.inputs[2:]
+        next_image, next_vel = self.target_actor.inputs
+        rewards = K.placeholder(shape=(None, 1), dtype='float32')
+        dones = K.placeholder(shape=(None, 1), dtype='float32')
+        # importance-sampling weights of the minibatch (ones for uniform replay)
+        weights = K.placeholder(shape=(None, 1), dtype='float32')
+
+        # targets from the target networks; call() reuses the models without adding inbound nodes
+        target_Qs = self.target_critic.call([next_image, next_vel] + self.target_actor.outputs)
+        if not isinstance(target_Qs, list):
+            target_Qs = [target_Qs]
+        ys = [K.stop_gradient(rewards + self.gamma * (1 - dones) * target_Q) for target_Q in target_Qs]
+
+        # critic loss on the replayed actions
+        preds = self.critic.outputs
+        avgloss = sum(K.mean(weights * K.square(pred - y)) for pred, y in zip(preds, ys)) / self.num_drone
+        td_error = sum(K.abs(pred - y) for pred, y in zip(preds, ys)) / self.num_drone
+        critic_grads = tf.gradients(avgloss, self.critic.trainable_weights)
+
+        # deterministic policy gradient through the critic evaluated at the actor's own actions
+        policies = self.actor.outputs
+        policy_Qs = self.critic.call([image, vel] + policies)
+        if not isinstance(policy_Qs, list):
+            policy_Qs = [policy_Qs]
+        params_grad = []
+        for policy, policy_Q in zip(policies, policy_Qs):
+            action_grad = tf.gradients(policy_Q, policy)[0]
+            params_grad += tf.gradients(policy, self.actor.trainable_weights, -action_grad / self.batch_size)
         params_grad, global_norm = tf.clip_by_global_norm(params_grad, 5.0)
-        grads = zip(params_grad, self.actor.trainable_weights)
-        # grads1 = zip(params_grad1, self.actor.trainable_weights)
-        # grads2 = zip(params_grad2, self.actor.trainable_weights)
-        # grads3 = zip(params_grad3, self.actor.trainable_weights)
-
-        print("params_grad1: ", params_grad)
-        print("global_norm1: ", global_norm)
-        print("grads1: ", grads)
-        #concatglobal_norm = tf.stack([global_norm1, global_norm2, global_norm3], axis=0)
-        #global_norm = K.mean(concatglobal_norm)
-        #concatgrads = tf.stack([grads], axis=0)
-
-        optimizer = tf.train.AdamOptimizer(self.actor_lr)
-        updates = optimizer.apply_gradients(grads)
-        train = K.function(
-            [self.actor.input[0], self.actor.input[1], self.critic.input[2], self.critic.input[3], self.critic.input[4]],
-            [global_norm],
-            updates=[updates]
-        )
-        return train
 
-    def build_critic_optimizer(self):
-        y1 = K.placeholder(shape=(None, 1), dtype='float32')
-        y2 = K.placeholder(shape=(None, 1), dtype='float32')
-        y3 = K.placeholder(shape=(None, 1), dtype='float32')
-
-        pred1, pred2, pred3 = self.critic.output
-        
-        preloss1 = K.mean(K.square(pred1 - y1))
-        preloss2 = K.mean(K.square(pred2 - y2))
-        preloss3 = K.mean(K.square(pred3 - y3))
-
-        #concatpreloss = tf.stack([preloss1, preloss2, preloss3], axis=0)
-        #print("preloss1: ", preloss1)
-        #print("concatpreloss: ", concatpreloss)
-        #loss = K.mean(concatpreloss)
-        #print("loss: ", loss)
-        avgloss = (preloss1 + preloss2 + preloss3)/3
-        print("avgloss: ", avgloss)
-        # Huber Loss
-        # error = K.abs(y - pred)
-        # quadratic = K.clip(error, 0.0, 1.0)
-        # linear = error - quadratic
-        # loss = K.mean(0.5 * K.square(quadratic) + linear)
-
-        optimizer = Adam(lr=self.critic_lr)
-        updates = optimizer.get_updates(self.critic.trainable_weights, [], avgloss)
+        with tf.control_dependencies(critic_grads + params_grad + [avgloss, td_error]):
+            actor_apply = tf.train.AdamOptimizer(self.actor_lr).apply_gradients(
+                zip(params_grad, self.actor.trainable_weights))
+        # actor first, then critic, in the order of the old updates; this only orders the writes to the
+        # shared trunk: the critic's gradients are still those of the pre-update weights
+        with tf.control_dependencies([actor_apply]):
+            critic_apply = tf.train.AdamOptimizer(self.critic_lr, epsilon=K.epsilon()).apply_gradients(
+                zip(critic_grads, self.critic.trainable_weights))
         train = K.function(
-            [self.critic.input[0], self.critic.input[1], self.critic.input[2], self.critic.input[3], self.critic.input[4], y1, y2, y3],
-            [avgloss],
-            updates=updates
+            [image, vel] + actions + [next_image, next_vel, rewards, dones, weights],
+            [global_norm, avgloss, td_error],
+            updates=[actor_apply, critic_apply]
         )
         return train
 
+    def acting_predict(self, state):
+        """
+        Returns the acting actor's policies for a state, one array per drone, through
+        the embedding cache when it is on
+        """
+        with self.acting_lock:
+            model = self.acting_actor if self.cache is None else self.cache
+            outputs = model.predict(state)
+        if not isinstance(outputs, list):
+            # a single-drone model has one output
+            outputs = [outputs]
+        return outputs
+
     def get_action(self, state):
-        policy1, policy2, policy3 = self.actor.predict(state)
-        policy1, policy2, policy3 = policy1[0], policy2[0], policy3[0]
-        noise1 = np.random.normal(0, self.epsilon, self.action_size)
-        noise2 = np.random.normal(0, self.epsilon, self.action_size)
-        noise3 = np.random.normal(0, self.epsilon, self.action_size)
-        action1 = np.clip(policy1 + noise1, self.action_low, self.action_high)
-        action2 = np.clip(policy2 + noise2, self.action_low, self.action_high)
-        action3 = np.clip(policy3 + noise3, self.action_low, self.action_high)
-        return [(action1, policy1), (action2, policy2), (action3, policy3)]
+        """
+        Returns an (action, policy) pair per drone, the action with exploration noise
+        """
+        policies = self.acting_predict(state)
+        policies = [policy[0] for policy in policies]
+        noise = np.random.normal(0, self.epsilon, (self.num_drone, self.action_size))
+        actions = np.clip(np.stack(policies) + noise, self.action_low, self.action_high)
+        return list(zip(actions, policies))
+
+    def sample_batch(self):
+        if self.prefetcher is not None:
+            return self.prefetcher.get()
+        return self.memory.sample(self.batch_size)
 
     def train_model(self):
         print(f'lem mem: {len(self.memory)}, batch: {self.batch_size}')
-        batch = random.sample(self.memory, self.batch_size)
-
-        images = np.zeros([self.batch_size] + self.state_size)
-        vels = np.zeros([self.batch_size, self.pos_size])
-
-        actions1 = np.zeros((self.batch_size, self.action_size))
-        actions2 = np.zeros((self.batch_size, self.action_size))
-        actions3 = np.zeros((self.batch_size, self.action_size))
-
-        rewards = np.zeros((self.batch_size, 1))
-
-        next_images = np.zeros([self.batch_size] + self.state_size)
-        next_vels = np.zeros([self.batch_size, self.pos_size])
-
-        dones = np.zeros((self.batch_size, 1))
-
-        targets = np.zeros((self.batch_size, 1))
-        
-        for i, sample in enumerate(batch):
-            images[i], vels[i] = sample[0]
-            actions1[i] = sample[1]
-            actions2[i] = sample[2]
-            actions3[i] = sample[3]
-            rewards[i] = sample[4]
-            next_images[i], next_vels[i] = sample[5]
-            dones[i] = sample[6]
-        states = [images, vels]
-        next_states = [next_images, next_vels]
-        policy1, policy2, policy3 = self.actor.predict(states)
-        target_actions1, target_actions2, target_actions3 = self.target_actor.predict(next_states)
-        #target_actions = np.concatenate([target_actions1,target_actions2,target_actions3], axis=1)
-        target_next_Qs1, target_next_Qs2, target_next_Qs3 = self.target_critic.predict(next_states + [target_actions1, target_actions2, target_actions3])
-        targets1 = rewards + self.gamma * (1 - dones) * target_next_Qs1
-        targets2 = rewards + self.gamma * (1 - dones) * target_next_Qs2
-        targets3 = rewards + self.gamma * (1 - dones) * target_next_Qs3
-
-        #policy = np.hstack((policy1, policy2, policy3))
-        #actions = np.hstack((actions1, actions2, actions3))
-        actor_loss = self.actor_update(states + [policy1, policy2, policy3])
-        critic_loss = self.critic_update(states + [actions1, actions2, actions3, targets1, targets2, targets3])
-        return actor_loss[0], critic_loss[0]
-
-    def append_memory(self, state, action1, action2, action3, reward, next_state, done):        
-        self.memory.append((state, action1, action2, action3, reward, next_state, done))
+        images, vels, actions, rewards, next_images, next_vels, dones, weights, indices = self.sample_batch()
+        rewards = rewards.reshape(-1, 1)
+        dones = dones.reshape(-1, 1)
+        weights = weights.reshape(-1, 1)
+
+        actor_loss, critic_loss, td_error = self.train_update(
+            [images, vels] + [actions[:, i] for i in range(self.num_drone)] + [next_images, next_vels, rewards, dones, weights])
+        self.memory.update_priorities(indices, td_error.reshape(-1))
+        if self.cache is not None and self.acting_actor is self.actor:
+            self.cache.invalidate()
+        return actor_loss, critic_loss
+
+    def append_memory(self, state, actions, reward, next_state, done):
+        self.memory.append(state, actions, reward, next_state, done)
         
     def load_model(self, name):
         if os.path.exists(name + '_actor.h5'):
@@ -353,15 +316,16 @@ class RDDPGAgent(object):
         self.actor.save_weights(name + '_actor.h5')
         self.critic.save_weights(name + '_critic.h5')
 
+    def publish_weights(self):
+        if self.acting_actor is not self.actor:
+            weights = self.actor.get_weights()
+            with self.acting_lock:
+                self.acting_actor.set_weights(weights)
+                if self.cache is not None:
+                    self.cache.invalidate()
+
     def update_target_model(self):
-        self.target_actor.set_weights(
-            self.tau * np.array(self.actor.get_weights()) \
-            + (1 - self.tau) * np.array(self.target_actor.get_weights())
-        )
-        self.target_critic.set_weights(
-            self.tau * np.array(self.critic.get_weights()) \
-            + (1 - self.tau) * np.array(self.target_critic.get_weights())
-        )
+        self.sess.run(self.target_update)
 
 
 '''
@@ -369,16 +333,12 @@ Environment interaction
 '''
 
 def transform_input(responses, img_height, img_width):
-    dimg_list = []
-    for img in responses:
-        # resize the image to half, from (224, 352) to (112, 176), so that less parameter is needed for the networks.
-        img_resized = cv2.resize(img, (img_width, img_height))
-        dimg = np.array(cv2.cvtColor(img_resized[:,:,:3], cv2.COLOR_BGR2GRAY))
-        dnorm = np.zeros((img_height, img_width))
-        dnorm = cv2.normalize(dimg, dnorm, 0, 255, cv2.NORM_MINMAX)
-        dimg_list.append(dnorm)
-    dimg_all = np.array(dimg_list)
-    #print("dimg_all: ", dimg_all.shape)
+    # frames stay uint8 from here to the graph input, which casts them
+    dimg_all = np.empty((len(responses), img_height, img_width), dtype=np.uint8)
+    for i, img in enumerate(responses):
+        # resize the image to half, from (224, 352) to (112, 176), so that less parameter is needed for the networks
+        # (not needed when AirSim captures at that size: capture_profile.py)
+        dimg_all[i] = model_frame(img, img_height, img_width)
     image = dimg_all.reshape(1, img_height, img_width, len(responses))
     print("transform responses len: ", len(responses))
     #cv2.imwrite('view.png', dimg)
@@ -411,6 +371,42 @@ if __name__ == '__main__':
     parser.add_argument('--epoch',      type=int,   default=1)
     parser.add_argument('--batch_size', type=int,   default=32)
     parser.add_argument('--memory_size',type=int,   default=10000)
+    parser.add_argument('--replay_backend', type=str, default='memory', choices=['memory', 'mmap'])
+    parser.add_argument('--replay_dir', type=str,   default='save_replay/' + agent_name)
+    parser.add_argument('--per',        action='store_true')
+    parser.add_argument('--per_alpha',  type=float, default=0.6)
+    parser.add_argument('--per_beta',   type=float, default=0.4)
+    # compress the frames kept in the replay memory ('none': raw uint8)
+    parser.add_argument('--frame_codec', type=str,  default='none', choices=codec_names)
+    parser.add_argument('--codec_workers', type=int, default=4)
+    # minibatches assembled ahead by a background thread (0: sample inside train_model)
+    parser.add_argument('--prefetch',   type=int,   default=0)
+    # train in a learner thread while the main loop steps the env; the acting network gets the weights every --publish_rate updates
+    parser.add_argument('--learner',    action='store_true')
+    parser.add_argument('--publish_rate', type=int, default=10)
+    # act from cached per-frame conv embeddings instead of re-encoding the whole history
+    parser.add_argument('--embedding_cache', action='store_true')
+    # snapshot the replay memory and counters every N episodes (0: off); resumed with --load_model
+    parser.add_argument('--snapshot_rate', type=int, default=0)
+    parser.add_argument('--snapshot_dir', type=str, default='save_replay/' + agent_name + '_snapshot')
+    # move all drones at once in Env.step and settle without sleeping
+    parser.add_argument('--concurrent_motion', action='store_true')
+    parser.add_argument('--async_rpc',  action='store_true')
+    # collision monitor polls per second, debounced over 3 polls (0: the original back-to-back polling)
+    parser.add_argument('--monitor_rate', type=float, default=0.)
+    parser.add_argument('--rpc_pool',   type=int,   default=0,
+                        help='AirSim connections for per-drone threads (0: one shared connection)')
+    # time the phases of the steps; p50/p95/max per episode appended to save_stat/<agent>_spans.csv
+    parser.add_argument('--spans',      action='store_true')
+    # kinematic: the headless NumPy stand-in for AirSim (kinematic_sim.py),
+    # replay: serve the observations of a --record recording back (episode_recorder.py)
+    parser.add_argument('--sim',        type=str,   default='airsim', choices=['airsim', 'kinematic', 'replay'])
+    parser.add_argument('--replay_from', type=str,  default='save_record')
+    # stream every env step (actions, frames, positions, detections, rewards) to this directory
+    parser.add_argument('--record',     type=str,   default='')
+    # fleet size (one actor and critic head per drone) and the cameras of each drone
+    parser.add_argument('--num_drone',  type=int,   default=num_drone)
+    parser.add_argument('--cameras',    type=int,   nargs='+', default=camList)
     parser.add_argument('--train_start',type=int,   default=200)
     parser.add_argument('--train_rate', type=int,   default=5)
     parser.add_argument('--epsilon',    type=float, default=1)
@@ -427,9 +423,9 @@ if __name__ == '__main__':
         os.makedirs('save_model')
 
     # Make RL agent
-    state_size = [args.seqsize, args.img_height, args.img_width, num_drone*num_cam]
+    state_size = [args.seqsize, args.img_height, args.img_width, args.num_drone*len(args.cameras)]
     action_size = 3
-    pos_size = num_drone*3
+    pos_size = args.num_drone*3
     agent = RDDPGAgent(
         state_size=state_size,
         pos_size=pos_size,
@@ -444,11 +440,35 @@ if __name__ == '__main__':
         epsilon=args.epsilon,
         epsilon_end=args.epsilon_end,
         decay_step=args.decay_step,
-        load_model=args.load_model
+        load_model=args.load_model,
+        replay_backend=args.replay_backend,
+        replay_dir=args.replay_dir,
+        per=args.per,
+        per_alpha=args.per_alpha,
+        per_beta=args.per_beta,
+        frame_codec=args.frame_codec,
+        codec_workers=args.codec_workers,
+        prefetch=args.prefetch,
+        decoupled=args.learner,
+        embedding_cache=args.embedding_cache,
+        num_drone=args.num_drone
     )
 
     episode = 0
-    env = Env()
+    if args.sim == 'replay':
+        env = ReplayEnv(args.replay_from)
+    else:
+        env = Env(concurrent_motion=args.concurrent_motion, async_rpc=args.async_rpc, rpc_pool=args.rpc_pool, monitor_rate=args.monitor_rate, sim=args.sim, verbose=args.verbose or args.sim != 'kinematic', num_drone=args.num_drone, camList=args.cameras)
+    profiler = None
+    if args.spans:
+        profiler = StepProfiler('save_stat/' + agent_name + '_spans.csv')
+        if args.sim != 'replay':
+            instrument_env(profiler, env)
+        profiler.instrument(agent, 'get_action', 'get_action')
+        profiler.instrument(agent, 'train_model', 'train_model')
+        transform_input = profiler.wrap('transform_input', transform_input)
+    if args.record:
+        env = EpisodeRecorder(env, args.record)
 
     if args.play:
         print("Evaluation process")
@@ -481,19 +501,15 @@ if __name__ == '__main__':
                     # snapshot += 128
                     # cv2.imshow('%s' % timestep, np.uint8(snapshot))
                     # cv2.waitKey(0)
-                    action1, action2, action3 = agent.actor.predict(state)
-                    print("check1 action1:", action1)
-                    action1, action2, action3 = action1[0], action2[0], action3[0]
-                    print("check2 action1:", action1)
+                    actions = agent.acting_predict(state)
+                    print("check1 action1:", actions[0])
+                    actions = [action[0] for action in actions]
+                    print("check2 action1:", actions[0])
                     noise = [np.random.normal(scale=args.epsilon) for _ in range(action_size)]
                     noise = np.array(noise, dtype=np.float32)
-                    action1 = np.clip(action1 + noise, -1, 1)
-                    action2 = np.clip(action2 + noise, -1, 1)
-                    action3 = np.clip(action3 + noise, -1, 1)
-                    real_action1 = transform_action(action1)
-                    real_action2 = transform_action(action2)
-                    real_action3 = transform_action(action3)
-                    observe, reward, done, info = env.step([transform_action(real_action1), transform_action(real_action2), transform_action(real_action3)])
+                    actions = [np.clip(action + noise, -1, 1) for action in actions]
+                    real_actions = [transform_action(action) for action in actions]
+                    observe, reward, done, info = env.step([transform_action(real_action) for real_action in real_actions])
                     image, vel = observe
                     try:
                         image = transform_input(image, args.img_height, args.img_width)
@@ -505,24 +521,22 @@ if __name__ == '__main__':
                     vel = vel.reshape(1, -1)
                     next_state = [history, vel]
                     reward = np.sum(np.array(reward))
-                    info1, info2, info3 = info[0]['status'], info[1]['status'], info[2]['status']
+                    infos = [i['status'] for i in info]
 
                     # stats
-                    #action = np.concatenate([action1,action2,action3])
+                    #action = np.concatenate(actions)
                     #print("action: ", action)
-                    Qs1, Qs2, Qs3 = agent.critic.predict([state[0], state[1], action1.reshape(1, -1), action2.reshape(1, -1), action3.reshape(1, -1)])
-                    Qs1, Qs2, Qs3 = Qs1[0][0], Qs2[0][0], Qs3[0][0]
-                    avgQ += float(Qs1 + Qs2 + Qs3)
-                    avgvel += float(np.linalg.norm(real_action1)+np.linalg.norm(real_action2)+np.linalg.norm(real_action3))
+                    Qs = agent.critic.predict(state + [action.reshape(1, -1) for action in actions])
+                    avgQ += float(np.sum(Qs))
+                    avgvel += float(sum(np.linalg.norm(real_action) for real_action in real_actions))
                     score += float(reward)
                     if float(reward) > bestReward:
                         bestReward = float(reward)
-                    print('%s' % (real_action1), end='\r', flush=True)
-                    print('%s' % (real_action2), end='\r', flush=True)
-                    print('%s' % (real_action3), end='\r', flush=True)
+                    for real_action in real_actions:
+                        print('%s' % (real_action), end='\r', flush=True)
 
                     if args.verbose:
-                        print('Step %d Action1 %s Action2 %s Action3 %s Reward %.2f Info1 %s Info2 %s Info3 %s:' % (timestep, real_action1, real_action2, real_action3, reward, info1, info2, info3))
+                        print('Step %d Actions %s Reward %.2f Infos %s:' % (timestep, real_actions, reward, infos))
 
                     state = next_state
 
@@ -533,17 +547,18 @@ if __name__ == '__main__':
                 avgvel /= timestep
 
                 # done
-                print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f AvgVel %.2f Info1 %s Info2 %s Info3 %s'
-                        % (episode, bestReward, timestep, score, avgQ, avgvel, info1, info2, info3))
+                print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f AvgVel %.2f Infos %s'
+                        % (episode, bestReward, timestep, score, avgQ, avgvel, infos))
 
                 stats = [
                     episode, timestep, score, bestReward, avgvel, \
-                    avgQ, avgAct, info[0]['status'], info[1]['status'], info[2]['status']
-                ]
+                    avgQ, avgAct] + [i['status'] for i in info]
                 # log stats
                 with open('save_stat/'+ agent_name + '_test_stat.csv', 'a', encoding='utf-8', newline='') as f:
                     wr = csv.writer(f)
                     wr.writerow(['%.4f' % s if type(s) is float else s for s in stats])
+                if profiler is not None:
+                    print(profiler.flush(episode))
 
                 episode += 1
             except KeyboardInterrupt:
@@ -566,6 +581,17 @@ if __name__ == '__main__':
                 highscore = float(next(reversed(list(read)))[0])
                 print('Highscore:', highscore)
         global_step = 0
+        snapshot = None
+        if args.snapshot_rate:
+            snapshot = ReplaySnapshot(args.snapshot_dir)
+            if args.load_model and snapshot.exists():
+                counters = snapshot.load(agent.memory)
+                agent.epsilon = counters['epsilon']
+                global_step = counters['global_step']
+        learner = None
+        if args.learner:
+            # at most --epoch updates per --train_rate env steps, the replay ratio of the synchronous loop
+            learner = Learner(agent, args.publish_rate, updates_per_step=args.epoch / float(args.train_rate))
         while True:
             try:
                 done = False
@@ -574,6 +600,7 @@ if __name__ == '__main__':
                 # stats
                 bestReward, timestep, score, avgvel, avgQ, avgAct = 0., 0, 0., 0., 0., 0.
                 train_num, actor_loss, critic_loss = 0, 0., 0.
+                throughput = Throughput()
 
                 observe = env.reset()
                 image, vel = observe
@@ -593,7 +620,10 @@ if __name__ == '__main__':
                     print("len(agent.memory): ", len(agent.memory))
                     print("args.train_start: ", args.train_start)
                     print("args.train_rate: ", args.train_rate)
-                    if len(agent.memory) >= args.train_start and global_step >= args.train_rate:
+                    if learner is not None:
+                        if not learner.started() and len(agent.memory) >= args.train_start:
+                            learner.start()
+                    elif len(agent.memory) >= args.train_start and global_step >= args.train_rate:
                         print('Training model')
                         for _ in range(args.epoch):
                             a_loss, c_loss = agent.train_model()
@@ -602,18 +632,17 @@ if __name__ == '__main__':
                             train_num += 1
                         agent.update_target_model()
                         global_step = 0
-                    (action1, policy1), (action2, policy2), (action3, policy3) = agent.get_action(state)
+                    actions, policies = zip(*agent.get_action(state))
                     #print("get_action results: ", agent.get_action(state))
-                    real_action1, real_policy1 = transform_action(action1), transform_action(policy1)
-                    real_action2, real_policy2 = transform_action(action2), transform_action(policy2)
-                    real_action3, real_policy3 = transform_action(action3), transform_action(policy3)
-                    observe, reward, done, info = env.step([real_action1, real_action2, real_action3])
+                    real_actions = [transform_action(action) for action in actions]
+                    real_policies = [transform_action(policy) for policy in policies]
+                    observe, reward, done, info = env.step(real_actions)
                     image, vel = observe
-                    info1, info2, info3 = info[0]['status'], info[1]['status'], info[2]['status']
+                    infos = [i['status'] for i in info]
                     print("Done: ", done)
                     print("Timestep: ", timestep)
                     try:
-                        print("STATUS: ", timestep, info[0]['status'], info[1]['status'], info[2]['status'])
+                        print("STATUS: ", timestep, *infos)
                         image = transform_input(image, args.img_height, args.img_width)
                     except:
                         print('BUG')
@@ -623,25 +652,25 @@ if __name__ == '__main__':
                     vel = vel.reshape(1, -1)
                     next_state = [history, vel]
                     reward = np.sum(np.array(reward))
-                    agent.append_memory(state, action1, action2, action3, reward, next_state, done)
+                    agent.append_memory(state, actions, reward, next_state, done)
+                    if learner is not None:
+                        learner.add_steps()
 
                     # stats
-                    action = np.concatenate([action1,action2,action3])
+                    action = np.concatenate(actions)
                     print("action: ", action)
-                    Qs1, Qs2, Qs3 = agent.critic.predict([state[0], state[1], action1.reshape(1, -1), action2.reshape(1, -1), action3.reshape(1, -1)])
-                    Qs1, Qs2, Qs3 = Qs1[0][0], Qs2[0][0], Qs3[0][0]
-                    avgQ += float(Qs1 + Qs2 + Qs3)
-                    avgvel += float(np.linalg.norm(real_policy1)+np.linalg.norm(real_policy2)+np.linalg.norm(real_policy3))
-                    avgAct += float(np.linalg.norm(real_action1)+np.linalg.norm(real_action2)+np.linalg.norm(real_action3))
+                    Qs = agent.critic.predict(state + [action.reshape(1, -1) for action in actions])
+                    avgQ += float(np.sum(Qs))
+                    avgvel += float(sum(np.linalg.norm(real_policy) for real_policy in real_policies))
+                    avgAct += float(sum(np.linalg.norm(real_action) for real_action in real_actions))
                     score += float(reward)
                     if float(reward) > bestReward:
                         bestReward = float(reward)
-                    print('%s | %s' % (real_action1, real_policy1))
-                    print('%s | %s' % (real_action2, real_policy2))
-                    print('%s | %s' % (real_action3, real_policy3))
+                    for real_action, real_policy in zip(real_actions, real_policies):
+                        print('%s | %s' % (real_action, real_policy))
 
                     if args.verbose:
-                        print('Step %d Action1 %s Action2 %s Action3 %s Reward %.2f Info1 %s Info2 %s Info3 %s:' % (timestep, real_action1, real_action2, real_action3, reward, info1, info2, info3))
+                        print('Step %d Actions %s Reward %.2f Infos %s:' % (timestep, real_actions, reward, infos))
 
                     state = next_state
 
@@ -654,6 +683,16 @@ if __name__ == '__main__':
                 if train_num:
                     actor_loss /= train_num
                     critic_loss /= train_num
+                if learner is not None:
+                    train_num, losses = learner.pop_stats()
+                    actor_loss, critic_loss = (float(losses[0]), float(losses[1])) if train_num else (0., 0.)
+                print(throughput.report(timestep, train_num))
+                if args.frame_codec != 'none':
+                    print(agent.memory.report())
+                if agent.prefetcher is not None:
+                    print(agent.prefetcher.report())
+                if profiler is not None:
+                    print(profiler.flush(episode))
 
                 avgQ /= timestep
                 avgvel /= timestep
@@ -661,13 +700,12 @@ if __name__ == '__main__':
 
                 # done
                 if args.verbose:
-                    print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f AvgVel %.2f AvgAct %.2f Info1 %s Info2 %s Info3 %s'
-                        % (episode, bestReward, timestep, score, avgQ, avgvel, avgAct, info1, info2, info3))
+                    print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f AvgVel %.2f AvgAct %.2f Infos %s'
+                        % (episode, bestReward, timestep, score, avgQ, avgvel, avgAct, infos))
 
                 stats = [
                     episode, timestep, score, bestReward, avgvel, \
-                    actor_loss, critic_loss, avgQ, avgAct, info[0]['status'], info[1]['status'], info[2]['status']
-                ]
+                    actor_loss, critic_loss, avgQ, avgAct] + [i['status'] for i in info]
                 # log stats
                 with open('save_stat/'+ agent_name + '_stat.csv', 'a', encoding='utf-8', newline='') as f:
                     wr = csv.writer(f)
@@ -679,7 +717,13 @@ if __name__ == '__main__':
                         wr.writerow('%.4f' % s if type(s) is float else s for s in [highscore, episode, score, dt.now().strftime('%Y-%m-%d %H:%M:%S')])
                     agent.save_model('./save_model/'+ agent_name + '_best')
                 agent.save_model('./save_model/'+ agent_name)
+                if snapshot is not None and episode % args.snapshot_rate == 0:
+                    snapshot.save(agent.memory, {'epsilon': agent.epsilon, 'global_step': global_step})
                 episode += 1
             except KeyboardInterrupt:
+                if learner is not None:
+                    learner.stop()
+                if snapshot is not None:
+                    snapshot.save(agent.memory, {'epsilon': agent.epsilon, 'global_step': global_step}, wait=True)
                 env.disconnect()
                 break
\ No newline at end of file
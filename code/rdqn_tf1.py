@@ -1,10 +1,9 @@
 import os
 import csv
 import time
-import random
 import argparse
+import threading
 from copy import deepcopy
-from collections import deque
 from datetime import datetime as dt
 import numpy as np
 import tensorflow as tf
@@ -15,7 +14,17 @@ from keras.optimizers import Adam
 from keras.models import Model
 from PIL import Image
 import cv2
-from airsim_env_tf1 import Env, ACTION
+from airsim_env_tf1 import Env, ACTION, camList
+from replay_memory import make_replay_memory
+from frame_codec import codec_names
+from replay_snapshot import ReplaySnapshot
+from batch_prefetcher import BatchPrefetcher
+from learner import Learner, Throughput
+from embedding_cache import EmbeddingCache
+from target_update import build_target_update
+from episode_recorder import EpisodeRecorder, ReplayEnv
+from capture_profile import model_frame
+from step_profiler import StepProfiler, instrument_env
 
 np.set_printoptions(suppress=True, precision=4)
 agent_name = 'rdqn'
@@ -26,8 +35,14 @@ class RDQNAgent(object):
 
     def __init__(self, state_size, pos_size, action_size, lr,
                 gamma, batch_size, memory_size,
-                epsilon, epsilon_end, decay_step, load_model):
+                epsilon, epsilon_end, decay_step, load_model,
+                replay_backend='memory', replay_dir=None,
+                per=False, per_alpha=0.6, per_beta=0.4,
+                frame_codec='none', codec_workers=4, prefetch=0,
+                decoupled=False, embedding_cache=False, image_dtype='uint8', num_drone=num_drone):
         self.state_size = state_size
+        # one Q head per drone
+        self.num_drone = num_drone
         self.pos_size = pos_size
         self.action_size = action_size
         self.lr = lr
@@ -38,6 +53,8 @@ class RDQNAgent(object):
         self.epsilon_end = epsilon_end
         self.decay_step = decay_step
         self.epsilon_decay = (epsilon - epsilon_end) / decay_step
+        # dtype of the image feeds; the graph casts to float32 ('float32' only for benchmarks)
+        self.image_dtype = image_dtype
 
         # adjust gpu usage here
         tf_config = tf.ConfigProto()
@@ -47,22 +64,40 @@ class RDQNAgent(object):
 
         self.critic = self.build_model()
         self.target_critic = self.build_model()
+        # with a learner thread, actions come from a copy of the critic that only changes on publish_weights
+        self.acting_critic = self.build_model() if decoupled else self.critic
         self.critic_update = self.build_critic_optimizer()
+        self.target_update = build_target_update([self.critic], [self.target_critic])
         self.sess.run(tf.global_variables_initializer())
         print("loading model: ", load_model)
         if load_model:
             self.load_model('./save_model/'+ agent_name)
             print("Loaded model for agent.")
         print("done loading")
-        self.target_critic.set_weights(self.critic.get_weights())
-
-        self.memory = deque(maxlen=self.memory_size)
+        self.update_target_model()
+        self.acting_lock = threading.Lock()
+        # encodes only the newest frame of the history at act time
+        self.cache = EmbeddingCache(self.acting_critic, self.sess) if embedding_cache else None
+        if decoupled:
+            self.publish_weights()
+            # build the predict functions before another thread calls them
+            for model in [self.critic, self.target_critic, self.acting_critic]:
+                model._make_predict_function()
+
+        self.memory = make_replay_memory(replay_backend, self.memory_size, self.state_size, self.pos_size,
+                                         action_shape=(self.num_drone,), action_dtype=np.int32, replay_dir=replay_dir,
+                                         per=per, per_alpha=per_alpha, per_beta=per_beta, per_beta_steps=decay_step,
+                                         frame_codec=frame_codec, codec_workers=codec_workers)
+        self.memory.image_dtype = np.dtype(image_dtype)
+        self.prefetcher = BatchPrefetcher(self.memory, self.batch_size, prefetch) if prefetch else None
         print("Done initialize agent.")
 
     def build_model(self):
         # image process
-        image = Input(shape=self.state_size)
-        image_process = BatchNormalization()(image)
+        # uint8 frames are fed as is and cast on-device; the BatchNormalization normalizes them
+        image = Input(shape=self.state_size, dtype=self.image_dtype)
+        image_process = Lambda(lambda x: K.cast(x, 'float32'))(image)
+        image_process = BatchNormalization()(image_process)
         image_process = TimeDistributed(Conv2D(32, (8, 8), activation='elu', padding='same', kernel_initializer='he_normal'))(image_process)
         image_process = TimeDistributed(MaxPooling2D((2, 2)))(image_process)
         image_process = TimeDistributed(Conv2D(32, (5, 5), activation='elu', kernel_initializer='he_normal'))(image_process)
@@ -86,31 +121,18 @@ class RDQNAgent(object):
         #state_process = image_process
 
         # Critic
-        Qvalue1 = Dense(128, kernel_initializer='he_normal', use_bias=False)(state_process)
-        Qvalue1 = BatchNormalization()(Qvalue1)
-        Qvalue1 = ELU()(Qvalue1)
-        Qvalue1 = Dense(128, kernel_initializer='he_normal', use_bias=False)(Qvalue1)
-        Qvalue1 = BatchNormalization()(Qvalue1)
-        Qvalue1 = ELU()(Qvalue1)
-        Qvalue1 = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue1)
-
-        Qvalue2 = Dense(128, kernel_initializer='he_normal', use_bias=False)(state_process)
-        Qvalue2 = BatchNormalization()(Qvalue2)
-        Qvalue2 = ELU()(Qvalue2)
-        Qvalue2 = Dense(128, kernel_initializer='he_normal', use_bias=False)(Qvalue2)
-        Qvalue2 = BatchNormalization()(Qvalue2)
-        Qvalue2 = ELU()(Qvalue2)
-        Qvalue2 = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue2)
-
-        Qvalue3 = Dense(128, kernel_initializer='he_normal', use_bias=False)(state_process)
-        Qvalue3 = BatchNormalization()(Qvalue3)
-        Qvalue3 = ELU()(Qvalue3)
-        Qvalue3 = Dense(128, kernel_initializer='he_normal', use_bias=False)(Qvalue3)
-        Qvalue3 = BatchNormalization()(Qvalue3)
-        Qvalue3 = ELU()(Qvalue3)
-        Qvalue3 = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue3)
-
-        critic = Model(inputs=[image, vel], outputs=[Qvalue1, Qvalue2, Qvalue3])
+        Qvalues = []
+        for _ in range(self.num_drone):
+            Qvalue = Dense(128, kernel_initializer='he_normal', use_bias=False)(state_process)
+            Qvalue = BatchNormalization()(Qvalue)
+            Qvalue = ELU()(Qvalue)
+            Qvalue = Dense(128, kernel_initializer='he_normal', use_bias=False)(Qvalue)
+            Qvalue = BatchNormalization()(Qvalue)
+            Qvalue = ELU()(Qvalue)
+            Qvalue = Dense(self.action_size, kernel_initializer=tf.random_uniform_initializer(minval=-3e-3, maxval=3e-3))(Qvalue)
+            Qvalues.append(Qvalue)
+
+        critic = Model(inputs=[image, vel], outputs=Qvalues)
 
         critic.summary()
 
@@ -119,103 +141,84 @@ class RDQNAgent(object):
         return critic
 
     def build_critic_optimizer(self):
-        action1 = K.placeholder(shape=(None, ), dtype='int32')
-        action2 = K.placeholder(shape=(None, ), dtype='int32')
-        action3 = K.placeholder(shape=(None, ), dtype='int32')
-        y1 = K.placeholder(shape=(None, ), dtype='float32')
-        y2 = K.placeholder(shape=(None, ), dtype='float32')
-        y3 = K.placeholder(shape=(None, ), dtype='float32')
-
-        pred1, pred2, pred3 = self.critic.output
-
-        # loss = K.mean(K.square(pred - y))
-        # Huber Loss
-        action_vec1 = K.one_hot(action1, self.action_size)
-        action_vec2 = K.one_hot(action2, self.action_size)
-        action_vec3 = K.one_hot(action3, self.action_size)
-
-        Q1 = K.sum(pred1 * action_vec1, axis=1)
-        Q2 = K.sum(pred2 * action_vec2, axis=1)
-        Q3 = K.sum(pred3 * action_vec3, axis=1)
-
-        error1 = K.abs(y1 - Q1)
-        error2 = K.abs(y2 - Q2)
-        error3 = K.abs(y3 - Q3)
-
-        quadratic1 = K.clip(error1, 0.0, 1.0)
-        quadratic2 = K.clip(error2, 0.0, 1.0)
-        quadratic3 = K.clip(error3, 0.0, 1.0)
-
-        linear1 = error1 - quadratic1
-        linear2 = error2 - quadratic2
-        linear3 = error3 - quadratic3
-
-        preloss1 = K.mean(0.5 * K.square(quadratic1) + linear1)
-        preloss2 = K.mean(0.5 * K.square(quadratic2) + linear2)
-        preloss3 = K.mean(0.5 * K.square(quadratic3) + linear3)
-
-        concatpreloss = tf.stack([preloss1, preloss2, preloss3], axis=0)
+        actions = [K.placeholder(shape=(None, ), dtype='int32') for _ in range(self.num_drone)]
+        ys = [K.placeholder(shape=(None, ), dtype='float32') for _ in range(self.num_drone)]
+        # importance-sampling weights of the minibatch (ones for uniform replay)
+        weights = K.placeholder(shape=(None, ), dtype='float32')
+
+        preloss, errors = [], []
+        for pred, action, y in zip(self.critic.outputs, actions, ys):
+            # loss = K.mean(K.square(pred - y))
+            # Huber Loss
+            action_vec = K.one_hot(action, self.action_size)
+            Q = K.sum(pred * action_vec, axis=1)
+            error = K.abs(y - Q)
+            quadratic = K.clip(error, 0.0, 1.0)
+            linear = error - quadratic
+            preloss.append(K.mean(weights * (0.5 * K.square(quadratic) + linear)))
+            errors.append(error)
+
+        # per-sample TD error, fed back to the replay priorities
+        td_error = sum(errors) / self.num_drone
+
+        concatpreloss = tf.stack(preloss, axis=0)
         loss = K.mean(concatpreloss)
 
         optimizer = Adam(lr=self.lr)
         updates = optimizer.get_updates(self.critic.trainable_weights, [], loss)
         #updates = optimizer.get_updates(params=self.critic.trainable_weights, loss=loss)
         train = K.function(
-            [self.critic.input[0], self.critic.input[1], action1, action2, action3, y1, y2, y3],
-            [loss],
+            [self.critic.input[0], self.critic.input[1]] + actions + ys + [weights],
+            [loss, td_error],
             updates=updates
         )
         return train
 
+    def acting_predict(self, state):
+        """
+        Returns the acting critic's Q values for a state, one array per drone, through
+        the embedding cache when it is on
+        """
+        with self.acting_lock:
+            model = self.acting_critic if self.cache is None else self.cache
+            outputs = model.predict(state)
+        if not isinstance(outputs, list):
+            # a single-drone model has one output
+            outputs = [outputs]
+        return outputs
+
     def get_action(self, state):
+        """
+        Returns an (action, greedy action, max Q) tuple per drone
+        """
         #print("state:", state)
-        Qs1, Qs2, Qs3 = self.critic.predict(state)
-        #print("Q values: ", Qs1, Qs2, Qs3)
-        Qmax1 = np.amax(Qs1)
-        Qmax2 = np.amax(Qs2)
-        Qmax3 = np.amax(Qs3)
-        if np.random.random() < self.epsilon:
-            return [(np.random.choice(self.action_size), np.argmax(Qs1), Qmax1),(np.random.choice(self.action_size), np.argmax(Qs2), Qmax2),(np.random.choice(self.action_size), np.argmax(Qs3), Qmax3)]
-        return [(np.argmax(Qs1), np.argmax(Qs1), Qmax1), (np.argmax(Qs2), np.argmax(Qs2), Qmax2), (np.argmax(Qs3), np.argmax(Qs3), Qmax3)]
+        Qs = self.acting_predict(state)
+        #print("Q values: ", Qs)
+        explore = np.random.random() < self.epsilon
+        return [(np.random.choice(self.action_size) if explore else np.argmax(Q), np.argmax(Q), np.amax(Q)) for Q in Qs]
+
+    def sample_batch(self):
+        if self.prefetcher is not None:
+            return self.prefetcher.get()
+        return self.memory.sample(self.batch_size)
 
     def train_model(self):
         print(f'lem mem: {len(self.memory)}, batch: {self.batch_size}')
-        batch = random.sample(self.memory, self.batch_size)
-
-        images = np.zeros([self.batch_size] + self.state_size)
-        vels = np.zeros([self.batch_size, self.pos_size])
-
-        actions1 = np.zeros((self.batch_size))
-        actions2 = np.zeros((self.batch_size))
-        actions3 = np.zeros((self.batch_size))
-
-        rewards = np.zeros((self.batch_size))
-
-        next_images = np.zeros([self.batch_size] + self.state_size)
-        next_vels = np.zeros([self.batch_size, self.pos_size])
-
-        dones = np.zeros((self.batch_size))
-
-        targets = np.zeros((self.batch_size, 1))
-        for i, sample in enumerate(batch):
-            images[i], vels[i] = sample[0]
-            actions1[i] = sample[1]
-            actions2[i] = sample[2]
-            actions3[i] = sample[3]
-            rewards[i] = sample[4]
-            next_images[i], next_vels[i] = sample[5]
-            dones[i] = sample[6]
+        images, vels, actions, rewards, next_images, next_vels, dones, weights, indices = self.sample_batch()
         states = [images, vels]
         next_states = [next_images, next_vels]
         target_next_Qs = self.target_critic.predict(next_states)
-        targets1 = rewards + self.gamma * (1 - dones) * np.amax(target_next_Qs[0], axis=1)
-        targets2 = rewards + self.gamma * (1 - dones) * np.amax(target_next_Qs[1], axis=1)
-        targets3 = rewards + self.gamma * (1 - dones) * np.amax(target_next_Qs[2], axis=1)
-        critic_loss = self.critic_update(states + [actions1, actions2, actions3, targets1, targets2, targets3])
-        return critic_loss[0]
-
-    def append_memory(self, state, action1, action2, action3, reward, next_state, done):
-        self.memory.append((state, action1, action2, action3, reward, next_state, done))
+        if not isinstance(target_next_Qs, list):
+            target_next_Qs = [target_next_Qs]
+        targets = [rewards + self.gamma * (1 - dones) * np.amax(target_next_Q, axis=1) for target_next_Q in target_next_Qs]
+        critic_loss, td_error = self.critic_update(states + [actions[:, i] for i in range(self.num_drone)] + targets + [weights])
+        self.memory.update_priorities(indices, td_error)
+        if self.cache is not None and self.acting_critic is self.critic:
+            self.cache.invalidate()
+        return critic_loss
+
+    def append_memory(self, state, actions, reward, next_state, done):
+        self.memory.append(state, actions, reward, next_state, done)
 
     def load_model(self, name):
         if os.path.exists(name + '.h5'):
@@ -225,23 +228,28 @@ class RDQNAgent(object):
     def save_model(self, name):
         self.critic.save_weights(name + '.h5')
 
+    def publish_weights(self):
+        if self.acting_critic is not self.critic:
+            weights = self.critic.get_weights()
+            with self.acting_lock:
+                self.acting_critic.set_weights(weights)
+                if self.cache is not None:
+                    self.cache.invalidate()
+
     def update_target_model(self):
-        self.target_critic.set_weights(self.critic.get_weights())
+        self.sess.run(self.target_update)
 
 '''
 Environment interaction
 '''
 
 def transform_input(responses, img_height, img_width):
-    dimg_list = []
-    for img in responses:
-        # resize the image to half, from (224, 352) to (112, 176), so that less parameter is needed for the networks.
-        img_resized = cv2.resize(img, (img_width, img_height))
-        dimg = np.array(cv2.cvtColor(img_resized[:,:,:3], cv2.COLOR_BGR2GRAY))
-        dnorm = np.zeros((img_height, img_width))
-        dnorm = cv2.normalize(dimg, dnorm, 0, 255, cv2.NORM_MINMAX)
-        dimg_list.append(dnorm)
-    dimg_all = np.array(dimg_list)
+    # frames stay uint8 from here to the graph input, which casts them
+    dimg_all = np.empty((len(responses), img_height, img_width), dtype=np.uint8)
+    for i, img in enumerate(responses):
+        # resize the image to half, from (224, 352) to (112, 176), so that less parameter is needed for the networks
+        # (not needed when AirSim captures at that size: capture_profile.py)
+        dimg_all[i] = model_frame(img, img_height, img_width)
     image = dimg_all.reshape(1, img_height, img_width, len(responses))
     print("transform responses len: ", len(responses))
     #cv2.imwrite('view.png', dimg)
@@ -280,6 +288,42 @@ if __name__ == '__main__':
     parser.add_argument('--epoch',      type=int,   default=1)
     parser.add_argument('--batch_size', type=int,   default=32)
     parser.add_argument('--memory_size',type=int,   default=10000)
+    parser.add_argument('--replay_backend', type=str, default='memory', choices=['memory', 'mmap'])
+    parser.add_argument('--replay_dir', type=str,   default='save_replay/' + agent_name)
+    parser.add_argument('--per',        action='store_true')
+    parser.add_argument('--per_alpha',  type=float, default=0.6)
+    parser.add_argument('--per_beta',   type=float, default=0.4)
+    # compress the frames kept in the replay memory ('none': raw uint8)
+    parser.add_argument('--frame_codec', type=str,  default='none', choices=codec_names)
+    parser.add_argument('--codec_workers', type=int, default=4)
+    # minibatches assembled ahead by a background thread (0: sample inside train_model)
+    parser.add_argument('--prefetch',   type=int,   default=0)
+    # train in a learner thread while the main loop steps the env; the acting network gets the weights every --publish_rate updates
+    parser.add_argument('--learner',    action='store_true')
+    parser.add_argument('--publish_rate', type=int, default=10)
+    # act from cached per-frame conv embeddings instead of re-encoding the whole history
+    parser.add_argument('--embedding_cache', action='store_true')
+    # snapshot the replay memory and counters every N episodes (0: off); resumed with --load_model
+    parser.add_argument('--snapshot_rate', type=int, default=0)
+    parser.add_argument('--snapshot_dir', type=str, default='save_replay/' + agent_name + '_snapshot')
+    # move all drones at once in Env.step and settle without sleeping
+    parser.add_argument('--concurrent_motion', action='store_true')
+    parser.add_argument('--async_rpc',  action='store_true')
+    # collision monitor polls per second, debounced over 3 polls (0: the original back-to-back polling)
+    parser.add_argument('--monitor_rate', type=float, default=0.)
+    parser.add_argument('--rpc_pool',   type=int,   default=0,
+                        help='AirSim connections for per-drone threads (0: one shared connection)')
+    # time the phases of the steps; p50/p95/max per episode appended to save_stat/<agent>_spans.csv
+    parser.add_argument('--spans',      action='store_true')
+    # kinematic: the headless NumPy stand-in for AirSim (kinematic_sim.py),
+    # replay: serve the observations of a --record recording back (episode_recorder.py)
+    parser.add_argument('--sim',        type=str,   default='airsim', choices=['airsim', 'kinematic', 'replay'])
+    parser.add_argument('--replay_from', type=str,  default='save_record')
+    # stream every env step (actions, frames, positions, detections, rewards) to this directory
+    parser.add_argument('--record',     type=str,   default='')
+    # fleet size (one Q head per drone) and the cameras of each drone
+    parser.add_argument('--num_drone',  type=int,   default=num_drone)
+    parser.add_argument('--cameras',    type=int,   nargs='+', default=camList)
     #parser.add_argument('--train_start',type=int,   default=1000)
     parser.add_argument('--train_start',type=int,   default=200)
     parser.add_argument('--train_rate', type=int,   default=5)
@@ -301,9 +345,9 @@ if __name__ == '__main__':
 
     # Make RL agent
     # state_size consists of [args.seqsize] images sets per history, where in every set, the number of images is [num_drone] times [num_cam].  
-    state_size = [args.seqsize, args.img_height, args.img_width, num_drone*num_cam]
+    state_size = [args.seqsize, args.img_height, args.img_width, args.num_drone*len(args.cameras)]
     action_size = 7
-    pos_size = num_drone*3
+    pos_size = args.num_drone*3
     agent = RDQNAgent(
         state_size=state_size,
         pos_size=pos_size,
@@ -315,11 +359,35 @@ if __name__ == '__main__':
         epsilon=args.epsilon,
         epsilon_end=args.epsilon_end,
         decay_step=args.decay_step,
-        load_model=args.load_model
+        load_model=args.load_model,
+        replay_backend=args.replay_backend,
+        replay_dir=args.replay_dir,
+        per=args.per,
+        per_alpha=args.per_alpha,
+        per_beta=args.per_beta,
+        frame_codec=args.frame_codec,
+        codec_workers=args.codec_workers,
+        prefetch=args.prefetch,
+        decoupled=args.learner,
+        embedding_cache=args.embedding_cache,
+        num_drone=args.num_drone
     )
 
     episode = 0
-    env = Env()
+    if args.sim == 'replay':
+        env = ReplayEnv(args.replay_from)
+    else:
+        env = Env(concurrent_motion=args.concurrent_motion, async_rpc=args.async_rpc, rpc_pool=args.rpc_pool, monitor_rate=args.monitor_rate, sim=args.sim, verbose=args.verbose or args.sim != 'kinematic', num_drone=args.num_drone, camList=args.cameras)
+    profiler = None
+    if args.spans:
+        profiler = StepProfiler('save_stat/' + agent_name + '_spans.csv')
+        if args.sim != 'replay':
+            instrument_env(profiler, env)
+        profiler.instrument(agent, 'get_action', 'get_action')
+        profiler.instrument(agent, 'train_model', 'train_model')
+        transform_input = profiler.wrap('transform_input', transform_input)
+    if args.record:
+        env = EpisodeRecorder(env, args.record)
     if args.play:
         print("Evaluation process")
         while True:
@@ -342,16 +410,16 @@ if __name__ == '__main__':
                 while not done:
                     timestep += 1
                     # predstart = time.time()
-                    Qs1, Qs2, Qs3 = agent.critic.predict(state)
+                    Qs = agent.acting_predict(state)
                     # predend = time.time()
                     # total_time = predend - predstart
                     # with open('rdqn_predtime.txt', 'a') as txtfile:
                     #     txtfile.write(" ".join(str(total_time)) + '\n')
 
-                    action1, action2, action3 = np.argmax(Qs1), np.argmax(Qs2), np.argmax(Qs3)
-                    Qmax1, Qmax2, Qmax3 = np.amax(Qs1), np.amax(Qs2), np.amax(Qs3)
-                    real_action1, real_action2, real_action3 = interpret_action(action1), interpret_action(action2), interpret_action(action3)
-                    observe, reward, done, info = env.step([real_action1, real_action2, real_action3])
+                    actions = [np.argmax(Q) for Q in Qs]
+                    Qmaxs = [np.amax(Q) for Q in Qs]
+                    real_actions = [interpret_action(action) for action in actions]
+                    observe, reward, done, info = env.step(real_actions)
                     image, vel = observe
                     #vel = np.array(vel)
                     try:
@@ -364,19 +432,18 @@ if __name__ == '__main__':
                     vel = vel.reshape(1, -1)
                     next_state = [history, vel]
                     reward = np.sum(np.array(reward))
-                    info1, info2, info3 = info[0]['status'], info[1]['status'], info[2]['status']
+                    infos = [i['status'] for i in info]
 
                     # stats
-                    avgQ += float(Qmax1 + Qmax2 + Qmax3)
+                    avgQ += float(sum(Qmaxs))
                     score += float(reward)
                     if float(reward) > bestReward:
                         bestReward = float(reward)
-                    print('Eval ACTION: %s' % (ACTION[action1]), end='\r', flush=True)
-                    print('Eval ACTION: %s' % (ACTION[action2]), end='\r', flush=True)
-                    print('Eval ACTION: %s' % (ACTION[action3]), end='\r', flush=True)
+                    for action in actions:
+                        print('Eval ACTION: %s' % (ACTION[action]), end='\r', flush=True)
 
                     if args.verbose:
-                        print('Step %d Action1 %s Action2 %s Action3 %s Reward %.2f Info1 %s Info2 %s Info3 %s:' % (timestep, real_action1, real_action2, real_action3, reward, info1, info2, info3))
+                        print('Step %d Actions %s Reward %.2f Infos %s:' % (timestep, real_actions, reward, infos))
 
                     state = next_state
 
@@ -387,17 +454,18 @@ if __name__ == '__main__':
 
                 # done
 
-                print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f Info1 %s Info2 %s Info3 %s'
-                        % (episode, bestReward, timestep, score, avgQ, info1, info2, info3))
+                print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f Infos %s'
+                        % (episode, bestReward, timestep, score, avgQ, infos))
 
                 stats = [
                 episode, timestep, score, bestReward, \
-                avgQ, info[0]['status'], info[1]['status'], info[2]['status']
-                ]
+                avgQ] + [i['status'] for i in info]
                 # log stats
                 with open('save_stat/'+ agent_name + '_test_stat.csv', 'a', encoding='utf-8', newline='') as f:
                     wr = csv.writer(f)
                     wr.writerow(['%.4f' % s if type(s) is float else s for s in stats])
+                if profiler is not None:
+                    print(profiler.flush(episode))
 
                 episode += 1
             except KeyboardInterrupt:
@@ -421,123 +489,152 @@ if __name__ == '__main__':
                 print('Highscore:', highscore)
         global_step = 0
         global_train_num = 0
+        snapshot = None
+        if args.snapshot_rate:
+            snapshot = ReplaySnapshot(args.snapshot_dir)
+            if args.load_model and snapshot.exists():
+                counters = snapshot.load(agent.memory)
+                agent.epsilon = counters['epsilon']
+                global_step = counters['global_step']
+                global_train_num = counters['global_train_num']
+        learner = None
+        if args.learner:
+            # at most --epoch updates per --train_rate env steps, the replay ratio of the synchronous loop
+            learner = Learner(agent, args.publish_rate, args.target_rate, updates_per_step=args.epoch / float(args.train_rate))
         while True:
-        # try:  
-            done = False
-            bug = False
+            try:
+                done = False
+                bug = False
 
-            # stats
-            bestReward, timestep, score, avgQ = 0., 0, 0., 0.
-            train_num, loss = 0, 0.
+                # stats
+                bestReward, timestep, score, avgQ = 0., 0, 0., 0.
+                train_num, loss = 0, 0.
+                throughput = Throughput()
 
-            observe = env.reset()
-            image, vel = observe
-            #vel = np.array(vel)
-            try:
-                image = transform_input(image, args.img_height, args.img_width)
-            except:
-                print("transform_image error..")
-                continue
-            history = np.stack([image] * args.seqsize, axis=1)
-            vel = vel.reshape(1, -1)
-            state = [history, vel]
-            print(f'Main Loop: done: {done}, timestep: {timestep}, time_limit: {time_limit}')
-            while not done and timestep < time_limit:
-                print(f'Sub Loop: timestep: {timestep}, global_step: {global_step}')
-                timestep += 1
-                global_step += 1
-                print("len(agent.memory): ", len(agent.memory))
-                print("args.train_start: ", args.train_start)
-                print("args.train_rate: ", args.train_rate)
-                if len(agent.memory) >= args.train_start and global_step >= args.train_rate:
-                    print('Training model')
-                    for _ in range(args.epoch):
-                        c_loss = agent.train_model()
-                        loss += float(c_loss)
-                        train_num += 1
-                        global_train_num += 1
-                    global_step = 0 
-                if global_train_num >= args.target_rate:
-                    print('Updating target model')
-                    agent.update_target_model()
-                    global_train_num = 0
-                (action1, policy1, Qmax1), (action2, policy2, Qmax2), (action3, policy3, Qmax3) = agent.get_action(state)
-                real_action1, real_action2, real_action3 = interpret_action(action1), interpret_action(action2), interpret_action(action3)
-                observe, reward, done, info = env.step([real_action1,real_action2,real_action3])
+                observe = env.reset()
                 image, vel = observe
                 #vel = np.array(vel)
-                info1, info2, info3 = info[0]['status'], info[1]['status'], info[2]['status']
-                print("Done: ", done)
-                print("Timestep: ", timestep)
                 try:
-                    print("STATUS: ", timestep, info[0]['status'], info[1]['status'], info[2]['status'])
-                    if timestep < 3 and info[0]['status'] == 'landed' and info[1]['status'] == 'landed' and info[2]['status'] == 'landed':
-                        raise Exception
                     image = transform_input(image, args.img_height, args.img_width)
                 except:
-                    print('BUG')
-                    bug = True
-                    break
-                history = np.append(history[:, 1:], [image], axis=1)
+                    print("transform_image error..")
+                    continue
+                history = np.stack([image] * args.seqsize, axis=1)
                 vel = vel.reshape(1, -1)
-                next_state = [history, vel]
-                reward = np.sum(np.array(reward))
-                agent.append_memory(state, action1, action2, action3, reward, next_state, done)
+                state = [history, vel]
+                print(f'Main Loop: done: {done}, timestep: {timestep}, time_limit: {time_limit}')
+                while not done and timestep < time_limit:
+                    print(f'Sub Loop: timestep: {timestep}, global_step: {global_step}')
+                    timestep += 1
+                    global_step += 1
+                    print("len(agent.memory): ", len(agent.memory))
+                    print("args.train_start: ", args.train_start)
+                    print("args.train_rate: ", args.train_rate)
+                    if learner is not None:
+                        if not learner.started() and len(agent.memory) >= args.train_start:
+                            learner.start()
+                    elif len(agent.memory) >= args.train_start and global_step >= args.train_rate:
+                        print('Training model')
+                        for _ in range(args.epoch):
+                            c_loss = agent.train_model()
+                            loss += float(c_loss)
+                            train_num += 1
+                            global_train_num += 1
+                        global_step = 0 
+                    if global_train_num >= args.target_rate:
+                        print('Updating target model')
+                        agent.update_target_model()
+                        global_train_num = 0
+                    actions, policies, Qmaxs = zip(*agent.get_action(state))
+                    real_actions = [interpret_action(action) for action in actions]
+                    observe, reward, done, info = env.step(real_actions)
+                    image, vel = observe
+                    #vel = np.array(vel)
+                    infos = [i['status'] for i in info]
+                    print("Done: ", done)
+                    print("Timestep: ", timestep)
+                    try:
+                        print("STATUS: ", timestep, *infos)
+                        if timestep < 3 and all(status == 'landed' for status in infos):
+                            raise Exception
+                        image = transform_input(image, args.img_height, args.img_width)
+                    except:
+                        print('BUG')
+                        bug = True
+                        break
+                    history = np.append(history[:, 1:], [image], axis=1)
+                    vel = vel.reshape(1, -1)
+                    next_state = [history, vel]
+                    reward = np.sum(np.array(reward))
+                    agent.append_memory(state, actions, reward, next_state, done)
+                    if learner is not None:
+                        learner.add_steps()
 
-                # stats
-                avgQ += float(Qmax1 + Qmax2 + Qmax3)
-                score += float(reward)
-                if float(reward) > bestReward:
-                    bestReward = float(reward)
-                #print("reward: ", reward)
-
-                # print('ACTION: %s | %s' % (ACTION[action1], ACTION[policy1]), end='\r', flush=True)
-                # print('ACTION: %s | %s' % (ACTION[action2], ACTION[policy2]), end='\r', flush=True)
-                # print('ACTION: %s | %s' % (ACTION[action3], ACTION[policy3]), end='\r', flush=True)
-
-                print('ACTION: %s | %s' % (ACTION[action1], ACTION[policy1]))
-                print('ACTION: %s | %s' % (ACTION[action2], ACTION[policy2]))
-                print('ACTION: %s | %s' % (ACTION[action3], ACTION[policy3]))
-
-                if args.verbose:
-                    print('Step %d Action1 %s Action2 %s Action3 %s Reward %.2f Info1 %s Info2 %s Info3 %s:' % (timestep, real_action1, real_action2, real_action3, reward, info1, info2, info3))
-
-                state = next_state
-
-                if agent.epsilon > agent.epsilon_end:
-                    agent.epsilon -= agent.epsilon_decay
-                print("epsilon: ", agent.epsilon)
-
-            if bug:
-                continue
-            if train_num:
-                loss /= train_num
-            avgQ /= timestep
-
-            # done
-            if args.verbose or episode % 10 == 0:
-                print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f'
-                        % (episode, bestReward, timestep, score, avgQ))
-            stats = [
-                episode, timestep, score, bestReward, \
-                loss, avgQ, info[0]['status'], info[1]['status'], info[2]['status']
-            ]
-            # log stats
-            with open('save_stat/'+ agent_name + '_stat.csv', 'a', encoding='utf-8', newline='') as f:
-                wr = csv.writer(f)
-                wr.writerow(['%.4f' % s if type(s) is float else s for s in stats])
-            if highscore < bestReward:
-                highscore = bestReward
-                with open('save_stat/'+ agent_name + '_highscore.csv', 'w', encoding='utf-8', newline='') as f:
+                    # stats
+                    avgQ += float(sum(Qmaxs))
+                    score += float(reward)
+                    if float(reward) > bestReward:
+                        bestReward = float(reward)
+                    #print("reward: ", reward)
+
+                    # print('ACTION: %s | %s' % (ACTION[action1], ACTION[policy1]), end='\r', flush=True)
+                    # print('ACTION: %s | %s' % (ACTION[action2], ACTION[policy2]), end='\r', flush=True)
+                    # print('ACTION: %s | %s' % (ACTION[action3], ACTION[policy3]), end='\r', flush=True)
+
+                    for action, policy in zip(actions, policies):
+                        print('ACTION: %s | %s' % (ACTION[action], ACTION[policy]))
+
+                    if args.verbose:
+                        print('Step %d Actions %s Reward %.2f Infos %s:' % (timestep, real_actions, reward, infos))
+
+                    state = next_state
+
+                    if agent.epsilon > agent.epsilon_end:
+                        agent.epsilon -= agent.epsilon_decay
+                    print("epsilon: ", agent.epsilon)
+
+                if bug:
+                    continue
+                if train_num:
+                    loss /= train_num
+                if learner is not None:
+                    train_num, losses = learner.pop_stats()
+                    loss = float(losses[0]) if train_num else 0.
+                print(throughput.report(timestep, train_num))
+                if args.frame_codec != 'none':
+                    print(agent.memory.report())
+                if agent.prefetcher is not None:
+                    print(agent.prefetcher.report())
+                if profiler is not None:
+                    print(profiler.flush(episode))
+                avgQ /= timestep
+
+                # done
+                if args.verbose or episode % 10 == 0:
+                    print('Ep %d: BestReward %.3f Step %d Score %.2f AvgQ %.2f'
+                            % (episode, bestReward, timestep, score, avgQ))
+                stats = [
+                    episode, timestep, score, bestReward, \
+                    loss, avgQ] + [i['status'] for i in info]
+                # log stats
+                with open('save_stat/'+ agent_name + '_stat.csv', 'a', encoding='utf-8', newline='') as f:
                     wr = csv.writer(f)
-                    wr.writerow('%.4f' % s if type(s) is float else s for s in [highscore, episode, score, dt.now().strftime('%Y-%m-%d %H:%M:%S')])
-                agent.save_model('./save_model/'+ agent_name + '_best')
-            agent.save_model('./save_model/'+ agent_name)
-            episode += 1
-        # except KeyboardInterrupt:
-        #     env.disconnect()
-        #     break
-        # except Exception as e:
-        #     print(f'{e}')
-        #     break
+                    wr.writerow(['%.4f' % s if type(s) is float else s for s in stats])
+                if highscore < bestReward:
+                    highscore = bestReward
+                    with open('save_stat/'+ agent_name + '_highscore.csv', 'w', encoding='utf-8', newline='') as f:
+                        wr = csv.writer(f)
+                        wr.writerow('%.4f' % s if type(s) is float else s for s in [highscore, episode, score, dt.now().strftime('%Y-%m-%d %H:%M:%S')])
+                    agent.save_model('./save_model/'+ agent_name + '_best')
+                agent.save_model('./save_model/'+ agent_name)
+                if snapshot is not None and episode % args.snapshot_rate == 0:
+                    snapshot.save(agent.memory, {'epsilon': agent.epsilon, 'global_step': global_step, 'global_train_num': global_train_num})
+                episode += 1
+            except KeyboardInterrupt:
+                if learner is not None:
+                    learner.stop()
+                if snapshot is not None:
+                    snapshot.save(agent.memory, {'epsilon': agent.epsilon, 'global_step': global_step, 'global_train_num': global_train_num}, wait=True)
+                env.disconnect()
+                break
 
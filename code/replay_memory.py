@@ -0,0 +1,411 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from frame_codec import make_codec
+
+
+class ReplayMemory(object):
+    """
+    Replay memory that keeps every transformed frame exactly once.
+
+    Consecutive states of an episode share seqsize-1 frames, so instead of
+    storing the full [history, vel] state and next_state of every transition,
+    each observation (newest frame + vel) is written once into a ring of slots
+    and the histories are rebuilt from slot indices at sample time. Like the
+    training loop, a history never reaches back past the first observation of
+    its episode; that frame is repeated instead.
+    """
+
+    def __init__(self, capacity, state_size, pos_size, action_shape, action_dtype=np.float32, priority=None):
+        self.capacity = capacity
+        self.seqsize = state_size[0]
+        self.frame_shape = tuple(state_size[1:])
+        self.pos_size = pos_size
+
+        # one slot per observation; the transition that led to the observation
+        # (action, reward, done) is stored in the same slot. All arrays are
+        # preallocated and used as a circular buffer.
+        self.frames = self.alloc('frames', (capacity,) + self.frame_shape, np.uint8)
+        self.vels = self.alloc('vels', (capacity, pos_size), np.float32)
+        self.actions = self.alloc('actions', (capacity,) + tuple(action_shape), action_dtype)
+        self.rewards = self.alloc('rewards', (capacity,), np.float32)
+        self.dones = self.alloc('dones', (capacity,), np.float32)
+
+        # absolute index of the observation in each slot, and of the first
+        # observation of its episode
+        self.index = np.full(capacity, -1, dtype=np.int64)
+        self.ep_start = np.zeros(capacity, dtype=np.int64)
+        # slot holds a sampleable transition (not an episode start, and its
+        # history has not been evicted)
+        self.valid = np.zeros(capacity, dtype=bool)
+
+        self.total = 0
+        self.size = 0
+        self.cur_ep_start = 0
+        self.last_done = True
+
+        # PrioritySampler, or None for uniform sampling
+        self.priority = priority
+
+        # minibatch output buffers, reused by every sample() of the same size
+        self.batch_size = None
+        self.buffers = None
+        # dtype of the sampled images: frames are fed as uint8 and cast in the graph
+        self.image_dtype = np.uint8
+        # held while appending or sampling, so a BatchPrefetcher thread can sample concurrently
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def alloc(self, name, shape, dtype):
+        return np.zeros(shape, dtype=dtype)
+
+    def append(self, state, actions, reward, next_state, done):
+        """
+        Method to store a transition
+        state and next_state are [history, vel] as built by the training loop
+        """
+        with self.lock:
+            if self.last_done or not self.continues(state):
+                self.cur_ep_start = self.total
+                self.write_slot(state[0][0, -1], state[1][0])
+
+            slot = self.write_slot(next_state[0][0, -1], next_state[1][0])
+            self.actions[slot] = actions
+            self.rewards[slot] = reward
+            self.dones[slot] = done
+            self.set_valid(slot, True)
+            self.last_done = bool(done)
+
+    def continues(self, state):
+        """
+        Check whether state is the last stored observation, i.e. whether the
+        transition continues the current episode
+        """
+        if self.total == 0:
+            return False
+        slot = (self.total - 1) % self.capacity
+        return self.frame_equal(slot, state[0][0, -1]) \
+            and np.array_equal(self.vels[slot], np.asarray(state[1][0], dtype=self.vels.dtype))
+
+    def frame_equal(self, slot, frame):
+        return np.array_equal(self.frames[slot], frame)
+
+    def store_frame(self, slot, frame):
+        self.frames[slot] = frame
+
+    def gather_frames(self, window, out):
+        np.take(self.frames, window, axis=0, out=out)
+
+    def set_valid(self, slot, valid):
+        if self.valid[slot] == valid:
+            return
+        self.valid[slot] = valid
+        self.size += 1 if valid else -1
+        if self.priority is not None:
+            self.priority.set_valid(slot, valid)
+
+    def write_slot(self, frame, vel):
+        n = self.total
+        slot = n % self.capacity
+        self.set_valid(slot, False)
+        self.store_frame(slot, frame)
+        self.vels[slot] = vel
+        self.index[slot] = n
+        self.ep_start[slot] = self.cur_ep_start
+        self.total += 1
+        self.evict(n - self.capacity + 1)
+        return slot
+
+    def evict(self, oldest):
+        # transitions whose state history reaches back before the oldest
+        # retained observation can no longer be rebuilt
+        if oldest <= 0:
+            return
+        for n in range(oldest, min(oldest + self.seqsize, self.total)):
+            slot = n % self.capacity
+            if self.valid[slot] and max(self.ep_start[slot], n - self.seqsize) < oldest:
+                self.set_valid(slot, False)
+
+    def history_slots(self, slots):
+        """
+        Slot indices of the seqsize+1 frames spanning state and next_state
+        of the transitions stored in slots
+        """
+        n = self.index[slots]
+        window = n[:, None] + np.arange(-self.seqsize, 1)
+        window = np.maximum(window, self.ep_start[slots][:, None])
+        return window % self.capacity
+
+    def sample_slots(self, batch_size):
+        """
+        Draw batch_size distinct valid slots uniformly at random
+        """
+        if batch_size > self.size:
+            raise ValueError('Sample larger than memory: %d > %d' % (batch_size, self.size))
+        filled = min(self.total, self.capacity)
+        slots = np.empty(0, dtype=np.int64)
+        while len(slots) < batch_size:
+            cand = np.random.randint(filled, size=2 * batch_size)
+            slots = np.concatenate([slots, cand[self.valid[cand]]])
+            # drop repeats but keep the draw order, so truncating stays uniform
+            _, first = np.unique(slots, return_index=True)
+            slots = slots[np.sort(first)]
+        return slots[:batch_size]
+
+    def alloc_buffers(self, batch_size):
+        self.batch_size = batch_size
+        self.buffers = self.make_buffers(batch_size)
+
+    def make_buffers(self, batch_size):
+        window_shape = (batch_size, self.seqsize + 1) + self.frame_shape
+        state_shape = (batch_size, self.seqsize) + self.frame_shape
+        return {
+            'window': np.empty(window_shape, dtype=np.uint8),
+            'images': np.empty(state_shape, dtype=self.image_dtype),
+            'next_images': np.empty(state_shape, dtype=self.image_dtype),
+            'vels': np.empty((batch_size, self.pos_size), dtype=np.float32),
+            'next_vels': np.empty((batch_size, self.pos_size), dtype=np.float32),
+            'actions': np.empty((batch_size,) + self.actions.shape[1:], dtype=self.actions.dtype),
+            'rewards': np.empty(batch_size, dtype=np.float32),
+            'dones': np.empty(batch_size, dtype=np.float32),
+            'weights': np.ones(batch_size, dtype=np.float32),
+        }
+
+    def sample(self, batch_size, buf=None):
+        """
+        Method to sample a minibatch
+        Besides the transitions, returns their importance-sampling weights
+        (all ones for uniform sampling) and the absolute indices of their
+        observations, to be passed back to update_priorities. The returned arrays are reused by the next call
+        with the same batch_size, so they must be consumed (fed to the
+        session) first. buf (from make_buffers) fills caller-owned buffers
+        instead.
+        """
+        if buf is None:
+            if batch_size != self.batch_size:
+                self.alloc_buffers(batch_size)
+            buf = self.buffers
+        with self.lock:
+            return self.sample_into(batch_size, buf)
+
+    def sample_into(self, batch_size, buf):
+        if self.priority is None:
+            slots = self.sample_slots(batch_size)
+        else:
+            if batch_size > self.size:
+                raise ValueError('Sample larger than memory: %d > %d' % (batch_size, self.size))
+            slots = self.priority.sample(batch_size, self.size, out=buf['weights'])
+        prev = (self.index[slots] - 1) % self.capacity
+
+        # one gather of the seqsize+1 frames shared by state and next_state
+        self.gather_frames(self.history_slots(slots), buf['window'])
+        np.copyto(buf['images'], buf['window'][:, :-1])
+        np.copyto(buf['next_images'], buf['window'][:, 1:])
+        np.take(self.vels, prev, axis=0, out=buf['vels'])
+        np.take(self.vels, slots, axis=0, out=buf['next_vels'])
+        np.take(self.actions, slots, axis=0, out=buf['actions'])
+        np.take(self.rewards, slots, out=buf['rewards'])
+        np.take(self.dones, slots, out=buf['dones'])
+        # the write counter of each slot tags the sample, so that update_priorities
+        # can tell a slot overwritten since (e.g. by a prefetched batch) apart
+        return buf['images'], buf['vels'], buf['actions'], buf['rewards'], \
+            buf['next_images'], buf['next_vels'], buf['dones'], buf['weights'], self.index[slots]
+
+    def update_priorities(self, indices, td_errors):
+        """
+        Method to feed the TD errors of a sampled minibatch back into the
+        sampling priorities (no-op for uniform sampling). Transitions whose
+        slot was overwritten or evicted since they were sampled are skipped.
+        """
+        if self.priority is not None:
+            with self.lock:
+                slots = indices % self.capacity
+                fresh = (self.index[slots] == indices) & self.valid[slots]
+                if fresh.any():
+                    self.priority.update(slots[fresh], td_errors[fresh])
+
+
+class MmapReplayMemory(ReplayMemory):
+    """
+    ReplayMemory whose frames, vels, actions, rewards and dones live in
+    np.memmap files under replay_dir, for capacities that do not fit in RAM.
+    Only the slot index (a few bytes per slot) is kept in memory; the OS page
+    cache decides how much of the data stays resident.
+    """
+
+    def __init__(self, capacity, state_size, pos_size, action_shape, action_dtype=np.float32, priority=None,
+                 replay_dir='save_replay'):
+        self.replay_dir = replay_dir
+        if not os.path.exists(replay_dir):
+            os.makedirs(replay_dir)
+        super(MmapReplayMemory, self).__init__(capacity, state_size, pos_size, action_shape, action_dtype, priority)
+
+    def alloc(self, name, shape, dtype):
+        return np.memmap(os.path.join(self.replay_dir, name + '.dat'), dtype=dtype, mode='w+', shape=shape)
+
+    def flush(self):
+        for arr in (self.frames, self.vels, self.actions, self.rewards, self.dones):
+            arr.flush()
+
+
+class CompressedReplayMemory(ReplayMemory):
+    """
+    ReplayMemory that keeps every frame compressed with a frame_codec codec.
+    The frames of a minibatch are decompressed by a pool of worker threads
+    (zlib, lz4 and cv2 release the GIL), each distinct slot only once.
+    """
+
+    def __init__(self, capacity, state_size, pos_size, action_shape, action_dtype=np.float32, priority=None,
+                 codec='zlib', workers=4):
+        self.codec = make_codec(codec)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.last_frame = None
+        # bytes currently stored, and time spent decoding minibatches
+        self.stored_bytes = 0
+        self.decode_time = 0.
+        self.decode_calls = 0
+        super(CompressedReplayMemory, self).__init__(capacity, state_size, pos_size, action_shape, action_dtype, priority)
+
+    def alloc(self, name, shape, dtype):
+        if name == 'frames':
+            # one bytes object (or None) per slot
+            return np.full(shape[0], None, dtype=object)
+        return np.zeros(shape, dtype=dtype)
+
+    def frame_equal(self, slot, frame):
+        # only ever asked about the last stored frame, which is kept raw
+        return self.last_frame is not None and np.array_equal(self.last_frame, frame)
+
+    def store_frame(self, slot, frame):
+        data = self.codec.encode(frame)
+        if self.frames[slot] is not None:
+            self.stored_bytes -= len(self.frames[slot])
+        self.frames[slot] = data
+        self.stored_bytes += len(data)
+        self.last_frame = np.array(frame, dtype=np.uint8)
+
+    def gather_frames(self, window, out):
+        start = time.time()
+        unique, inverse = np.unique(window, return_inverse=True)
+        decoded = np.empty((len(unique),) + self.frame_shape, dtype=np.uint8)
+        list(self.pool.map(lambda i: self.codec.decode(self.frames[unique[i]], decoded[i]), range(len(unique))))
+        np.take(decoded, inverse.reshape(window.shape), axis=0, out=out)
+        self.decode_time += time.time() - start
+        self.decode_calls += 1
+
+    def compression_ratio(self):
+        stored = min(self.total, self.capacity)
+        if not self.stored_bytes:
+            return 1.
+        return stored * int(np.prod(self.frame_shape)) / float(self.stored_bytes)
+
+    def report(self):
+        # decode time since the last report
+        latency = self.decode_time / self.decode_calls * 1e3 if self.decode_calls else 0.
+        line = 'Replay %s: %.1f MB stored, compression %.2fx, decode %.1f ms per minibatch' \
+            % (self.codec.name, self.stored_bytes / 1e6, self.compression_ratio(), latency)
+        self.decode_time, self.decode_calls = 0., 0
+        return line
+
+
+class SumTree(object):
+    """
+    Array-based binary sum-tree over capacity leaves. Node i has children 2i
+    and 2i+1, the root is node 1 and leaf j is node leaf_num+j, so updates and
+    prefix-sum lookups are O(log n) and vectorized over a batch of leaves.
+    """
+
+    def __init__(self, capacity):
+        self.leaf_num = 1
+        while self.leaf_num < capacity:
+            self.leaf_num *= 2
+        self.tree = np.zeros(2 * self.leaf_num, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, leaves):
+        return self.tree[np.asarray(leaves) + self.leaf_num]
+
+    def update(self, leaves, values):
+        nodes = np.asarray(leaves, dtype=np.int64) + self.leaf_num
+        self.tree[nodes] = values
+        # all nodes of a level are recomputed together, bottom-up
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Leaf index of every prefix-sum value in [0, total)
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaf_num:
+            left = self.tree[2 * nodes]
+            # never descend into an empty subtree because of rounding
+            right = (values >= left) & (self.tree[2 * nodes + 1] > 0)
+            values -= np.where(right, left, 0)
+            nodes = 2 * nodes + right
+        return nodes - self.leaf_num
+
+
+class PrioritySampler(object):
+    """
+    Proportional prioritized replay (Schaul et al., 2016) over the slots of
+    a ReplayMemory. Slot i is drawn with probability p_i^alpha / sum p^alpha,
+    where p_i = |TD error| + eps, and weighted by (N * P(i))^-beta normalized
+    by the largest weight of the batch. beta is annealed linearly to 1 over
+    beta_steps minibatches.
+    """
+
+    def __init__(self, capacity, alpha=0.6, beta=0.4, beta_steps=20000, eps=1e-3):
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / max(beta_steps, 1)
+        self.eps = eps
+        self.max_priority = 1.0
+
+    def set_valid(self, slot, valid):
+        # new transitions are sampled at least once at the highest priority
+        self.tree.update([slot], [self.max_priority ** self.alpha if valid else 0.0])
+
+    def sample(self, batch_size, size, out):
+        # stratified: one draw from each of batch_size equal segments
+        total = self.tree.total()
+        bounds = np.arange(batch_size) * (total / batch_size)
+        slots = self.tree.find(bounds + np.random.uniform(0, total / batch_size, batch_size))
+        probs = self.tree.get(slots) / total
+        weights = (size * probs) ** -self.beta
+        np.divide(weights, weights.max(), out=out, casting='unsafe')
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return slots
+
+    def update(self, slots, td_errors):
+        priorities = np.abs(td_errors) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max(initial=0))
+        self.tree.update(slots, priorities ** self.alpha)
+
+
+def make_replay_memory(backend, capacity, state_size, pos_size, action_shape, action_dtype=np.float32, replay_dir=None,
+                       per=False, per_alpha=0.6, per_beta=0.4, per_beta_steps=20000, frame_codec='none', codec_workers=4):
+    """
+    Build the replay memory selected by --replay_backend (and --per, --frame_codec)
+    """
+    priority = PrioritySampler(capacity, per_alpha, per_beta, per_beta_steps) if per else None
+    if frame_codec != 'none':
+        if backend != 'memory':
+            raise ValueError('--frame_codec is only supported with --replay_backend memory')
+        return CompressedReplayMemory(capacity, state_size, pos_size, action_shape, action_dtype, priority,
+                                      frame_codec, codec_workers)
+    if backend == 'memory':
+        return ReplayMemory(capacity, state_size, pos_size, action_shape, action_dtype, priority)
+    if backend == 'mmap':
+        return MmapReplayMemory(capacity, state_size, pos_size, action_shape, action_dtype, priority,
+                                replay_dir or 'save_replay')
+    raise ValueError('Unknown replay backend: %s' % backend)
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+manifest_name = 'manifest.json'
+version = 1
+
+
+def frame_codec(memory):
+    codec = getattr(memory, 'codec', None)
+    return 'none' if codec is None else codec.name
+
+
+def unpack_frames(data, sizes):
+    frames = np.full(len(sizes), None, dtype=object)
+    offset = 0
+    for i, size in enumerate(sizes):
+        if size >= 0:
+            frames[i] = data[offset:offset + size].tobytes()
+            offset += size
+    return frames
+
+
+class ReplaySnapshot(object):
+    """
+    Crash-safe, incremental snapshots of a ReplayMemory plus agent counters.
+
+    The slots are saved in fixed-size chunks (one uncompressed .npz per chunk)
+    and only the chunks written since the last snapshot are saved again. The
+    slot index, priorities and counters go into a small index .npz and a JSON
+    manifest. Every snapshot writes new file names and commits by atomically
+    replacing the manifest, so a crash at any point leaves the previous
+    snapshot intact. The training loop only pays for copying the slot index;
+    a background thread copies the dirty chunks one at a time under the
+    memory lock and writes them. Slots overwritten by the training loop
+    before their chunk was copied are saved as evicted.
+    """
+
+    def __init__(self, path, chunk_size=256):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.thread = None
+        # memory.total covered by the last committed snapshot
+        self.saved_total = 0
+        self.manifest = None
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, manifest_name))
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def save(self, memory, counters, wait=False):
+        """
+        Method to snapshot memory and the counters dict
+        Returns False if the previous snapshot is still being written.
+        """
+        if self.busy():
+            if not wait:
+                print('Replay snapshot skipped: previous snapshot still writing')
+                return False
+            self.wait()
+        start = time.time()
+        chunks = self.dirty_chunks(memory)
+        gen = 0 if self.manifest is None else self.manifest['generation'] + 1
+        # a learner or prefetch thread may be sampling and updating priorities meanwhile
+        with memory.lock:
+            index = {
+                'index': memory.index.copy(),
+                'ep_start': memory.ep_start.copy(),
+                'valid': memory.valid.copy(),
+            }
+            if memory.priority is not None:
+                index['priorities'] = memory.priority.tree.get(np.arange(memory.capacity))
+        manifest = {
+            'version': version,
+            'generation': gen,
+            'capacity': memory.capacity,
+            'frame_shape': list(memory.frame_shape),
+            'pos_size': memory.pos_size,
+            'action_shape': list(memory.actions.shape[1:]),
+            'action_dtype': memory.actions.dtype.str,
+            'frame_codec': frame_codec(memory),
+            'chunk_size': self.chunk_size,
+            'total': memory.total,
+            'size': memory.size,
+            'cur_ep_start': memory.cur_ep_start,
+            'last_done': memory.last_done,
+            'counters': counters,
+            'index': 'index_%06d.npz' % gen,
+            'chunks': dict(self.manifest['chunks']) if self.manifest is not None else {},
+        }
+        for c in chunks:
+            manifest['chunks'][str(c)] = 'chunk_%05d_%06d.npz' % (c, gen)
+        if memory.priority is not None:
+            manifest['priority'] = {'max_priority': float(memory.priority.max_priority), 'beta': float(memory.priority.beta)}
+
+        self.thread = threading.Thread(target=self.write, args=(memory, manifest, index, chunks))
+        self.thread.daemon = True
+        self.thread.start()
+        print('Replay snapshot: index copied in %.0f ms, %d chunks to write' % ((time.time() - start) * 1e3, len(chunks)))
+        if wait:
+            self.wait()
+        return True
+
+    def dirty_chunks(self, memory):
+        if self.manifest is None or memory.total - self.saved_total >= memory.capacity:
+            slots = np.arange(min(memory.total, memory.capacity))
+        else:
+            slots = np.arange(self.saved_total, memory.total) % memory.capacity
+        return [int(c) for c in np.unique(slots // self.chunk_size)]
+
+    def copy_chunk(self, memory, c):
+        window = slice(c * self.chunk_size, (c + 1) * self.chunk_size)
+        frames = memory.frames[window]
+        arrays = {}
+        if frames.dtype == object:
+            # compressed frames: concatenated bytes plus their sizes (-1 for empty slots)
+            arrays['frame_sizes'] = np.array([-1 if f is None else len(f) for f in frames], dtype=np.int64)
+            frames = np.frombuffer(b''.join(f for f in frames if f is not None), dtype=np.uint8)
+        arrays.update({
+            'frames': np.array(frames),
+            'vels': np.array(memory.vels[window]),
+            'actions': np.array(memory.actions[window]),
+            'rewards': np.array(memory.rewards[window]),
+            'dones': np.array(memory.dones[window]),
+        })
+        return arrays
+
+    def write_file(self, name, arrays):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def drop_overwritten(self, memory, index, overwritten, total):
+        """
+        Mark the observations of index overwritten since it was copied, and
+        the older ones, as evicted, with the transitions whose history
+        reaches back to them
+        """
+        if not len(overwritten):
+            return
+        # as in the ring, every observation older than an overwritten one is gone,
+        # also where its chunk was copied before the overwrite
+        oldest = int(overwritten.max()) + 1
+        gone = index['index'] < oldest
+        index['valid'][gone] = False
+        index['index'][gone] = -1
+        # the rule of ReplayMemory.evict, applied to the copied index
+        for n in range(oldest, min(oldest + memory.seqsize, total)):
+            slot = n % memory.capacity
+            if index['index'][slot] == n and max(index['ep_start'][slot], n - memory.seqsize) < oldest:
+                index['valid'][slot] = False
+        if 'priorities' in index:
+            index['priorities'][~index['valid']] = 0.
+
+    def write(self, memory, manifest, index, chunks):
+        start = time.time()
+        overwritten = [np.empty(0, dtype=np.int64)]
+        for c in chunks:
+            window = slice(c * self.chunk_size, (c + 1) * self.chunk_size)
+            with memory.lock:
+                arrays = self.copy_chunk(memory, c)
+                changed = memory.index[window] != index['index'][window]
+            # slots the training loop wrote since save() copied the index
+            overwritten.append(index['index'][window][changed & (index['index'][window] >= 0)])
+            self.write_file(manifest['chunks'][str(c)], arrays)
+        self.drop_overwritten(memory, index, np.concatenate(overwritten), manifest['total'])
+        manifest['size'] = int(index['valid'].sum())
+        self.write_file(manifest['index'], index)
+
+        # commit: atomically replace the manifest, then drop superseded files
+        tmp = os.path.join(self.path, manifest_name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, manifest_name))
+        self.manifest = manifest
+        self.saved_total = manifest['total']
+        self.cleanup(manifest)
+        print('Replay snapshot %d written in %.2f s' % (manifest['generation'], time.time() - start))
+
+    def cleanup(self, manifest):
+        keep = set(manifest['chunks'].values()) | {manifest['index'], manifest_name}
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') and name not in keep:
+                os.remove(os.path.join(self.path, name))
+
+    def load(self, memory):
+        """
+        Method to restore memory from the last committed snapshot
+        Returns the counters dict saved with it.
+        A compressed memory gets its raw copy of the last stored frame
+        (last_frame) back, decoded from its slot, so the next append still
+        continues the snapshotted episode.
+        """
+        start = time.time()
+        with open(os.path.join(self.path, manifest_name)) as f:
+            manifest = json.load(f)
+        expected = {
+            'capacity': memory.capacity,
+            'frame_shape': list(memory.frame_shape),
+            'pos_size': memory.pos_size,
+            'action_shape': list(memory.actions.shape[1:]),
+            'action_dtype': memory.actions.dtype.str,
+            'frame_codec': frame_codec(memory),
+        }
+        manifest.setdefault('frame_codec', 'none')
+        for key, value in expected.items():
+            if manifest[key] != value:
+                raise ValueError('Replay snapshot %s mismatch: %s != %s' % (key, manifest[key], value))
+
+        chunk_size = manifest['chunk_size']
+        for c, name in manifest['chunks'].items():
+            window = slice(int(c) * chunk_size, (int(c) + 1) * chunk_size)
+            with np.load(os.path.join(self.path, name)) as arrays:
+                if memory.frames.dtype == object:
+                    memory.frames[window] = unpack_frames(arrays['frames'], arrays['frame_sizes'])
+                else:
+                    memory.frames[window] = arrays['frames']
+                memory.vels[window] = arrays['vels']
+                memory.actions[window] = arrays['actions']
+                memory.rewards[window] = arrays['rewards']
+                memory.dones[window] = arrays['dones']
+        if memory.frames.dtype == object:
+            memory.stored_bytes = sum(len(f) for f in memory.frames if f is not None)
+        with np.load(os.path.join(self.path, manifest['index'])) as index:
+            memory.index[:] = index['index']
+            memory.ep_start[:] = index['ep_start']
+            memory.valid[:] = index['valid']
+            if memory.priority is not None:
+                if 'priorities' in index:
+                    memory.priority.tree.update(np.arange(memory.capacity), index['priorities'])
+                    memory.priority.max_priority = manifest['priority']['max_priority']
+                    memory.priority.beta = manifest['priority']['beta']
+                else:
+                    # snapshot of a uniform memory: start every transition at max priority
+                    valid = np.flatnonzero(memory.valid)
+                    memory.priority.tree.update(valid, np.full(len(valid), memory.priority.max_priority ** memory.priority.alpha))
+        memory.total = manifest['total']
+        memory.size = manifest['size']
+        memory.cur_ep_start = manifest['cur_ep_start']
+        memory.last_done = manifest['last_done']
+        if memory.frames.dtype == object:
+            memory.last_frame = None
+            if memory.total:
+                memory.last_frame = np.empty(memory.frame_shape, dtype=np.uint8)
+                memory.codec.decode(memory.frames[(memory.total - 1) % memory.capacity], memory.last_frame)
+
+        self.chunk_size = chunk_size
+        self.manifest = manifest
+        self.saved_total = memory.total
+        print('Replay snapshot %d loaded: %d transitions in %.2f s'
+              % (manifest['generation'], len(memory), time.time() - start))
+        return manifest['counters']
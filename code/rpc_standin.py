@@ -0,0 +1,261 @@
+import json
+import time
+import asyncio
+import threading
+import argparse
+from collections import Counter
+import numpy as np
+import msgpack
+
+
+def vector(x=0., y=0., z=0.):
+    return {'x_val': float(x), 'y_val': float(y), 'z_val': float(z)}
+
+
+def quaternion(w=1., x=0., y=0., z=0.):
+    return {'w_val': float(w), 'x_val': float(x), 'y_val': float(y), 'z_val': float(z)}
+
+
+class StandinServer(object):
+    """
+    Local msgpack-rpc server answering the subset of the AirSim RPC API that
+    DroneControl and Env use, so the client side (capture, telemetry, RPC
+    counts) can be measured without the simulator.
+
+    Every call is delayed by latency seconds, plus image_latency per image
+    for simGetImages, plus the flight time of move calls scaled by
+    time_scale. Requests are served concurrently, as AirSim does for the
+    async move calls. Calls are counted per method in self.calls.
+    """
+
+    def __init__(self, droneList, host='127.0.0.1', port=41451, latency=0., image_latency=0.,
+                 img_height=144, img_width=256, empty_rate=0., time_scale=1., seed=0):
+        self.droneList = droneList
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.image_latency = image_latency
+        self.img_height = img_height
+        self.img_width = img_width
+        # fraction of images returned empty, to exercise the client retry
+        self.empty_rate = empty_rate
+        # wall-clock seconds per simulated second of a move (0: moves return at once)
+        self.time_scale = time_scale
+        self.rng = np.random.RandomState(seed)
+        self.calls = Counter()
+        self.frame = 0
+        self.spawn = {drone: np.array([0., 3. * i, -8.]) for i, drone in enumerate(droneList)}
+        self.position = {drone: pos.copy() for drone, pos in self.spawn.items()}
+        self.loop = None
+        self.thread = None
+        self.handlers = {name[len('rpc_'):]: getattr(self, name) for name in dir(self) if name.startswith('rpc_')}
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(ready,))
+        self.thread.daemon = True
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.loop.close()
+
+    def num_calls(self):
+        return sum(self.calls.values())
+
+    async def handle(self, reader, writer):
+        unpacker = msgpack.Unpacker(raw=False)
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            unpacker.feed(data)
+            for msg in unpacker:
+                if msg[0] == 0:
+                    asyncio.ensure_future(self.respond(writer, msg[1], msg[2], msg[3]))
+                elif msg[0] == 2:
+                    # notification: no response
+                    asyncio.ensure_future(self.respond(None, None, msg[1], msg[2]))
+        writer.close()
+
+    async def respond(self, writer, msgid, method, params):
+        self.calls[method] += 1
+        delay = self.delay(method, params)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        handler = self.handlers.get(method)
+        if handler is None:
+            error, result = 'rpc method not found: %s' % method, None
+        else:
+            try:
+                error, result = None, handler(*params)
+            except Exception as e:
+                error, result = repr(e), None
+        if writer is not None:
+            writer.write(msgpack.packb([1, msgid, error, result], use_bin_type=True))
+
+    def delay(self, method, params):
+        delay = self.latency
+        if method == 'simGetImages':
+            delay += self.image_latency * len(params[0])
+        elif method in ('moveByVelocity', 'moveByVelocityBodyFrame'):
+            delay += self.time_scale * params[3]
+        elif method == 'moveToPosition':
+            dist = np.linalg.norm(np.array(params[:3], dtype=float) - self.position[params[-1]])
+            delay += self.time_scale * min(dist / params[3], params[4])
+        return delay
+
+    # connection
+    def rpc_ping(self):
+        return True
+
+    def rpc_getServerVersion(self):
+        return 1
+
+    def rpc_getMinRequiredClientVersion(self):
+        return 1
+
+    def rpc_getSettingsString(self):
+        vehicles = {drone: {'VehicleType': 'SimpleFlight', 'X': 0, 'Y': 3 * i, 'Z': 0}
+                    for i, drone in enumerate(self.droneList)}
+        capture = {'ImageType': 0, 'Width': self.img_width, 'Height': self.img_height}
+        return json.dumps({'SettingsVersion': 1.2, 'SimMode': 'Multirotor', 'Vehicles': vehicles,
+                           'CameraDefaults': {'CaptureSettings': [capture]}})
+
+    def rpc_enableApiControl(self, is_enabled, vehicle_name=''):
+        return None
+
+    def rpc_armDisarm(self, arm, vehicle_name=''):
+        return True
+
+    def rpc_reset(self):
+        self.position = {drone: pos.copy() for drone, pos in self.spawn.items()}
+        return None
+
+    def rpc_simPause(self, is_paused):
+        return None
+
+    # state
+    def rpc_getMultirotorState(self, vehicle_name=''):
+        pos = self.position[vehicle_name]
+        return {
+            'collision': {'has_collided': False},
+            'kinematics_estimated': self.kinematics(vehicle_name),
+            'gps_location': {'latitude': 47.641468 + pos[0] * 1e-5, 'longitude': -122.140165 + pos[1] * 1e-5,
+                             'altitude': 122. - pos[2]},
+            'timestamp': int(time.time() * 1e9),
+            'landed_state': 1,
+            'rc_data': {},
+            'ready': True,
+            'ready_message': '',
+            'can_arm': True,
+        }
+
+    def rpc_simGetGroundTruthKinematics(self, vehicle_name=''):
+        return self.kinematics(vehicle_name)
+
+    def rpc_simGetObjectPose(self, object_name, *args):
+        return {'position': vector(*self.position[object_name]), 'orientation': quaternion()}
+
+    def rpc_simGetCollisionInfo(self, vehicle_name=''):
+        return {'has_collided': False, 'normal': vector(), 'impact_point': vector(), 'position': vector(),
+                'penetration_depth': 0., 'time_stamp': 0, 'object_name': '', 'object_id': -1}
+
+    def rpc_getDistanceSensorData(self, distance_sensor_name='', vehicle_name=''):
+        return {'time_stamp': int(time.time() * 1e9), 'distance': 20., 'min_distance': 0.2, 'max_distance': 40.,
+                'relative_pose': {'position': vector(), 'orientation': quaternion()}}
+
+    # motion: the delay stands for the flight time, the drone is then at its destination
+    def rpc_moveToPosition(self, x, y, z, velocity, timeout_sec, *args):
+        self.position[args[-1]] = np.array([x, y, z], dtype=float)
+        return True
+
+    def rpc_moveByVelocity(self, vx, vy, vz, duration, *args):
+        self.position[args[-1]] += np.array([vx, vy, vz]) * duration
+        return True
+
+    def rpc_moveByVelocityBodyFrame(self, vx, vy, vz, duration, *args):
+        # the stand-in drones never yaw, so body frame is world frame
+        self.position[args[-1]] += np.array([vx, vy, vz]) * duration
+        return True
+
+    def rpc_hover(self, vehicle_name=''):
+        return True
+
+    def rpc_takeoff(self, timeout_sec=20, vehicle_name=''):
+        return True
+
+    def rpc_simSetCameraPose(self, camera_name, pose, vehicle_name='', external=False):
+        return None
+
+    def kinematics(self, vehicle_name):
+        return {
+            'position': vector(*self.position[vehicle_name]),
+            'orientation': quaternion(),
+            'linear_velocity': vector(0.1, 0., 0.),
+            'angular_velocity': vector(),
+            'linear_acceleration': vector(),
+            'angular_acceleration': vector(),
+        }
+
+    # images
+    def rpc_simGetImages(self, requests, vehicle_name='', *args):
+        self.frame += 1
+        return [self.image_response(request) for request in requests]
+
+    def image_response(self, request):
+        empty = self.rng.rand() < self.empty_rate
+        height, width = (0, 0) if empty else (self.img_height, self.img_width)
+        if empty:
+            data = b''
+        else:
+            # a moving gradient, so consecutive frames differ
+            row = (np.arange(width) + self.frame * 3 + sum(map(ord, str(request['camera_name']))) * 31) % 256
+            data = np.broadcast_to(row.astype(np.uint8)[None, :, None], (height, width, 3)).tobytes()
+        return {
+            'image_data_uint8': data,
+            'image_data_float': [],
+            'camera_position': vector(),
+            'camera_orientation': quaternion(),
+            'time_stamp': int(time.time() * 1e9),
+            'message': '',
+            'pixels_as_float': False,
+            'compress': False,
+            'width': width,
+            'height': height,
+            'image_type': request['image_type'],
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stand-in AirSim RPC server')
+    parser.add_argument('--port',       type=int,   default=41451)
+    parser.add_argument('--latency',    type=float, default=0.002)
+    parser.add_argument('--image_latency', type=float, default=0.)
+    parser.add_argument('--time_scale', type=float, default=1.)
+    parser.add_argument('--num_drone',  type=int,   default=3)
+    args = parser.parse_args()
+
+    server = StandinServer(['Drone%d' % i for i in range(args.num_drone)], port=args.port,
+                           latency=args.latency, image_latency=args.image_latency,
+                           time_scale=args.time_scale).start()
+    print('Stand-in AirSim RPC server on port %d' % args.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,105 @@
+import os
+import csv
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+import numpy as np
+
+
+class StepProfiler(object):
+    """
+    Wall-clock latency spans of the hot path of Env.step and the training
+    loops. A span is a method or function wrapped by instrument / wrap:
+    the time of every call is recorded under the span's name (several
+    callables can share one). flush() appends the count, total, p50, p95
+    and max of each span over the episode to a CSV file and starts over.
+
+    Nothing is wrapped unless a profiler is made, so with spans off the hot
+    path is unchanged; a wrapped call costs two perf_counter calls and a
+    list append. Calls from other threads (the learner) are recorded too.
+    """
+    fields = ['episode', 'span', 'count', 'total_ms', 'p50_ms', 'p95_ms', 'max_ms']
+
+    def __init__(self, path):
+        self.path = path
+        self.samples = OrderedDict()
+
+    def wrap(self, name, fn):
+        """
+        Method to get fn timed under the span name
+        """
+        record = self.samples.setdefault(name, []).append
+        clock = time.perf_counter
+        if asyncio.iscoroutinefunction(fn):
+            async def timed(*args, **kwargs):
+                start = clock()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record(clock() - start)
+        else:
+            def timed(*args, **kwargs):
+                start = clock()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    record(clock() - start)
+        return functools.wraps(fn)(timed)
+
+    def instrument(self, obj, name, *methods):
+        """
+        Method to time the methods of obj (those it has) under the span name
+        """
+        for method in methods:
+            if hasattr(obj, method):
+                setattr(obj, method, self.wrap(name, getattr(obj, method)))
+
+    def stats(self):
+        """
+        Method to take the samples recorded so far: returns
+        (span, count, total, p50, p95, max) per span with samples, in seconds
+        """
+        stats = []
+        for name, samples in self.samples.items():
+            # only appended to meanwhile: take the first n
+            n = len(samples)
+            if not n:
+                continue
+            taken = np.array(samples[:n])
+            del samples[:n]
+            p50, p95 = np.percentile(taken, [50, 95])
+            stats.append((name, n, taken.sum(), p50, p95, taken.max()))
+        return stats
+
+    def flush(self, episode):
+        """
+        Method to write the spans of an episode to the stats file; returns a
+        one-line summary (p50 / p95 in ms per span)
+        """
+        stats = self.stats()
+        new = not os.path.exists(self.path)
+        with open(self.path, 'a', encoding='utf-8', newline='') as f:
+            wr = csv.writer(f)
+            if new:
+                wr.writerow(self.fields)
+            for name, count, total, p50, p95, peak in stats:
+                wr.writerow([episode, name, count] + ['%.3f' % (s * 1e3) for s in (total, p50, p95, peak)])
+        return 'Spans (p50/p95 ms): ' + '  '.join('%s %.1f/%.1f' % (name, p50 * 1e3, p95 * 1e3)
+                                                  for name, _, _, p50, p95, _ in stats)
+
+
+def instrument_env(profiler, env):
+    """
+    The spans of Env.step: step (all of it), motion, settle (collision
+    polling), capture (images, and the state for step_async), telemetry,
+    yolo, coverage and reward
+    """
+    profiler.instrument(env, 'step', 'step')
+    profiler.instrument(env, 'motion', 'move_drones', 'move_drones_concurrent', 'move_drones_async')
+    profiler.instrument(env.monitor, 'settle', 'watch', 'watch_async')
+    profiler.instrument(env, 'capture', 'capture_state_image', 'capture_async')
+    profiler.instrument(env, 'telemetry', 'capture_telemetry')
+    profiler.instrument(env.dc, 'yolo', 'predict_yv4')
+    profiler.instrument(env.dc, 'coverage', 'testAreaCoverage')
+    profiler.instrument(env, 'reward', 'compute_reward')
@@ -0,0 +1,25 @@
+import tensorflow as tf
+
+
+def build_target_update(models, target_models, tau=1.):
+    """
+    Build one op that moves the weights of target_models towards models
+    on-device: target = tau * source + (1 - tau) * target (tau=1: hard copy).
+
+    Like set_weights(get_weights()), it covers all weights including the
+    BatchNormalization moving statistics. Layers shared between models
+    (the RDDPG actor and critic) are updated once.
+    """
+    pairs = []
+    seen = set()
+    for model, target in zip(models, target_models):
+        for source, dest in zip(model.weights, target.weights):
+            if dest.name in seen:
+                continue
+            seen.add(dest.name)
+            pairs.append((source, dest))
+    if tau == 1.:
+        ops = [tf.assign(dest, source) for source, dest in pairs]
+    else:
+        ops = [tf.assign(dest, tau * source + (1. - tau) * dest) for source, dest in pairs]
+    return tf.group(*ops)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+from bench_agent import acting_model
+from bench_replay import make_agent, synthetic_frame, num_drone, num_cam
+
+# small enough to build in a few seconds, large enough for the whole conv stack
+seqsize, img_height, img_width = 3, 48, 64
+state_size = [seqsize, img_height, img_width, num_drone*num_cam]
+pos_size = num_drone*3
+tolerance = 1e-5
+
+
+@pytest.fixture(params=['rdqn', 'rddpg'])
+def agent(request):
+    tf.reset_default_graph()
+    agent = make_agent(request.param, state_size, pos_size, batch_size=4, memory_size=20, embedding_cache=True)
+    yield agent
+    agent.sess.close()
+
+
+def max_diff(agent, history, vel):
+    full = acting_model(agent).predict([history, vel])
+    cached = agent.cache.predict([history, vel])
+    return max(float(np.max(np.abs(a - b))) for a, b in zip(full, cached))
+
+
+def test_cache_matches_full_model(agent):
+    rng = np.random.RandomState(0)
+    frame_shape = (1,) + tuple(state_size[1:])
+    history = np.stack([synthetic_frame(rng, frame_shape)] * seqsize, axis=1)
+    for t in range(2 * seqsize):
+        assert max_diff(agent, history, rng.rand(1, pos_size)) < tolerance, 'step %d' % t
+        history = np.append(history[:, 1:], [synthetic_frame(rng, frame_shape)], axis=1)
+    # only the newest frame is encoded once the cache is warm
+    assert agent.cache.encoded_frames == seqsize + 2 * seqsize - 1
+
+
+def test_cache_matches_after_new_weights(agent):
+    rng = np.random.RandomState(1)
+    frame_shape = (1,) + tuple(state_size[1:])
+    history = np.stack([synthetic_frame(rng, frame_shape) for _ in range(seqsize)], axis=1)
+    vel = rng.rand(1, pos_size)
+    assert max_diff(agent, history, vel) < tolerance
+    model = acting_model(agent)
+    model.set_weights([w + rng.normal(0, 0.05, w.shape).astype(w.dtype) for w in model.get_weights()])
+    agent.cache.invalidate()
+    assert max_diff(agent, history, vel) < tolerance
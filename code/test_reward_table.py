@@ -0,0 +1,96 @@
+import itertools
+import numpy as np
+import pytest
+import config
+import airsim_env_tf1
+from airsim_env_tf1 import Env, EXIST_NONE, EXIST_MISS, EXIST_FOUND, FOCUS_NONE, FOCUS_IN, FOCUS_OUT
+
+
+def reward_chain(exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success, out_small_range, done):
+    # Env.compute_reward before the status codes: a per-drone if/elif chain over the string statuses
+    reward = [None] * len(exist_reward)
+    for id in range(len(exist_reward)):
+        exist_status = exist_reward[id]
+        focus_status = focus_reward[id]
+        if done:
+            if sum(success) == airsim_env_tf1.target_num:
+                reward[id] = config.reward['success']
+            else:
+                reward[id] = config.reward['dead']
+        elif exist_status == 'miss':
+            reward[id] = config.reward['miss']
+        elif exist_status == 'found' and focus_status == 'in':
+            reward[id] = config.reward['in']
+        elif exist_status == 'found' and focus_status == 'out':
+            reward[id] = config.reward['out']
+        else:
+            reward[id] = config.reward['none']
+        reward[id] += area_reward[id]
+        if spread_reward == 'near':
+            reward[id] += config.reward['near']
+        if any(dsensor_reward):
+            reward[id] += config.reward['dsensor_close']
+        if out_small_range[id] == True:
+            reward[id] += config.reward['out_small']
+    return reward
+
+
+# the string status each code stands for
+exist_strings = {EXIST_NONE: 'none', EXIST_MISS: 'miss', EXIST_FOUND: 'found'}
+focus_strings = {FOCUS_NONE: 'none', FOCUS_IN: 'in', FOCUS_OUT: 'out'}
+
+
+def status_strings(exist_reward, focus_reward):
+    return [exist_strings[int(code)] for code in exist_reward], [focus_strings[int(code)] for code in focus_reward]
+
+
+@pytest.fixture(scope='module')
+def env():
+    return Env(sim='kinematic', verbose=False)
+
+
+def assert_bitwise_equal(env, exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward, success, out_small_range, done):
+    args = [area_reward, spread_reward, dsensor_reward, success, out_small_range, done]
+    expected = reward_chain(*(list(status_strings(exist_reward, focus_reward)) + args))
+    reward = env.compute_reward(exist_reward, focus_reward, *args)
+    # compare the float64 bit patterns
+    assert np.array_equal(np.asarray(expected, dtype=np.float64).view(np.int64), reward.view(np.int64)), \
+        (exist_reward, focus_reward, args, expected, reward)
+
+
+@pytest.mark.parametrize('num_drone', [1, 2, 3])
+def test_every_status_code(env, num_drone):
+    # every exist / focus code of every drone, with and without the episode ending and each team penalty
+    rng = np.random.RandomState(num_drone)
+    codes = list(itertools.product(exist_strings, focus_strings))
+    for statuses in itertools.product(codes, repeat=num_drone):
+        exist_reward = np.array([exist for exist, _ in statuses], dtype=np.int8)
+        focus_reward = np.array([focus for _, focus in statuses], dtype=np.int8)
+        for done, spread_reward, dsensor in itertools.product([False, True], ['near', 'far'], [False, True]):
+            area_reward = rng.rand(num_drone)
+            dsensor_reward = np.zeros(num_drone, dtype=bool)
+            dsensor_reward[rng.randint(num_drone)] = dsensor
+            success = rng.rand(num_drone) < 0.5
+            out_small_range = rng.rand(num_drone) < 0.5
+            assert_bitwise_equal(env, exist_reward, focus_reward, area_reward, spread_reward, dsensor_reward,
+                                 success, out_small_range, done)
+
+
+def test_success_on_target_num(env):
+    # the success reward only when exactly target_num drones succeeded
+    for num_success in range(4):
+        success = np.arange(3) < num_success
+        for done in [False, True]:
+            assert_bitwise_equal(env, np.full(3, EXIST_FOUND, dtype=np.int8),
+                                 np.full(3, FOCUS_IN, dtype=np.int8), np.zeros(3), 'far',
+                                 np.zeros(3, dtype=bool), success, np.zeros(3, dtype=bool), done)
+
+
+@pytest.mark.parametrize('num_drone', [8, 16, 32])
+def test_large_fleets(env, num_drone):
+    rng = np.random.RandomState(num_drone)
+    for _ in range(200):
+        assert_bitwise_equal(env, rng.choice(list(exist_strings), num_drone).astype(np.int8),
+                             rng.choice(list(focus_strings), num_drone).astype(np.int8), rng.rand(num_drone),
+                             rng.choice(['near', 'far']), rng.rand(num_drone) < 0.1, rng.rand(num_drone) < 0.2,
+                             rng.rand(num_drone) < 0.2, rng.rand() < 0.1)